@@ -0,0 +1,11 @@
+"""Benchmarks of the dashboard aggregations on synthetic Olist data.
+
+Usage: python -m benchmarks --sizes 100k 1M --output benchmarks/results/run.json
+"""
+import os
+import sys
+
+# The dashboard is a Streamlit script directory rather than a package, make its modules importable
+DASHBOARD_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard")
+if DASHBOARD_DIRECTORY not in sys.path:
+    sys.path.insert(0, DASHBOARD_DIRECTORY)
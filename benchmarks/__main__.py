@@ -0,0 +1,3 @@
+from benchmarks.run import main_cli
+
+main_cli()
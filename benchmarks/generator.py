@@ -0,0 +1,185 @@
+"""Seeded generator of synthetic Olist datasets.
+
+Produces the three denormalized datasets read by the dashboard, with the
+schemas of loader.DATASETS, at any number of rows. Cities, product
+categories, products and sellers follow Zipf-like popularity, most customers
+order once while a few repeat, and order volume grows over time, as in the
+public Olist sample.
+"""
+import os
+import numpy as np
+import pandas as pd
+from loader import DATASETS, encode_categorical_columns
+
+FIRST_DAY = np.datetime64("2016-09-04", "s")
+DAYS = 773
+SECONDS_PER_DAY = 86400
+
+CITIES = 4000
+CATEGORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "data", "product_category_name_translation.csv")
+STATES = np.array(["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "DF", "ES", "GO", "PE", "CE", "PA", "MT",
+                   "MA", "MS", "PB", "PI", "RN", "AL", "SE", "TO", "RO", "AM", "AC", "AP", "RR"])
+STATE_WEIGHTS = np.array([41.9, 12.9, 11.7, 5.5, 5.1, 3.7, 3.4, 2.2, 2.0, 2.0, 1.7, 1.3, 1.0, 0.9,
+                          0.7, 0.7, 0.5, 0.5, 0.5, 0.4, 0.3, 0.3, 0.3, 0.1, 0.1, 0.1, 0.1])
+
+ORDER_STATUSES = ["delivered", "shipped", "canceled", "unavailable", "invoiced", "processing", "created", "approved"]
+ORDER_STATUS_WEIGHTS = [97.0, 1.1, 0.63, 0.61, 0.32, 0.3, 0.02, 0.02]
+PAYMENT_TYPES = ["credit_card", "boleto", "voucher", "debit_card", "not_defined"]
+PAYMENT_TYPE_WEIGHTS = [73.9, 19.0, 5.6, 1.5, 0.003]
+REVIEW_SCORE_WEIGHTS = [11.5, 3.2, 8.2, 19.3, 57.8]
+REVIEW_MESSAGES = np.array([
+    "Recebi bem antes do prazo estipulado.",
+    "Parabéns lojas lannister adorei comprar pela Internet seguro e prático",
+    "aparelho eficiente. no site a marca do aparelho esta impresso como 3desinfector",
+    "Mas um pouco ,travando...pelo valor ta Boa.",
+    "Vendedor confiável, produto ok e entrega antes do prazo.",
+    "Não recebi o produto e não tenho retorno do vendedor",
+    "Produto de ótima qualidade, chegou antes do prazo. Recomendo!",
+    "péssimo, veio com defeito e a troca demorou muito"
+])
+REVIEW_TITLES = np.array(["recomendo", "Super recomendo", "Ótimo", "Não recebi", "Muito bom", "Péssimo"])
+
+
+def zipf_weights(size: int, exponent: float = 1.1) -> np.ndarray:
+    """Function: Get normalized Zipf popularity weights for size items"""
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def hex_ids(rng: np.random.Generator, size: int) -> np.ndarray:
+    """Function: Get random 32-character hex identifiers, like the Olist ids"""
+    digits = np.frombuffer(b"0123456789abcdef", dtype="S1")
+    nibbles = rng.integers(0, 16, size=(size, 32), dtype=np.uint8)
+    return digits[nibbles].view("S32").ravel().astype(str)
+
+
+def random_timestamps(rng: np.random.Generator, start: np.ndarray, low_days: float, high_days: float) -> np.ndarray:
+    """Function: Get timestamps a uniform random number of days after start"""
+    offsets = rng.uniform(low_days * SECONDS_PER_DAY, high_days * SECONDS_PER_DAY, size=len(start))
+    return start + offsets.astype("timedelta64[s]")
+
+
+def generate_datasets(rows: int, seed: int = 0) -> dict:
+    """Function: Get the three dashboard datasets with about rows rows in order_customers_payments,
+    sorted, typed and encoded as loader.load_datasets returns them"""
+    rng = np.random.default_rng(seed)
+    orders = max(1, int(rows / 1.04))
+
+    # Orders, with volume growing over time
+    order_ids = hex_ids(rng, orders)
+    purchase = FIRST_DAY + (DAYS * SECONDS_PER_DAY * rng.random(orders) ** 0.6).astype("timedelta64[s]")
+    status = rng.choice(ORDER_STATUSES, size=orders, p=np.array(ORDER_STATUS_WEIGHTS) / sum(ORDER_STATUS_WEIGHTS))
+    approved = random_timestamps(rng, purchase, 0.01, 2)
+    carrier = random_timestamps(rng, approved, 0.5, 6)
+    delivered = random_timestamps(rng, carrier, 1, 25)
+    estimated = (purchase.astype("datetime64[D]") + rng.integers(10, 45, orders)).astype("datetime64[s]")
+    delivered_status = status == "delivered"
+    carrier = np.where(delivered_status | (status == "shipped"), carrier, np.datetime64("NaT"))
+    delivered = np.where(delivered_status, delivered, np.datetime64("NaT"))
+
+    # Customers, most of them order once and a few keep coming back
+    customers = max(1, int(orders * 0.96))
+    customer_index = np.concatenate([
+        np.arange(customers),
+        rng.choice(customers, size=orders - customers, p=zipf_weights(customers, 0.8))
+    ])[rng.permutation(orders)] if orders > customers else rng.permutation(orders)
+    customer_unique_ids = hex_ids(rng, customers)
+    city_index = rng.choice(CITIES, size=customers, p=zipf_weights(CITIES))
+    city_names = np.array(["sao paulo", "rio de janeiro", "belo horizonte", "brasilia", "curitiba", "campinas",
+                           "porto alegre", "salvador", "guarulhos", "sao bernardo do campo"]
+                          + ["cidade {}".format(i) for i in range(10, CITIES)])
+    city_states = np.concatenate([["SP", "RJ", "MG", "DF", "PR", "SP", "RS", "BA", "SP", "SP"],
+                                  rng.choice(STATES, size=CITIES - 10, p=STATE_WEIGHTS / STATE_WEIGHTS.sum())])
+    customer_zip = rng.integers(1000, 99990, size=customers)
+
+    order_df = pd.DataFrame({
+        "order_id": order_ids,
+        "customer_id": hex_ids(rng, orders),
+        "order_status": status,
+        "order_purchase_timestamp": purchase,
+        "order_approved_at": np.where(status == "created", np.datetime64("NaT"), approved),
+        "order_delivered_carrier_date": carrier,
+        "order_delivered_customer_date": delivered,
+        "order_estimated_delivery_date": estimated
+    })
+
+    # Dataset 1: orders x customers x payments
+    payments = rng.choice([1, 2, 3], size=orders, p=[0.96, 0.03, 0.01])
+    payment_rows = np.repeat(np.arange(orders), payments)
+    payment_type = rng.choice(PAYMENT_TYPES, size=len(payment_rows),
+                              p=np.array(PAYMENT_TYPE_WEIGHTS) / sum(PAYMENT_TYPE_WEIGHTS))
+    installments = np.where(payment_type == "credit_card", rng.choice(np.arange(1, 11), size=len(payment_rows),
+                                                                      p=zipf_weights(10, 0.9)), 1)
+    order_customer = customer_index[payment_rows]
+    dataset_1_df = order_df.iloc[payment_rows].reset_index(drop=True)
+    dataset_1_df["customer_unique_id"] = customer_unique_ids[order_customer]
+    dataset_1_df["customer_zip_code_prefix"] = customer_zip[order_customer]
+    dataset_1_df["customer_city"] = city_names[city_index[order_customer]]
+    dataset_1_df["customer_state"] = city_states[city_index[order_customer]]
+    dataset_1_df["payment_sequential"] = pd.Series(payment_rows).groupby(payment_rows).cumcount().to_numpy() + 1
+    dataset_1_df["payment_type"] = payment_type
+    dataset_1_df["payment_installments"] = installments
+    dataset_1_df["payment_value"] = np.round(rng.gamma(2.0, 80.0, size=len(payment_rows)), 2)
+
+    # Dataset 2: orders x items x products x categories
+    category_df = pd.read_csv(CATEGORY_FILE)
+    products = max(10, orders // 3)
+    sellers = max(10, orders // 35)
+    product_ids = hex_ids(rng, products)
+    seller_ids = hex_ids(rng, sellers)
+    product_category = rng.choice(len(category_df), size=products, p=zipf_weights(len(category_df), 1.0))
+    items = rng.choice([1, 2, 3, 4], size=orders, p=[0.88, 0.09, 0.02, 0.01])
+    item_rows = np.repeat(np.arange(orders), items)
+    item_product = rng.choice(products, size=len(item_rows), p=zipf_weights(products, 0.9))
+    dataset_2_df = order_df.iloc[item_rows].reset_index(drop=True)
+    dataset_2_df["order_item_id"] = pd.Series(item_rows).groupby(item_rows).cumcount().to_numpy() + 1
+    dataset_2_df["product_id"] = product_ids[item_product]
+    dataset_2_df["seller_id"] = seller_ids[rng.choice(sellers, size=len(item_rows), p=zipf_weights(sellers, 0.9))]
+    dataset_2_df["shipping_limit_date"] = random_timestamps(rng, purchase[item_rows], 2, 7)
+    dataset_2_df["price"] = np.round(rng.gamma(1.5, 80.0, size=len(item_rows)), 2)
+    dataset_2_df["freight_value"] = np.round(rng.gamma(3.0, 7.0, size=len(item_rows)), 2)
+    dataset_2_df["product_category_name"] = category_df["product_category_name"].to_numpy()[
+        product_category[item_product]]
+    for column, (low, high) in {"product_name_lenght": (5, 76), "product_description_lenght": (4, 3992),
+                                "product_photos_qty": (1, 20), "product_weight_g": (0, 40425),
+                                "product_length_cm": (7, 105), "product_height_cm": (2, 105),
+                                "product_width_cm": (6, 118)}.items():
+        dataset_2_df[column] = rng.integers(low, high, size=products)[item_product]
+    dataset_2_df["product_category_name_english"] = category_df["product_category_name_english"].to_numpy()[
+        product_category[item_product]]
+
+    # Dataset 3: one review for almost every order
+    reviewed = np.flatnonzero(rng.random(orders) < 0.99)
+    review_dates = np.where(delivered_status[reviewed], delivered[reviewed], estimated[reviewed])
+    review_creation = (review_dates.astype("datetime64[D]") + 1).astype("datetime64[s]")
+    has_message = rng.random(len(reviewed)) < 0.41
+    has_title = rng.random(len(reviewed)) < 0.12
+    dataset_3_df = pd.DataFrame({
+        "review_id": hex_ids(rng, len(reviewed)),
+        "order_id": order_ids[reviewed],
+        "review_score": rng.choice(np.arange(1, 6), size=len(reviewed),
+                                   p=np.array(REVIEW_SCORE_WEIGHTS) / sum(REVIEW_SCORE_WEIGHTS)),
+        "review_comment_title": np.where(has_title, rng.choice(REVIEW_TITLES, size=len(reviewed)), None),
+        "review_comment_message": np.where(has_message, rng.choice(REVIEW_MESSAGES, size=len(reviewed)), None),
+        "review_creation_date": review_creation,
+        "review_answer_timestamp": random_timestamps(rng, review_creation, 0.1, 5)
+    })
+
+    datasets = {}
+    for name, dataframe in zip(DATASETS, [dataset_1_df, dataset_2_df, dataset_3_df]):
+        spec = DATASETS[name]
+        for column in spec["datetime_columns"]:
+            dataframe[column] = dataframe[column].astype("datetime64[ns]")
+        dataframe = dataframe.astype(spec["dtypes"])
+        dataframe = dataframe.sort_values(by=spec["sort_column"], kind="stable", ignore_index=True)
+        encode_categorical_columns(dataframe, spec["categorical_columns"])
+        datasets[name] = dataframe
+    return datasets
+
+
+def write_datasets(datasets: dict, directory: str) -> None:
+    """Procedure: Write generated datasets as the CSV files the dashboard reads"""
+    os.makedirs(directory, exist_ok=True)
+    for name, dataframe in datasets.items():
+        dataframe.to_csv(os.path.join(directory, DATASETS[name]["filename"]), index=False)
@@ -0,0 +1,361 @@
+"""Load test of the dashboard with concurrent headless sessions.
+
+Every simulated analyst is a Streamlit AppTest session running dashboard/main.py
+in this process, as the sessions of a Streamlit server share one process, its
+caches and its GIL. Sessions are opened one after another over the ramp-up and
+then repeat until the end of the test: think for a lognormal time, change the
+sidebar timeframe or switch tab, and time the rerun. Timeframes are drawn from
+the months, quarters and years of the data, the few windows analysts look at,
+so later sessions hit the caches filled by earlier ones. A sampler records the
+open sessions, the reruns, the CPU use and the RSS of the process over time.
+
+The report gives the p50/p95/p99 rerun latency overall, per action and per
+tab, with the throughput and the samples, and is saved as JSON next to the
+benchmark results. --compare fails when the p95 latency of an action or a tab
+got slower than --threshold times a previous report, as happens when a cache
+stops being shared across sessions.
+
+AppTest installs and clears the process-wide Streamlit runtime and config
+options around every run, which concurrent sessions would undo for each other,
+and compiles the script again for every run, which isn't thread-safe on every
+Python version. While the load test runs, one runtime and one script cache
+shared by every session are installed instead, as a server does.
+
+Usage: python -m benchmarks.loadtest --sessions 20 --duration 300 [--size 1M]
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import contextlib
+from unittest import mock
+from dataclasses import dataclass, asdict
+import numpy as np
+from streamlit.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+from streamlit.testing.v1.util import patch_config_options
+import loader
+import report
+from benchmarks.generator import generate_datasets, write_datasets
+from benchmarks.run import parse_size
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCRIPT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard", "main.py")
+
+# Seconds a rerun may take before it counts as failed
+RERUN_TIMEOUT = 300
+QUANTILES = [0.5, 0.95, 0.99]
+# Windows of the timeframes chosen by the sessions, see report.create_windows
+TIMEFRAME_PERIODS = ["month", "quarter", "year", "all"]
+
+
+@dataclass
+class Rerun:
+    """One timed rerun of a session"""
+    session: int
+    action: str  # open, timeframe or tab
+    tab: str
+    start_seconds: float  # since the load test started
+    seconds: float
+    error: str | None = None
+
+
+class SharedRuntime:
+    """Stand-in for the Runtime class within streamlit.testing, so that the runtime set by one session
+    is not cleared by another. Every session uses the runtime installed by shared_runtime instead"""
+    _instance = None
+
+
+@contextlib.contextmanager
+def shared_runtime():
+    """Generator: Install one Streamlit runtime, config and script cache for every session of the load test"""
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    script_cache = ScriptCache()
+    with patch_config_options({"global.appTest": True}), \
+            mock.patch.object(app_test, "Runtime", SharedRuntime), \
+            mock.patch.object(app_test, "patch_config_options", lambda overrides: contextlib.nullcontext()), \
+            mock.patch.object(local_script_runner, "ScriptCache", lambda: script_cache), \
+            mock.patch.object(Runtime, "_instance", runtime):
+        yield
+
+
+def rss_bytes() -> int | None:
+    """Function: Get the resident set size of this process. Without /proc it is the peak RSS, and None
+    where neither can be read"""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    # In KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def latency_summary(seconds: list) -> dict:
+    """Function: Get the count, mean, quantiles and maximum of rerun latencies"""
+    if not seconds:
+        return {"count": 0}
+    values = np.asarray(seconds)
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        **{"p{:g}".format(quantile * 100): float(np.quantile(values, quantile)) for quantile in QUANTILES},
+        "max": float(values.max())
+    }
+
+
+class LoadTest:
+    """Sessions of a load test with their reruns and the samples of the process"""
+
+    def __init__(self, sessions: int, duration: float, ramp_up: float, think_time: float, think_sigma: float,
+                 tab_share: float, sample_interval: float, seed: int):
+        self.sessions = sessions
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.think_sigma = think_sigma
+        self.tab_share = tab_share
+        self.sample_interval = sample_interval
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reruns = []
+        self.samples = []
+        self.open_sessions = 0
+        self.start = None
+        self.stop = threading.Event()
+
+    def elapsed(self) -> float:
+        """Function: Get the seconds since the load test started"""
+        return time.perf_counter() - self.start
+
+    def rerun(self, index: int, at: AppTest, action: str) -> bool:
+        """Function: Time a rerun of a session, recording it. False if the session can't go on, its timeframe
+        or tab widgets missing"""
+        start = self.elapsed()
+        error = None
+        try:
+            at.run(timeout=RERUN_TIMEOUT)
+            if at.exception:
+                error = str(at.exception[0].value)
+        except RuntimeError as exception:
+            error = str(exception)
+        seconds = self.elapsed() - start
+        interactive = any(radio.key == "tab" for radio in at.radio) and len(at.sidebar.date_input) > 0
+        if error is None and not interactive:
+            error = "The rerun showed no dashboard"
+        tab = at.session_state["tab"] if "tab" in at.session_state else ""
+        with self.lock:
+            self.reruns.append(Rerun(index, action, tab, start, seconds, error))
+        return interactive
+
+    def run_session(self, index: int) -> None:
+        """Procedure: Open a session, then change its timeframe or tab after every think time until the end"""
+        rng = np.random.default_rng([self.seed, index])
+        self.stop.wait(index * self.ramp_up / self.sessions)
+        if self.stop.is_set():
+            return
+        with self.lock:
+            self.open_sessions += 1
+        try:
+            at = AppTest.from_file(SCRIPT_FILE, default_timeout=RERUN_TIMEOUT)
+            if not self.rerun(index, at, "open"):
+                return
+            tabs = at.radio(key="tab").options
+            first_date, last_date = at.sidebar.date_input[0].value
+            timeframes = report.create_windows(first_date, last_date, TIMEFRAME_PERIODS)
+
+            while not self.stop.wait(rng.lognormal(math.log(self.think_time), self.think_sigma)):
+                if rng.random() < self.tab_share:
+                    action = "tab"
+                    at.radio(key="tab").set_value(tabs[rng.integers(len(tabs))])
+                else:
+                    action = "timeframe"
+                    window = timeframes[rng.integers(len(timeframes))]
+                    at.sidebar.date_input[0].set_value((window.start_date, window.end_date))
+                self.rerun(index, at, action)
+        finally:
+            with self.lock:
+                self.open_sessions -= 1
+
+    def sample(self) -> None:
+        """Procedure: Record the open sessions, reruns, CPU use and RSS of every interval until the end"""
+        last_wall, last_cpu, last_reruns = self.elapsed(), time.process_time(), 0
+        while not self.stop.wait(self.sample_interval):
+            wall, cpu = self.elapsed(), time.process_time()
+            with self.lock:
+                reruns = self.reruns[last_reruns:]
+                last_reruns = len(self.reruns)
+                sessions = self.open_sessions
+            self.samples.append({
+                "seconds": wall,
+                "sessions": sessions,
+                "reruns": len(reruns),
+                "p95": latency_summary([rerun.seconds for rerun in reruns]).get("p95"),
+                "cpu_percent": (cpu - last_cpu) / (wall - last_wall) * 100,
+                "rss_bytes": rss_bytes()
+            })
+            last_wall, last_cpu = wall, cpu
+
+    def run(self) -> float:
+        """Function: Run every session and the sampler for the duration, returning the wall time"""
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=self.run_session, args=(index,), name="session-{}".format(index))
+                   for index in range(self.sessions)]
+        threads.append(threading.Thread(target=self.sample, name="sampler"))
+        with shared_runtime():
+            for thread in threads:
+                thread.start()
+            self.stop.wait(self.duration)
+            self.stop.set()
+            # Reruns in flight are waited for, so that the runtime outlives them
+            for thread in threads:
+                thread.join()
+        return self.elapsed()
+
+
+def summarize(load_test: LoadTest, wall_seconds: float) -> dict:
+    """Function: Get the latency quantiles overall, per action and per tab, the throughput and the RSS"""
+    completed = [rerun for rerun in load_test.reruns if rerun.error is None]
+    # Opening a session reruns the default tab too, tab latencies are those of the interactions
+    interactions = [rerun for rerun in completed if rerun.action != "open"]
+    rss = [sample["rss_bytes"] for sample in load_test.samples if sample["rss_bytes"] is not None]
+    return {
+        "reruns": len(load_test.reruns),
+        "errors": len(load_test.reruns) - len(completed),
+        "wall_seconds": wall_seconds,
+        "throughput_per_second": len(completed) / wall_seconds if wall_seconds else 0.0,
+        "latency": latency_summary([rerun.seconds for rerun in interactions]),
+        "by_action": {action: latency_summary([rerun.seconds for rerun in completed if rerun.action == action])
+                      for action in ["open", "timeframe", "tab"]},
+        "by_tab": {tab: latency_summary([rerun.seconds for rerun in interactions if rerun.tab == tab])
+                   for tab in sorted({rerun.tab for rerun in interactions})},
+        "peak_rss_bytes": max(rss, default=None),
+        "last_rss_bytes": rss[-1] if rss else None
+    }
+
+
+def print_summary(summary: dict) -> None:
+    """Procedure: Print the latency table of a load test summary"""
+    print("{:<40} {:>7} {:>9} {:>9} {:>9}".format("", "reruns", "p50 s", "p95 s", "p99 s"), file=sys.stderr)
+    rows = [("all interactions", summary["latency"])] + \
+        [("action " + action, latency) for action, latency in summary["by_action"].items()] + \
+        [("tab " + tab, latency) for tab, latency in summary["by_tab"].items()]
+    for name, latency in rows:
+        if latency["count"]:
+            print("{:<40} {:>7} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                name, latency["count"], latency["p50"], latency["p95"], latency["p99"]), file=sys.stderr)
+    print("{} reruns, {} errors, {:.2f} reruns/s, peak RSS {}".format(
+        summary["reruns"], summary["errors"], summary["throughput_per_second"],
+        "-" if summary["peak_rss_bytes"] is None else "{:.0f} MiB".format(summary["peak_rss_bytes"] / 2 ** 20)),
+        file=sys.stderr)
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> list:
+    """Function: Get the (group, name, ratio) of every action or tab whose p95 latency is more than threshold
+    times the baseline"""
+    regressions = []
+    for group in ["by_action", "by_tab"]:
+        for name, latency in current["summary"][group].items():
+            previous = baseline["summary"][group].get(name, {})
+            if latency["count"] and previous.get("count") and previous["p95"] > 0:
+                ratio = latency["p95"] / previous["p95"]
+                print("{:<10} {:<40} {:>6.2f}x".format(group, name, ratio), file=sys.stderr)
+                if ratio > threshold:
+                    regressions.append((group, name, ratio))
+    return regressions
+
+
+@contextlib.contextmanager
+def synthetic_data(size: str | None, seed: int):
+    """Generator: Run within a temporary directory holding synthetic datasets of size rows in its data
+    directory, or in the current directory without a size"""
+    if size is None:
+        yield
+        return
+    directory, cwd = tempfile.mkdtemp(prefix="loadtest-"), os.getcwd()
+    try:
+        write_datasets(generate_datasets(parse_size(size), seed), os.path.join(directory, loader.DATA_DIRECTORY))
+        os.chdir(directory)
+        yield
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Load test the dashboard with concurrent headless sessions")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=120, help="seconds of the load test")
+    parser.add_argument("--ramp-up", type=float, default=30, help="seconds over which the sessions are opened")
+    parser.add_argument("--think-time", type=float, default=5, help="median seconds between two interactions")
+    parser.add_argument("--think-sigma", type=float, default=0.8, help="sigma of the lognormal think time")
+    parser.add_argument("--tab-share", type=float, default=0.6,
+                        help="share of the interactions switching tab, the others change the timeframe")
+    parser.add_argument("--sample-interval", type=float, default=1, help="seconds between two samples")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sessions and of the synthetic data")
+    parser.add_argument("--size", default=None,
+                        help="rows of synthetic datasets to test on, e.g. 1M (default: the datasets of ./data)")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous load test to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="exit with an error when a p95 latency is this many times slower than in --compare")
+    args = parser.parse_args()
+
+    load_test = LoadTest(args.sessions, args.duration, args.ramp_up, args.think_time, args.think_sigma,
+                         args.tab_share, args.sample_interval, args.seed)
+    with synthetic_data(args.size, args.seed):
+        wall_seconds = load_test.run()
+
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "settings": {**vars(args), "backend": loader.selected_backend()},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "summary": summarize(load_test, wall_seconds),
+        "samples": load_test.samples,
+        "reruns": [asdict(rerun) for rerun in load_test.reruns]
+    }
+    print_summary(results["summary"])
+    for rerun in load_test.reruns:
+        if rerun.error is not None:
+            print("Session {} {} failed: {}".format(rerun.session, rerun.action, rerun.error), file=sys.stderr)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         "loadtest-{}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to {}".format(output), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare_reports(json.load(file), results, args.threshold)
+        if regressions:
+            sys.exit("Regressions: " + ", ".join("{} {} {:.2f}x".format(*r) for r in regressions))
+
+
+if __name__ == "__main__":
+    main_cli()
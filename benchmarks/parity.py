@@ -0,0 +1,163 @@
+"""Check that the SQL and streaming backends return the same aggregations as the pandas path.
+
+Synthetic datasets are written to Parquet, read by the selected backend, and
+every create_* aggregation is compared with its pandas counterpart in main.py
+over several timeframes. Row order is ignored where the pandas function leaves
+ties in an arbitrary order. The distinct counts estimated from the daily
+sketches are checked against their error bound instead.
+"""
+import os
+import sys
+import argparse
+import datetime
+import tempfile
+from typing import Callable
+import pandas as pd
+import main
+import loader
+import streaming
+import sketch
+import rollup
+import sql_backend
+from timeframe import slice_timeframe
+from benchmarks.generator import generate_datasets
+from benchmarks.run import parse_size
+
+# name -> (pandas function, its dataset, key columns)
+CHECKS = {
+    "monthly_orders_df": (main.create_monthly_orders_df, "order_customers_payments", ["order_month"]),
+    "sum_order_items_df": (main.create_sum_order_items_df, "orders_order_items_products_category",
+                           ["product_category"]),
+    "payment_type_df": (main.create_payment_type_df, "order_customers_payments", ["payment_type"]),
+    "payment_installments_df": (main.create_payment_installments_df, "order_customers_payments",
+                                ["use_installment"]),
+    "customer_order_revenue_city": (main.create_customer_order_revenue_city, "order_customers_payments",
+                                    ["customer_city"]),
+    "customer_order_revenue_state": (main.create_customer_order_revenue_state, "order_customers_payments",
+                                     ["customer_state"]),
+    "customer_order_revenue_zip": (main.create_customer_order_revenue_zip, "order_customers_payments",
+                                   ["customer_zip_code_prefix"]),
+    "customer_scores_df": (main.create_customer_scores_df, "order_reviews", ["review_score"]),
+    "rfm_df": (main.create_rfm_df, "order_customers_payments", ["customer_id"]),
+    "cohort_df": (main.create_cohort_df, "order_customers_payments", ["cohort", "age"])
+}
+
+# Keys of a small count that the sketch parity check allows to share a register with another key
+SKETCH_COLLISIONS = 3
+
+
+def sql_aggregates(connection, start_date: datetime.date, end_date: datetime.date) -> dict:
+    """Function: Get the aggregations of the SQL backend, named as in CHECKS"""
+    return {
+        "monthly_orders_df": sql_backend.create_monthly_orders_df(connection, start_date, end_date),
+        "sum_order_items_df": sql_backend.create_sum_order_items_df(connection, start_date, end_date),
+        "payment_type_df": sql_backend.create_payment_type_df(connection, start_date, end_date),
+        "payment_installments_df": sql_backend.create_payment_installments_df(connection, start_date, end_date),
+        "customer_order_revenue_city": sql_backend.create_customer_order_revenue_df(
+            connection, "customer_city", start_date, end_date),
+        "customer_order_revenue_state": sql_backend.create_customer_order_revenue_df(
+            connection, "customer_state", start_date, end_date),
+        "customer_order_revenue_zip": sql_backend.create_customer_order_revenue_df(
+            connection, "customer_zip_code_prefix", start_date, end_date),
+        "customer_scores_df": sql_backend.create_customer_scores_df(connection, start_date, end_date),
+        "rfm_df": sql_backend.create_rfm_df(connection, start_date, end_date),
+        "cohort_df": sql_backend.create_cohort_df(connection, start_date, end_date)
+    }
+
+
+def sketch_aggregates(datasets: dict) -> Callable:
+    """Function: Get the function returning the aggregations estimated from the daily sketches"""
+    sketches = sketch.build_sketches(datasets["orders_order_items_products_category"])
+    rollups = rollup.build_rollups(datasets["order_customers_payments"],
+                                   datasets["orders_order_items_products_category"], datasets["order_reviews"])
+    return lambda start_date, end_date: {
+        "sum_order_items_df": sketch.create_sum_order_items_df(sketches, rollups, start_date, end_date)
+    }
+
+
+def normalize(dataframe: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Function: Get a dataframe sorted on its keys, with plain object strings and a default index"""
+    dataframe = loader.decode_categorical_columns(dataframe).sort_values(by=keys, ignore_index=True)
+    for column in dataframe.columns:
+        if dataframe[column].dtype == "string":
+            dataframe[column] = dataframe[column].astype(object)
+    return dataframe
+
+
+def timeframes(datasets: dict) -> list:
+    """Function: Get the whole timeframe, a few sub-ranges of it and an empty one"""
+    purchases = datasets["order_customers_payments"]["order_purchase_timestamp"]
+    first, last = purchases.iloc[0].date(), purchases.iloc[-1].date()
+    middle = first + (last - first) / 2
+    return [
+        (first, last),
+        (first, middle),
+        (middle, last),
+        (middle, middle + datetime.timedelta(days=30)),
+        (last + datetime.timedelta(days=1), last + datetime.timedelta(days=2))
+    ]
+
+
+def check_parity(datasets: dict, backend_aggregates, rtol: float = 1e-9, atol: float = 0.0) -> list:
+    """Function: Get the (aggregation, timeframe, error) of every aggregation of a backend that differs
+    from the pandas path by more than atol + rtol times the expected value. backend_aggregates(start_date,
+    end_date) returns the aggregations named as in CHECKS, only those it returns are checked"""
+    failures = []
+    for start_date, end_date in timeframes(datasets):
+        aggregates = backend_aggregates(start_date, end_date)
+        for name, (pandas_function, dataset, keys) in CHECKS.items():
+            if name not in aggregates:
+                continue
+            timeframe_df = slice_timeframe(datasets[dataset], loader.DATASETS[dataset]["sort_column"],
+                                           start_date, end_date)
+            status = "ok"
+            try:
+                expected = normalize(pandas_function(timeframe_df), keys)
+                actual = normalize(aggregates[name], keys)
+                if len(expected) or len(actual):
+                    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, rtol=rtol, atol=atol)
+            except AssertionError as error:
+                failures.append((name, (start_date, end_date), str(error)))
+                status = "FAILED"
+            print("{:<40} {} .. {} {}".format(name, start_date, end_date, status), file=sys.stderr)
+    return failures
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Compare a dashboard backend with the pandas aggregations")
+    parser.add_argument("--backend", choices=["duckdb", "streaming", "sketch"], default="duckdb",
+                        help="backend to check")
+    parser.add_argument("--size", default="100k", help="rows of the synthetic datasets, e.g. 100k or 1M")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data generator")
+    parser.add_argument("--chunk-size", type=int, default=loader.selected_chunk_size(),
+                        help="rows per chunk of the streaming backend")
+    args = parser.parse_args()
+
+    datasets = generate_datasets(parse_size(args.size), args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        files = {}
+        for name, dataframe in datasets.items():
+            files[name] = os.path.join(directory, name + ".parquet")
+            dataframe.to_parquet(files[name], index=False, row_group_size=loader.CACHE_ROW_GROUP_SIZE)
+
+        if args.backend == "duckdb":
+            connection = sql_backend.connect(files)
+            failures = check_parity(datasets, lambda start_date, end_date: sql_aggregates(
+                connection, start_date, end_date))
+        elif args.backend == "sketch":
+            # Estimates are allowed three standard errors, beyond which 0.3% of them fall. Small counts are
+            # exact but for the few keys sharing a register, which a relative error doesn't bound
+            failures = check_parity(datasets, sketch_aggregates(datasets), 3 * sketch.STANDARD_ERROR,
+                                    SKETCH_COLLISIONS)
+        else:
+            failures = check_parity(datasets, lambda start_date, end_date: streaming.stream_aggregates(
+                start_date, end_date, args.chunk_size, files))
+
+    for name, (start_date, end_date), error in failures:
+        print("{} {} .. {}:\n{}".format(name, start_date, end_date, error), file=sys.stderr)
+    if failures:
+        sys.exit("{} aggregations differ between the pandas and {} backends".format(len(failures), args.backend))
+
+
+if __name__ == "__main__":
+    main_cli()
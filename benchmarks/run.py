@@ -0,0 +1,169 @@
+"""Time the dashboard aggregations on synthetic datasets of increasing size.
+
+Every function is timed over several repeats (best wall time is reported) and
+run once more under tracemalloc for its peak memory. Results are written as
+JSON so that runs can be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import tracemalloc
+import numpy as np
+import pandas as pd
+import main
+import scheduler
+from benchmarks.generator import generate_datasets, write_datasets
+
+SIZES = {"100k": 100_000, "1M": 1_000_000, "10M": 10_000_000, "50M": 50_000_000}
+
+# name -> (function, dataset or builder of its input)
+BENCHMARKS = {
+    "create_monthly_orders_df": (main.create_monthly_orders_df, "order_customers_payments"),
+    "create_sum_order_items_df": (main.create_sum_order_items_df, "orders_order_items_products_category"),
+    "create_payment_type_df": (main.create_payment_type_df, "order_customers_payments"),
+    "create_payment_installments_df": (main.create_payment_installments_df, "order_customers_payments"),
+    "create_customer_order_revenue_city": (main.create_customer_order_revenue_city, "order_customers_payments"),
+    "create_customer_order_revenue_state": (main.create_customer_order_revenue_state, "order_customers_payments"),
+    "create_customer_order_revenue_zip": (main.create_customer_order_revenue_zip, "order_customers_payments"),
+    "create_customer_scores_df": (main.create_customer_scores_df, "order_reviews"),
+    "create_satisfied_df": (main.create_satisfied_df,
+                            lambda datasets: main.create_customer_scores_df(datasets["order_reviews"])),
+    "create_rfm_df": (main.create_rfm_df, "order_customers_payments"),
+    "create_cohort_df": (main.create_cohort_df, "order_customers_payments")
+}
+
+
+def parse_size(size: str) -> int:
+    """Function: Get the number of rows of a size such as 100k, 1M or 250000"""
+    if size in SIZES:
+        return SIZES[size]
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(size[-1].lower(), 1)
+    return int(float(size.rstrip("kKmM")) * multiplier)
+
+
+def time_function(function, dataframe: pd.DataFrame, repeats: int) -> dict:
+    """Function: Get the best wall time and the peak traced memory of one function"""
+    wall_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(dataframe)
+        wall_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function(dataframe)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall_seconds": min(wall_times),
+        "median_wall_seconds": float(np.median(wall_times)),
+        "peak_bytes": peak_bytes
+    }
+
+
+def time_refresh(datasets: dict, workers: int) -> dict:
+    """Function: Get the wall time and per-task timings of every aggregation over the whole timeframe,
+    run serially and on the scheduler with workers threads"""
+    purchases = datasets["order_customers_payments"]["order_purchase_timestamp"]
+    start_date, end_date = purchases.iloc[0].date(), purchases.iloc[-1].date()
+    refresh = {"workers": workers}
+    for mode, max_workers in [("serial", 1), ("parallel", workers)]:
+        _, timings = scheduler.run_tasks(main.create_aggregation_tasks(datasets, start_date, end_date), max_workers)
+        refresh[mode] = timings
+    return refresh
+
+
+def run_benchmarks(sizes: list, repeats: int = 3, seed: int = 0, functions: list | None = None,
+                   data_directory: str | None = None, workers: int | None = None) -> dict:
+    """Function: Run the benchmarks for every size, returning the JSON-serializable results.
+    The generated datasets are also written to data_directory/<size> when it is given"""
+    results, refreshes = [], []
+    for size in sizes:
+        rows = parse_size(size)
+        start = time.perf_counter()
+        datasets = generate_datasets(rows, seed)
+        print("Generated {} rows in {:.1f} s".format(rows, time.perf_counter() - start), file=sys.stderr)
+        if data_directory:
+            write_datasets(datasets, os.path.join(data_directory, size))
+
+        for name in functions or BENCHMARKS:
+            function, source = BENCHMARKS[name]
+            dataframe = datasets[source] if isinstance(source, str) else source(datasets)
+            result = {"size": size, "rows": rows, "function": name, "input_rows": len(dataframe),
+                      **time_function(function, dataframe, repeats)}
+            print("{:<40} {:>12,} rows {:>10.4f} s {:>10.1f} MiB".format(
+                name, result["input_rows"], result["wall_seconds"], result["peak_bytes"] / 2 ** 20), file=sys.stderr)
+            results.append(result)
+
+        refresh = {"size": size, "rows": rows, **time_refresh(datasets, workers or os.cpu_count())}
+        slowest = max(timing["seconds"] for timing in refresh["serial"]["tasks"].values())
+        print("Refresh of all aggregations: {:.4f} s serial, {:.4f} s on {} workers, slowest task {:.4f} s".format(
+            refresh["serial"]["wall_seconds"], refresh["parallel"]["wall_seconds"], refresh["workers"], slowest),
+            file=sys.stderr)
+        refreshes.append(refresh)
+        del datasets
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "seed": seed,
+        "repeats": repeats,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__
+        },
+        "results": results,
+        "refresh": refreshes
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list:
+    """Function: Get the (size, function, ratio) of every benchmark slower than threshold times the baseline"""
+    baseline_times = {(r["size"], r["function"]): r["wall_seconds"] for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["size"], result["function"])
+        if key in baseline_times and baseline_times[key] > 0:
+            ratio = result["wall_seconds"] / baseline_times[key]
+            print("{:<6} {:<40} {:>6.2f}x".format(key[0], key[1], ratio), file=sys.stderr)
+            if ratio > threshold:
+                regressions.append((key[0], key[1], ratio))
+    return regressions
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard aggregations on synthetic Olist data")
+    parser.add_argument("--sizes", nargs="+", default=["100k"], help="dataset sizes, e.g. 100k 1M 10M 50M")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per function, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data generator")
+    parser.add_argument("--function", action="append", choices=list(BENCHMARKS), help="only run this function")
+    parser.add_argument("--workers", type=int, default=None, help="threads of the refresh benchmark (default: CPUs)")
+    parser.add_argument("--write-data", default=None, help="also write the generated datasets as CSV to this directory")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="exit with an error when a function is this many times slower than in --compare")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeats, args.seed, args.function, args.write_data, args.workers)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         "benchmark-{}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to {}".format(output), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare_results(json.load(file), results, args.threshold)
+        if regressions:
+            sys.exit("Regressions: " + ", ".join("{} {} {:.2f}x".format(*r) for r in regressions))
@@ -0,0 +1,131 @@
+"""Cached chart rendering.
+
+A chart is a draw function that builds a matplotlib figure from dataframes
+and style arguments. Charts are rendered once to PNG, the figure is always
+closed right after rasterization, and the PNG is kept in a process-wide LRU
+cache keyed by a hash of the draw function, its dataframes and its style, so
+a chart already seen by any session is served without touching matplotlib.
+"""
+import io
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+import streamlit as st
+import matplotlib.pyplot as plt
+from PIL import Image
+import profiling
+
+# Same rasterization options as st.pyplot
+SAVEFIG_OPTIONS = {"bbox_inches": "tight", "dpi": 200, "format": "png"}
+# Streamlit downscales wider images on every display, so they are cached at this width instead
+MAX_IMAGE_WIDTH = 2 * 730
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ChartCache:
+    """Thread-safe LRU cache of rendered charts, bounded by the total size of the images"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rendered_bytes = 0
+        self.render_seconds = 0.0
+
+    def get(self, key: str) -> bytes | None:
+        """Function: Get a cached image, marking it as the most recently used"""
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.images.move_to_end(key)
+            return image
+
+    def put(self, key: str, image: bytes, render_seconds: float) -> None:
+        """Procedure: Cache an image, evicting the least recently used ones beyond max_bytes"""
+        with self.lock:
+            self.rendered_bytes += len(image)
+            self.render_seconds += render_seconds
+            if key in self.images or len(image) > self.max_bytes:
+                return
+            self.images[key] = image
+            self.cached_bytes += len(image)
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.cached_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Function: Get the cache metrics"""
+        with self.lock:
+            return {
+                "entries": len(self.images),
+                "cached_bytes": self.cached_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "rendered_bytes": self.rendered_bytes,
+                "render_seconds": self.render_seconds
+            }
+
+
+CHART_CACHE = ChartCache(CACHE_MAX_BYTES)
+
+
+def chart_key(draw, data: tuple, style: dict) -> str:
+    """Function: Get the hash identifying a chart by its draw function, dataframes and style"""
+    digest = hashlib.sha256()
+    digest.update("{}.{}".format(draw.__module__, draw.__qualname__).encode())
+    for dataframe in data:
+        digest.update(pickle.dumps((list(dataframe.columns), list(dataframe.dtypes.astype(str)))))
+        digest.update(pd.util.hash_pandas_object(dataframe, index=True).to_numpy().tobytes())
+    digest.update(pickle.dumps(sorted(style.items())))
+    return digest.hexdigest()
+
+
+def fit_image_width(image: bytes) -> bytes:
+    """Function: Get a PNG image downscaled to MAX_IMAGE_WIDTH, the same way Streamlit does"""
+    pil_image = Image.open(io.BytesIO(image))
+    width, height = pil_image.size
+    if width <= MAX_IMAGE_WIDTH:
+        return image
+
+    buffer = io.BytesIO()
+    pil_image.resize((MAX_IMAGE_WIDTH, int(1.0 * height * MAX_IMAGE_WIDTH / width)), resample=Image.BILINEAR). \
+        save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_chart(draw, *data: pd.DataFrame, **style) -> bytes:
+    """Function: Get the PNG image of a chart, rendering and caching it if it is not cached yet"""
+    key = chart_key(draw, data, style)
+    image = CHART_CACHE.get(key)
+    if image is not None:
+        return image
+
+    start = time.perf_counter()
+    with profiling.Stage("charts.render:" + draw.__qualname__, profiling.count_rows(data)):
+        fig = draw(*data, **style)
+        try:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, **SAVEFIG_OPTIONS)
+        finally:
+            plt.close(fig)
+        image = fit_image_width(buffer.getvalue())
+
+    CHART_CACHE.put(key, image, time.perf_counter() - start)
+    return image
+
+
+def show_chart(draw, *data: pd.DataFrame, **style) -> None:
+    """Procedure: Show a chart at the width of its container, like st.pyplot"""
+    st.image(render_chart(draw, *data, **style), use_column_width=True, output_format="PNG")
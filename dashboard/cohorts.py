@@ -0,0 +1,110 @@
+"""Monthly customer cohorts and their retention.
+
+A customer belongs to the cohort of the month of their first delivered order
+within the timeframe, and every later order falls in the cell of its cohort and
+its age, the months since that first order. Customers, orders and months are
+integer-coded, so the first month of every customer is one unbuffered minimum
+over the codes and every cell measure is one bincount over the flat cell
+index. The distinct customers of a cell take one sort of integer (customer,
+month) keys, so the cost is O(n log n) in the orders, with no pivot, groupby or
+per-customer loop, and the grid holds cohorts x ages cells whatever the number
+of orders.
+
+The retention of a cell is the share of the customers of its cohort who
+ordered in that month of age, so it is 100% at age 0. Cells past the month
+of the last order have no value.
+"""
+import numpy as np
+import pandas as pd
+import profiling
+
+COLUMNS = ["cohort", "age", "customers", "orders", "revenue", "retention"]
+
+
+def month_numbers(timestamps: pd.Series) -> np.ndarray:
+    """Function: Get the number of months since the epoch of every timestamp"""
+    return timestamps.to_numpy(dtype="datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+
+
+def create_cohort_grid_df(first_month: int, customers: np.ndarray, orders: np.ndarray,
+                          revenue: np.ndarray) -> pd.DataFrame:
+    """Function: Get a dataframe of every (cohort, age) cell of grids shaped (cohorts, ages), cohort 0 being
+    first_month. Cohorts without customers are left out"""
+    cohorts, ages = customers.shape
+    cohort_months = first_month + np.arange(cohorts)
+    sizes = customers[:, 0] if ages else np.zeros(cohorts, dtype=np.int64)
+    # Ages beyond the month of the last order haven't happened yet
+    past = np.arange(ages)[np.newaxis, :] > (cohorts - 1 - np.arange(cohorts))[:, np.newaxis]
+    retention = np.where(past, np.nan, customers / np.where(sizes > 0, sizes, 1)[:, np.newaxis] * 100)
+
+    kept = np.flatnonzero(sizes > 0)
+    return pd.DataFrame({
+        "cohort": np.repeat(cohort_months[kept].astype("datetime64[M]").astype(str), ages),
+        "age": np.tile(np.arange(ages), len(kept)),
+        "customers": customers[kept].ravel(),
+        "orders": orders[kept].ravel(),
+        "revenue": revenue[kept].ravel(),
+        "retention": retention[kept].ravel()
+    }, columns=COLUMNS)
+
+
+def integer_codes(values: pd.Series) -> tuple[np.ndarray, int]:
+    """Function: Get the integer code of every value, with the number of codes. A categorical series uses its
+    own codes, so it isn't hashed again"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64), len(values.cat.categories)
+    codes, uniques = pd.factorize(values)
+    return codes.astype(np.int64), len(uniques)
+
+
+@profiling.profiled
+def create_cohort_df(delivered_df: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the cohort dataframe of the rows of delivered orders (customer_unique_id, order_id,
+    order_purchase_timestamp, payment_value), one or more rows per order"""
+    delivered_df = delivered_df[delivered_df["customer_unique_id"].notna() &
+                                delivered_df["order_purchase_timestamp"].notna()]
+    customer_codes, customers = integer_codes(delivered_df["customer_unique_id"])
+    months = month_numbers(delivered_df["order_purchase_timestamp"])
+    if len(months) == 0:
+        return pd.DataFrame(columns=COLUMNS)
+
+    first_month = int(months.min())
+    months -= first_month
+    cohorts = int(months.max()) + 1
+    customer_cohorts = np.full(customers, cohorts, dtype=np.int64)
+    np.minimum.at(customer_cohorts, customer_codes, months)
+    row_cohorts = customer_cohorts[customer_codes]
+    cells = row_cohorts * cohorts + months - row_cohorts
+
+    # A customer counts once per month: the distinct (customer, month) keys are read off the sorted keys,
+    # a plain integer sort being much faster than hashing them
+    keys = np.sort(customer_codes * cohorts + months)
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    key_customers, key_months = np.divmod(keys, cohorts)
+    key_cohorts = customer_cohorts[key_customers]
+    # An order counts on its first row
+    first_rows = ~delivered_df["order_id"].duplicated().to_numpy()
+    size = cohorts * cohorts
+    return create_cohort_grid_df(
+        first_month,
+        np.bincount(key_cohorts * cohorts + key_months - key_cohorts, minlength=size).reshape(cohorts, cohorts),
+        np.bincount(cells[first_rows], minlength=size).reshape(cohorts, cohorts),
+        np.bincount(cells, weights=delivered_df["payment_value"].fillna(0).to_numpy(),
+                    minlength=size).reshape(cohorts, cohorts)
+    )
+
+
+def create_cohort_cells_df(cells_df: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the cohort dataframe of the non-empty cells aggregated elsewhere, such as by the SQL
+    backend (cohort month number, age, customers, orders, revenue)"""
+    if cells_df.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    cohort_months = cells_df["cohort_month"].to_numpy(dtype=np.int64)
+    first_month = int(cohort_months.min())
+    cohorts = int((cohort_months + cells_df["age"].to_numpy(dtype=np.int64)).max()) - first_month + 1
+    cells = (cohort_months - first_month) * cohorts + cells_df["age"].to_numpy(dtype=np.int64)
+    customers, orders, revenue = (
+        np.bincount(cells, weights=cells_df[column].to_numpy(dtype=np.float64), minlength=cohorts * cohorts).
+        reshape(cohorts, cohorts) for column in ["customers", "orders", "revenue"])
+    return create_cohort_grid_df(first_month, np.rint(customers).astype(np.int64), np.rint(orders).astype(np.int64),
+                                 revenue)
@@ -0,0 +1,250 @@
+"""Daily quantile sketches of the delivery durations.
+
+Every order gets three durations from its timestamps: the approval lag
+(purchase to approval), the carrier handoff (approval to carrier) and the
+delivery time (purchase to customer). Percentiles aren't additive across days
+or states, so each sketch keeps, per day and customer state, a histogram of the
+durations over logarithmic buckets: bucket i holds the durations in
+(GAMMA ** (i - 1), GAMMA ** i] hours. Histograms are merged over a timeframe by
+adding their counts, so a filter change reads the sketch entries of the
+selected days instead of sorting the durations of every order.
+
+A percentile is answered with the midpoint of the bucket holding its rank, so
+it is within RELATIVE_ERROR (1%) of the exact percentile of the durations. The
+durations under MIN_HOURS, including the negative ones of inconsistent
+timestamps, count as 0. Only the buckets a day actually used are stored.
+
+The delivered and late orders are additive and kept in a rollup. An order is
+late when it reached the customer on a later day than estimated.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import rollup
+import profiling
+
+ORDER_COLUMNS = [
+    "order_id", "order_purchase_timestamp", "order_approved_at", "order_delivered_carrier_date",
+    "order_delivered_customer_date", "order_estimated_delivery_date", "customer_state"
+]
+
+# Duration -> (start timestamp, end timestamp, display unit in hours)
+DURATIONS = {
+    "approval_hours": ("order_purchase_timestamp", "order_approved_at", 1),
+    "carrier_days": ("order_approved_at", "order_delivered_carrier_date", 24),
+    "delivery_days": ("order_purchase_timestamp", "order_delivered_customer_date", 24)
+}
+QUANTILES = [0.5, 0.9, 0.99]
+
+RELATIVE_ERROR = 0.01
+GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+# Durations up to a minute count as 0, durations beyond MAX_HOURS as MAX_HOURS
+MIN_HOURS = 1 / 60
+MAX_HOURS = 1000 * 24
+MIN_KEY = int(np.ceil(np.log(MIN_HOURS) / np.log(GAMMA)))
+# Bucket 0 holds the zero durations
+BUCKETS = int(np.ceil(np.log(MAX_HOURS) / np.log(GAMMA))) - MIN_KEY + 1
+
+
+@dataclass
+class DeliverySketch:
+    """Duration histogram counts per day, state and duration, sorted on the day, with the delivered and
+    late orders per day and state"""
+    first_day: int
+    groups: np.ndarray
+    offsets: np.ndarray  # entries of day d are offsets[d]:offsets[d + 1]
+    group_codes: np.ndarray
+    durations: np.ndarray  # position in DURATIONS
+    buckets: np.ndarray
+    counts: np.ndarray
+    orders: rollup.Rollup  # orders, delivered, late
+
+    @property
+    def days(self) -> int:
+        return len(self.offsets) - 1
+
+
+def duration_buckets(hours: np.ndarray) -> np.ndarray:
+    """Function: Get the bucket of every duration in hours"""
+    keys = np.ceil(np.log(np.clip(hours, MIN_HOURS, MAX_HOURS)) / np.log(GAMMA)).astype(np.int64) - MIN_KEY
+    return np.where(hours > MIN_HOURS, np.clip(keys, 1, BUCKETS - 1), 0)
+
+
+def bucket_hours(buckets: np.ndarray) -> np.ndarray:
+    """Function: Get the duration in hours standing for every bucket, the midpoint of its bounds"""
+    return np.where(buckets > 0, 2 * GAMMA ** (buckets + MIN_KEY) / (GAMMA + 1), 0.0)
+
+
+def hours_between(orders_df: pd.DataFrame, start_column: str, end_column: str) -> np.ndarray:
+    """Function: Get the hours from start_column to end_column of every row, NaN if either is missing"""
+    seconds = (orders_df[end_column].to_numpy(dtype="datetime64[ns]") -
+               orders_df[start_column].to_numpy(dtype="datetime64[ns]")) / np.timedelta64(1, "s")
+    return seconds / 3600
+
+
+@profiling.profiled
+def build_delivery_sketch(orders_df: pd.DataFrame, first_rows: np.ndarray | None = None) -> DeliverySketch:
+    """Function: Get the delivery sketch of the order customers payments dataset. first_rows flags the first
+    row of every order to count, by default the first row of every order of orders_df"""
+    if first_rows is None:
+        first_rows = ~orders_df["order_id"].duplicated().to_numpy()
+    orders_df = orders_df[first_rows]
+    days = rollup.day_numbers(orders_df["order_purchase_timestamp"])
+    valid_days = orders_df["order_purchase_timestamp"].notna().to_numpy()
+
+    delivered_days = rollup.day_numbers(orders_df["order_delivered_customer_date"])
+    estimated_days = rollup.day_numbers(orders_df["order_estimated_delivery_date"])
+    delivered = orders_df["order_delivered_customer_date"].notna().to_numpy() & \
+        orders_df["order_estimated_delivery_date"].notna().to_numpy()
+    orders = rollup.build_rollup(days[valid_days], orders_df["customer_state"][valid_days], {
+        "orders": None,
+        "delivered": delivered[valid_days],
+        "late": (delivered & (delivered_days > estimated_days))[valid_days]
+    })
+
+    states = orders_df["customer_state"].to_numpy(dtype=object)[valid_days]
+    valid_groups = orders_df["customer_state"].notna().to_numpy()[valid_days]
+    codes = np.zeros(len(states), dtype=np.int64)
+    codes[valid_groups] = np.searchsorted(orders.groups, states[valid_groups])
+    flat_indexes = []
+    for position, (start_column, end_column, _) in enumerate(DURATIONS.values()):
+        hours = hours_between(orders_df, start_column, end_column)[valid_days]
+        valid = valid_groups & ~np.isnan(hours)
+        flat_indexes.append((((days[valid_days][valid] - orders.first_day) * len(orders.groups) + codes[valid]) *
+                             len(DURATIONS) + position) * BUCKETS + duration_buckets(hours[valid]))
+
+    flat_index, counts = np.unique(np.concatenate(flat_indexes), return_counts=True)
+    day_group_duration, buckets = np.divmod(flat_index, BUCKETS)
+    day_group, durations = np.divmod(day_group_duration, len(DURATIONS))
+    entry_days, group_codes = np.divmod(day_group, max(len(orders.groups), 1))
+    return DeliverySketch(
+        first_day=orders.first_day,
+        groups=orders.groups,
+        offsets=np.searchsorted(entry_days, np.arange(orders.days + 1)),
+        group_codes=group_codes.astype(np.int32),
+        durations=durations.astype(np.int8),
+        buckets=buckets.astype(np.int16),
+        counts=counts.astype(np.int64),
+        orders=orders
+    )
+
+
+def add_delivery_sketches(left: DeliverySketch, right: DeliverySketch) -> DeliverySketch:
+    """Function: Get the delivery sketch of the orders of two sketches, such as a sketch and the sketch of a
+    delta. Buckets counted by both are kept twice, the histograms add them up"""
+    if len(right.counts) == 0 and right.orders.days == 0:
+        return left
+    if len(left.counts) == 0 and left.orders.days == 0:
+        return right
+
+    orders = rollup.add_rollups(left.orders, right.orders)
+    entry_days, group_codes = [], []
+    for part in (left, right):
+        entry_days.append(np.repeat(np.arange(part.days), np.diff(part.offsets)) + part.first_day - orders.first_day)
+        group_codes.append(np.searchsorted(orders.groups, part.groups)[part.group_codes])
+    entry_days, group_codes = np.concatenate(entry_days), np.concatenate(group_codes)
+    durations = np.concatenate([left.durations, right.durations])
+    buckets, counts = np.concatenate([left.buckets, right.buckets]), np.concatenate([left.counts, right.counts])
+
+    # A delta of later days is appended as it is, an older one is merged into place
+    if right.first_day < left.first_day + left.days:
+        order = np.argsort(entry_days, kind="stable")
+        entry_days, group_codes, durations = entry_days[order], group_codes[order], durations[order]
+        buckets, counts = buckets[order], counts[order]
+
+    return DeliverySketch(
+        first_day=orders.first_day,
+        groups=orders.groups,
+        offsets=np.searchsorted(entry_days, np.arange(orders.days + 1)),
+        group_codes=group_codes.astype(np.int32),
+        durations=durations,
+        buckets=buckets,
+        counts=counts,
+        orders=orders
+    )
+
+
+def histogram_quantiles(histograms: np.ndarray) -> np.ndarray:
+    """Function: Get the QUANTILES in hours of every histogram of the last axis, NaN for empty histograms"""
+    cumulative = histograms.cumsum(axis=-1)
+    totals = cumulative[..., -1:]
+    result = np.full(histograms.shape[:-1] + (len(QUANTILES),), np.nan)
+    for i, quantile in enumerate(QUANTILES):
+        # The quantile is the value of rank floor(quantile * (n - 1)), counting from 0
+        ranks = np.floor(quantile * (totals - 1))
+        buckets = (cumulative > ranks).argmax(axis=-1)
+        result[..., i] = np.where(totals[..., 0] > 0, bucket_hours(buckets), np.nan)
+    return result
+
+
+def create_quantiles_df(histograms: np.ndarray, orders: np.ndarray, index: pd.Index) -> pd.DataFrame:
+    """Function: Get a dataframe of the orders, late rate and duration quantiles of every row of index from their
+    histograms, shaped (rows, durations, buckets), and their orders, delivered and late counts"""
+    quantiles = histogram_quantiles(histograms)
+    result_df = pd.DataFrame({
+        "orders": orders[:, 0],
+        "delivered": orders[:, 1],
+        "late_rate": orders[:, 2] / np.where(orders[:, 1] > 0, orders[:, 1], np.nan) * 100
+    }, index=index)
+    for i, (duration, (_, _, unit)) in enumerate(DURATIONS.items()):
+        for j, quantile in enumerate(QUANTILES):
+            result_df["{}_p{:g}".format(duration, quantile * 100)] = quantiles[:, i, j] / unit
+    return result_df
+
+
+def timeframe_entries(delivery_sketch: DeliverySketch, start_date: datetime.date,
+                      end_date: datetime.date) -> tuple[slice, int, int]:
+    """Function: Get the entries and the days of the sketch within the timeframe"""
+    start, end = rollup.day_range(delivery_sketch.orders, start_date, end_date)
+    return slice(delivery_sketch.offsets[start], delivery_sketch.offsets[end]), start, end
+
+
+def create_state_delivery_df(delivery_sketch: DeliverySketch, start_date: datetime.date,
+                             end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the orders, late rate and duration quantiles of every customer state with
+    orders over the timeframe, and of all of them as the last row, labelled All"""
+    entries, start, end = timeframe_entries(delivery_sketch, start_date, end_date)
+    groups = len(delivery_sketch.groups)
+    flat_index = (delivery_sketch.group_codes[entries].astype(np.int64) * len(DURATIONS) +
+                  delivery_sketch.durations[entries]) * BUCKETS + delivery_sketch.buckets[entries]
+    histograms = np.bincount(flat_index, weights=delivery_sketch.counts[entries],
+                             minlength=groups * len(DURATIONS) * BUCKETS).reshape(groups, len(DURATIONS), BUCKETS)
+    orders = delivery_sketch.orders.prefix[end] - delivery_sketch.orders.prefix[start]
+
+    active = orders[:, 0] > 0
+    histograms = np.concatenate([histograms[active], histograms.sum(axis=0, keepdims=True)])
+    orders = np.concatenate([orders[active], orders.sum(axis=0, keepdims=True)])
+    index = pd.Index(list(delivery_sketch.groups[active]) + ["All"], name="customer_state")
+    return create_quantiles_df(histograms, orders, index).reset_index()
+
+
+def create_monthly_delivery_df(delivery_sketch: DeliverySketch, start_date: datetime.date, end_date: datetime.date,
+                               state: str | None = None) -> pd.DataFrame:
+    """Function: Get a dataframe of the orders, late rate and duration quantiles of every month of the
+    timeframe, for the orders of one customer state or of all of them"""
+    entries, start, end = timeframe_entries(delivery_sketch, start_date, end_date)
+    groups = slice(None)
+    selected = slice(None)
+    if state is not None:
+        code = int(np.searchsorted(delivery_sketch.groups, state))
+        if code == len(delivery_sketch.groups) or delivery_sketch.groups[code] != state:
+            # A state without orders has no months
+            entries, start, end = slice(0, 0), start, start
+        groups = slice(code, code + 1)
+        selected = delivery_sketch.group_codes[entries] == code
+
+    month_days = np.arange(start, end) + delivery_sketch.first_day
+    months, month_codes = np.unique(month_days.astype("datetime64[D]").astype("datetime64[M]"), return_inverse=True)
+    entry_months = np.repeat(month_codes, np.diff(delivery_sketch.offsets[start:end + 1]))[selected]
+    flat_index = (entry_months * len(DURATIONS) + delivery_sketch.durations[entries][selected]) * BUCKETS + \
+        delivery_sketch.buckets[entries][selected]
+    histograms = np.bincount(flat_index, weights=delivery_sketch.counts[entries][selected],
+                             minlength=len(months) * BUCKETS * len(DURATIONS))
+    histograms = histograms.reshape(len(months), len(DURATIONS), BUCKETS)
+
+    # The orders of a month are the difference of the prefix rows of its first day and of the next month
+    bounds = np.r_[start + np.flatnonzero(np.r_[True, month_codes[1:] != month_codes[:-1]]), end]
+    prefix = delivery_sketch.orders.prefix[bounds][:, groups].sum(axis=1)
+    index = pd.Index(pd.DatetimeIndex(months).strftime("%Y-%m"), name="order_month")
+    return create_quantiles_df(histograms, np.diff(prefix, axis=0), index).reset_index()
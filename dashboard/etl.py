@@ -0,0 +1,378 @@
+"""Build the denormalized dashboard datasets from the raw Olist tables.
+
+This reproduces the joins and cleaning steps of notebook.ipynb as a
+command-line pipeline. The large tables are read in chunks and hash
+partitioned on their join key, so every join only holds one partition in
+memory (a grace hash join). The small dimension tables (products and
+product categories) are joined in memory. Outputs are written as Parquet
+next to the raw CSVs, where they are picked up by loader.py, and a stage is
+skipped when none of its inputs changed since its last run.
+
+Usage: python dashboard/etl.py [--data-dir data] [--partitions 16] [--chunk-size 100000] [--force]
+"""
+import os
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import geo
+from loader import (
+    DATASETS, ORDER_DTYPES, ORDER_DATETIME_COLUMNS, set_datetime_columns, source_fingerprint, is_source_unchanged,
+    write_partitions
+)
+
+# Bump whenever the transformations change so every stage is rebuilt
+ETL_VERSION = 1
+MANIFEST_FILENAME = "etl_manifest.json"
+
+logger = logging.getLogger(__name__)
+
+RAW_TABLES = {
+    "orders": {
+        "filename": "orders_dataset.csv",
+        "dtypes": ORDER_DTYPES,
+        "datetime_columns": ORDER_DATETIME_COLUMNS
+    },
+    "customers": {
+        "filename": "customers_dataset.csv",
+        "dtypes": {
+            "customer_id": "string",
+            "customer_unique_id": "string",
+            "customer_zip_code_prefix": "Int32",
+            "customer_city": "string",
+            "customer_state": "string"
+        },
+        "datetime_columns": []
+    },
+    "order_payments": {
+        "filename": "order_payments_dataset.csv",
+        "dtypes": {
+            "order_id": "string",
+            "payment_sequential": "float64",
+            "payment_type": "string",
+            "payment_installments": "float64",
+            "payment_value": "float64"
+        },
+        "datetime_columns": []
+    },
+    "order_items": {
+        "filename": "order_items_dataset.csv",
+        "dtypes": {
+            "order_id": "string",
+            "order_item_id": "float64",
+            "product_id": "string",
+            "seller_id": "string",
+            "price": "float64",
+            "freight_value": "float64"
+        },
+        "datetime_columns": ["shipping_limit_date"]
+    },
+    "order_reviews": {
+        "filename": "order_reviews_dataset.csv",
+        "dtypes": DATASETS["order_reviews"]["dtypes"],
+        "datetime_columns": DATASETS["order_reviews"]["datetime_columns"]
+    },
+    "products": {
+        "filename": "products_dataset.csv",
+        "dtypes": {
+            column: dtype for column, dtype in DATASETS["orders_order_items_products_category"]["dtypes"].items()
+            if column.startswith("product_") and column != "product_category_name_english"
+        },
+        "datetime_columns": []
+    },
+    "product_category": {
+        "filename": "product_category_name_translation.csv",
+        "dtypes": {
+            "product_category_name": "string",
+            "product_category_name_english": "string"
+        },
+        "datetime_columns": []
+    },
+    "geolocation": {
+        "filename": geo.GEOLOCATION_FILENAME,
+        "dtypes": geo.GEOLOCATION_DTYPES,
+        "datetime_columns": []
+    }
+}
+
+# Categories found in products_dataset.csv but missing from the translation table,
+# translated once in the notebook so that the pipeline does not need a translation service
+MISSING_CATEGORY_TRANSLATIONS = {
+    "portateis_cozinha_e_preparadores_de_alimentos": "portable_kitchen_and_food_preparators",
+    "pc_gamer": "pc_gamer"
+}
+
+PRODUCT_NUMERIC_COLUMNS = [
+    "product_name_lenght",
+    "product_description_lenght",
+    "product_photos_qty",
+    "product_weight_g",
+    "product_length_cm",
+    "product_height_cm",
+    "product_width_cm"
+]
+
+
+def read_raw_table(data_directory: str, table: str) -> pd.DataFrame:
+    """Function: Read a whole raw table with its explicit schema"""
+    spec = RAW_TABLES[table]
+    dataframe = pd.read_csv(os.path.join(data_directory, spec["filename"]), dtype=spec["dtypes"])
+    set_datetime_columns(dataframe, spec["datetime_columns"])
+    return dataframe
+
+
+def iter_raw_table(data_directory: str, table: str, chunk_size: int):
+    """Generator: Read a raw table with its explicit schema, chunk_size rows at a time"""
+    spec = RAW_TABLES[table]
+    with pd.read_csv(os.path.join(data_directory, spec["filename"]), dtype=spec["dtypes"],
+                     chunksize=chunk_size) as reader:
+        for chunk in reader:
+            set_datetime_columns(chunk, spec["datetime_columns"])
+            yield chunk
+
+
+def clean_products(products_df: pd.DataFrame, product_category_df: pd.DataFrame) -> tuple:
+    """Function: Impute missing product data and complete the category translations, as done in the notebook"""
+    products_df = products_df.copy()
+    for column in PRODUCT_NUMERIC_COLUMNS:
+        products_df[column] = products_df[column].fillna(value=np.round(products_df[column].mean(), decimals=0))
+
+    most_category = products_df.groupby(by="product_category_name"). \
+        agg({"product_id": "nunique"}).sort_values(by="product_id", ascending=False).iloc[0].name
+    products_df["product_category_name"] = products_df["product_category_name"].fillna(value=most_category)
+
+    new_category = sorted(set(products_df["product_category_name"].unique())
+                          - set(product_category_df["product_category_name"].unique()))
+    product_category_df = pd.concat([product_category_df, pd.DataFrame({
+        "product_category_name": new_category,
+        "product_category_name_english": [MISSING_CATEGORY_TRANSLATIONS.get(category, category)
+                                          for category in new_category]
+    }).astype(RAW_TABLES["product_category"]["dtypes"])], ignore_index=True)
+
+    return products_df, product_category_df
+
+
+class ParquetOutput:
+    """Incrementally written Parquet file that only replaces its target once it is complete"""
+
+    def __init__(self, path: str, dtypes: dict | None = None):
+        self.path = path
+        self.dtypes = dtypes
+        self.writer = None
+        self.schema = None
+
+    def write(self, dataframe: pd.DataFrame) -> None:
+        """Procedure: Append a dataframe to the output"""
+        if self.dtypes is not None:
+            dataframe = dataframe.astype(self.dtypes)
+        if self.writer is None:
+            self.schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.path + ".tmp", self.schema)
+        self.writer.write_table(pa.Table.from_pandas(dataframe, schema=self.schema, preserve_index=False))
+
+    def close(self) -> None:
+        """Procedure: Finish the output and move it into place"""
+        if self.writer is None:
+            raise ValueError("No rows were written to {}".format(self.path))
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def build_order_customers_payments(data_directory: str, work_directory: str, output_file: str,
+                                   partitions: int, chunk_size: int) -> None:
+    """Procedure: Join orders, customers and order payments into order_customers_payments_dataset"""
+    orders_parts = write_partitions(iter_raw_table(data_directory, "orders", chunk_size), "customer_id",
+                                    partitions, os.path.join(work_directory, "orders_by_customer"))
+    customers_parts = write_partitions(iter_raw_table(data_directory, "customers", chunk_size), "customer_id",
+                                       partitions, os.path.join(work_directory, "customers"))
+    # Each orders_customers partition is repartitioned on order_id for the payments join
+    orders_customers_parts = write_partitions(
+        (pd.merge(left=pd.read_parquet(orders_path), right=pd.read_parquet(customers_path), how="left",
+                  left_on="customer_id", right_on="customer_id")
+         for orders_path, customers_path in zip(orders_parts, customers_parts)),
+        "order_id", partitions, os.path.join(work_directory, "orders_customers")
+    )
+    payments_parts = write_partitions(iter_raw_table(data_directory, "order_payments", chunk_size), "order_id",
+                                      partitions, os.path.join(work_directory, "order_payments"))
+
+    output = ParquetOutput(output_file, DATASETS["order_customers_payments"]["dtypes"])
+    for orders_customers_path, payments_path in zip(orders_customers_parts, payments_parts):
+        output.write(pd.merge(left=pd.read_parquet(orders_customers_path), right=pd.read_parquet(payments_path),
+                              how="left", left_on="order_id", right_on="order_id"))
+    output.close()
+
+
+def build_orders_order_items_products_category(data_directory: str, work_directory: str, output_file: str,
+                                               partitions: int, chunk_size: int) -> None:
+    """Procedure: Join orders, order items, products and product categories into
+    orders_order_items_products_category_dataset"""
+    products_df, product_category_df = clean_products(read_raw_table(data_directory, "products"),
+                                                      read_raw_table(data_directory, "product_category"))
+    orders_parts = write_partitions(iter_raw_table(data_directory, "orders", chunk_size), "order_id",
+                                    partitions, os.path.join(work_directory, "orders_by_order"))
+    items_parts = write_partitions(iter_raw_table(data_directory, "order_items", chunk_size), "order_id",
+                                   partitions, os.path.join(work_directory, "order_items"))
+
+    output = ParquetOutput(output_file, DATASETS["orders_order_items_products_category"]["dtypes"])
+    for orders_path, items_path in zip(orders_parts, items_parts):
+        orders_order_items_df = pd.merge(left=pd.read_parquet(orders_path), right=pd.read_parquet(items_path),
+                                         how="left", left_on="order_id", right_on="order_id")
+        orders_order_items_products_df = pd.merge(left=orders_order_items_df, right=products_df, how="left",
+                                                  left_on="product_id", right_on="product_id")
+        output.write(pd.merge(left=orders_order_items_products_df, right=product_category_df, how="left",
+                              left_on="product_category_name", right_on="product_category_name"))
+    output.close()
+
+
+def build_order_reviews(data_directory: str, work_directory: str, output_file: str,
+                        partitions: int, chunk_size: int) -> None:
+    """Procedure: Convert the order reviews to Parquet"""
+    output = ParquetOutput(output_file)
+    for chunk in iter_raw_table(data_directory, "order_reviews", chunk_size):
+        output.write(chunk)
+    output.close()
+
+
+def build_geolocation(data_directory: str, work_directory: str, output_file: str,
+                      partitions: int, chunk_size: int) -> None:
+    """Procedure: Remove duplicate geolocation rows, see geo.py"""
+    output = ParquetOutput(output_file)
+    for geolocation_df in geo.iter_unique_geolocation(iter_raw_table(data_directory, "geolocation", chunk_size),
+                                                      os.path.join(work_directory, "geolocation"), partitions):
+        output.write(geolocation_df)
+    output.close()
+
+
+def build_zip_centroids(data_directory: str, work_directory: str, output_file: str,
+                        partitions: int, chunk_size: int) -> None:
+    """Procedure: Fold the deduplicated geolocation points written by the geolocation stage into the centroid
+    of every zip code prefix, see geo.py"""
+    geolocation_file = os.path.join(os.path.dirname(output_file), STAGES["geolocation"]["output"])
+    batches = pq.ParquetFile(geolocation_file).iter_batches(batch_size=chunk_size, columns=geo.POINT_COLUMNS)
+    sums = geo.sum_geolocation(batch.to_pandas() for batch in batches)
+    output = ParquetOutput(output_file)
+    output.write(geo.create_centroids_df(sums))
+    output.close()
+
+
+STAGES = {
+    "order_customers_payments": {
+        "inputs": ["orders", "customers", "order_payments"],
+        "output": "order_customers_payments_dataset.parquet",
+        "build": build_order_customers_payments
+    },
+    "orders_order_items_products_category": {
+        "inputs": ["orders", "order_items", "products", "product_category"],
+        "output": "orders_order_items_products_category_dataset.parquet",
+        "build": build_orders_order_items_products_category
+    },
+    "order_reviews": {
+        "inputs": ["order_reviews"],
+        "output": "order_reviews_dataset.parquet",
+        "build": build_order_reviews
+    },
+    "geolocation": {
+        "inputs": ["geolocation"],
+        "output": "geolocation_dataset.parquet",
+        "build": build_geolocation
+    },
+    "zip_centroids": {
+        "inputs": [],
+        # Stages whose outputs are read as inputs, run first when they are out of date
+        "stages": ["geolocation"],
+        "output": geo.CENTROIDS_FILENAME,
+        "build": build_zip_centroids
+    }
+}
+
+
+def read_manifest(manifest_file: str) -> dict:
+    """Function: Get the recorded input fingerprints of every stage"""
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest_file: str, manifest: dict) -> None:
+    """Procedure: Atomically write the recorded input fingerprints of every stage"""
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def is_stage_up_to_date(record: dict | None, input_files: list, output_file: str) -> bool:
+    """Function: Check whether a stage output exists and none of its inputs changed"""
+    if record is None or record.get("version") != ETL_VERSION or not os.path.exists(output_file):
+        return False
+    if sorted(record["inputs"]) != sorted(input_files):
+        return False
+    return all(is_source_unchanged(path, record["inputs"][path]) for path in input_files)
+
+
+def run_pipeline(data_directory: str, output_directory: str, partitions: int = 16, chunk_size: int = 100_000,
+                 stages: list | None = None, force: bool = False) -> dict:
+    """Function: Run the selected stages, returning whether each stage was built or skipped"""
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_file = os.path.join(output_directory, MANIFEST_FILENAME)
+    manifest = read_manifest(manifest_file)
+    results = {}
+
+    selected = set(stages or STAGES)
+    selected.update(*(STAGES[name].get("stages", []) for name in list(selected)))
+    for name in (name for name in STAGES if name in selected):
+        stage = STAGES[name]
+        input_files = [os.path.join(data_directory, RAW_TABLES[table]["filename"]) for table in stage["inputs"]] + \
+            [os.path.join(output_directory, STAGES[other]["output"]) for other in stage.get("stages", [])]
+        output_file = os.path.join(output_directory, stage["output"])
+
+        if not force and is_stage_up_to_date(manifest.get(name), input_files, output_file):
+            logger.info("Skipping %s, its inputs did not change", name)
+            results[name] = "skipped"
+            continue
+
+        logger.info("Building %s", name)
+        work_directory = tempfile.mkdtemp(prefix="etl-" + name + "-", dir=output_directory)
+        try:
+            stage["build"](data_directory, work_directory, output_file, partitions, chunk_size)
+        finally:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+        manifest[name] = {
+            "version": ETL_VERSION,
+            "inputs": {path: source_fingerprint(path) for path in input_files}
+        }
+        write_manifest(manifest_file, manifest)
+        results[name] = "built"
+
+    # Fingerprints refreshed by a touched but unchanged input are kept for the next run
+    write_manifest(manifest_file, manifest)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the denormalized dashboard datasets from the raw Olist tables")
+    parser.add_argument("--data-dir", default="data", help="directory containing the raw *_dataset.csv files")
+    parser.add_argument("--output-dir", default=None, help="directory for the Parquet outputs (default: --data-dir)")
+    parser.add_argument("--partitions", type=int, default=16,
+                        help="number of hash partitions, raise it when one partition does not fit in memory")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="number of CSV rows read at a time")
+    parser.add_argument("--stage", action="append", choices=list(STAGES), help="only run this stage (repeatable)")
+    parser.add_argument("--force", action="store_true", help="rebuild the stages even if their inputs did not change")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    results = run_pipeline(args.data_dir, args.output_dir or args.data_dir, args.partitions, args.chunk_size,
+                           args.stage, args.force)
+    for name, result in results.items():
+        print("{:<40} {}".format(name, result))
+
+
+if __name__ == '__main__':
+    main()
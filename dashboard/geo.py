@@ -0,0 +1,181 @@
+"""Zip code prefix centroids and spatial bins of the orders map.
+
+The geolocation dataset has about a million points, many of them duplicates,
+for some 19k five-digit zip code prefixes. Duplicate rows are dropped first, as
+in the notebook, so that a point repeated many times doesn't pull its centroid
+towards it: the rows are hash partitioned on the zip code prefix, which
+duplicates share, and each partition is deduplicated on its own. The distinct
+points are then folded into the centroid of every prefix: the points of a
+partition are summed into dense arrays indexed by the prefix, without a sort or
+a merge. Points outside Brazil are left out. The centroids are stored as a small
+Parquet file, by etl.py next to the datasets or else in the loader cache, and
+loaded into dense arrays so that a zip prefix is joined to its centroid by
+indexing, not by a merge.
+
+The map aggregates orders and revenue into square bins of BIN_DEGREES by
+bincount over the bin index of every row, so a timeframe change costs one pass
+over the rows of the timeframe.
+"""
+import os
+import logging
+import tempfile
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import loader
+import profiling
+
+GEOLOCATION_FILENAME = "geolocation_dataset.csv"
+CENTROIDS_FILENAME = "zip_centroids.parquet"
+GEOLOCATION_DTYPES = {
+    "geolocation_zip_code_prefix": "Int32",
+    "geolocation_lat": "float64",
+    "geolocation_lng": "float64",
+    "geolocation_city": "string",
+    "geolocation_state": "string"
+}
+POINT_COLUMNS = ["geolocation_zip_code_prefix", "geolocation_lat", "geolocation_lng"]
+
+# Hash partitions of the geolocation dataset deduplicated one at a time when the centroids are cached
+PARTITIONS = 16
+
+# Zip code prefixes have five digits
+ZIP_PREFIXES = 100_000
+
+# (south, north, west, east) bounds of Brazil, in degrees
+BOUNDS = (-34.0, 5.5, -74.5, -34.5)
+BIN_DEGREES = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Centroids:
+    """Latitude and longitude of every zip code prefix, NaN if it has no located point"""
+    lat: np.ndarray
+    lng: np.ndarray
+
+
+def sum_geolocation(chunks) -> np.ndarray:
+    """Function: Get the sums of the latitudes and longitudes, and the number of points, of every zip code
+    prefix, shaped (3, ZIP_PREFIXES), over chunks of the geolocation dataset"""
+    sums = np.zeros((3, ZIP_PREFIXES))
+    south, north, west, east = BOUNDS
+    for chunk in chunks:
+        prefixes = chunk["geolocation_zip_code_prefix"].to_numpy(dtype=np.int64, na_value=-1)
+        lat = chunk["geolocation_lat"].to_numpy(dtype=np.float64, na_value=np.nan)
+        lng = chunk["geolocation_lng"].to_numpy(dtype=np.float64, na_value=np.nan)
+        located = (prefixes >= 0) & (prefixes < ZIP_PREFIXES) & (lat >= south) & (lat <= north) & \
+            (lng >= west) & (lng <= east)
+        prefixes = prefixes[located]
+        sums[0] += np.bincount(prefixes, weights=lat[located], minlength=ZIP_PREFIXES)
+        sums[1] += np.bincount(prefixes, weights=lng[located], minlength=ZIP_PREFIXES)
+        sums[2] += np.bincount(prefixes, minlength=ZIP_PREFIXES)
+    return sums
+
+
+def create_centroids_df(sums: np.ndarray) -> pd.DataFrame:
+    """Function: Get a dataframe of the centroid and the number of points of every located zip code prefix"""
+    prefixes = np.flatnonzero(sums[2])
+    return pd.DataFrame({
+        "zip_code_prefix": prefixes.astype(np.int32),
+        "lat": sums[0, prefixes] / sums[2, prefixes],
+        "lng": sums[1, prefixes] / sums[2, prefixes],
+        "points": sums[2, prefixes].astype(np.int32)
+    })
+
+
+def iter_geolocation(path: str, chunk_size: int = 100_000):
+    """Generator: Read the geolocation dataset chunk_size rows at a time"""
+    with pd.read_csv(path, usecols=list(GEOLOCATION_DTYPES), dtype=GEOLOCATION_DTYPES,
+                     chunksize=chunk_size) as reader:
+        yield from reader
+
+
+def iter_unique_geolocation(chunks, directory: str, partitions: int = PARTITIONS):
+    """Generator: Get the distinct rows of chunks of the geolocation dataset one hash partition at a time,
+    the partitions being written to directory. Duplicates share a zip code prefix, so they always land in the
+    same partition"""
+    for path in loader.write_partitions(chunks, "geolocation_zip_code_prefix", partitions, directory):
+        yield pd.read_parquet(path).drop_duplicates()
+
+
+def centroids_file() -> str | None:
+    """Function: Get the centroids file, the output of etl.py if there is one, else the cache built from the
+    geolocation dataset when it changed. None without a geolocation dataset"""
+    etl_file = loader.data_path(CENTROIDS_FILENAME)
+    if os.path.exists(etl_file):
+        return etl_file
+
+    source_file = loader.data_path(GEOLOCATION_FILENAME)
+    parquet_file = loader.cache_path(CENTROIDS_FILENAME)
+    meta_file = loader.cache_path(os.path.splitext(CENTROIDS_FILENAME)[0] + ".json")
+    if os.path.exists(parquet_file) and loader.is_cache_fresh(source_file, meta_file):
+        return parquet_file
+    if not os.path.exists(source_file):
+        return None
+
+    os.makedirs(loader.CACHE_DIRECTORY, exist_ok=True)
+    with profiling.Stage("geo.build_centroids") as stage, tempfile.TemporaryDirectory(
+            dir=loader.CACHE_DIRECTORY) as directory:
+        centroids_df = create_centroids_df(sum_geolocation(iter_unique_geolocation(iter_geolocation(source_file),
+                                                                                   directory)))
+        stage.rows_out = len(centroids_df)
+    centroids_df.to_parquet(parquet_file + ".tmp", index=False)
+    os.replace(parquet_file + ".tmp", parquet_file)
+    loader.write_cache_meta(meta_file, {
+        "version": loader.CACHE_VERSION,
+        "source": source_file,
+        **loader.source_fingerprint(source_file)
+    })
+    logger.info("Built %d zip code prefix centroids from %s", len(centroids_df), source_file)
+    return parquet_file
+
+
+def load_centroids() -> Centroids:
+    """Function: Get the centroids of every zip code prefix, none located without a geolocation dataset"""
+    lat, lng = np.full(ZIP_PREFIXES, np.nan), np.full(ZIP_PREFIXES, np.nan)
+    path = centroids_file()
+    if path is None:
+        logger.warning("No geolocation dataset %s, the map has no points", loader.data_path(GEOLOCATION_FILENAME))
+        return Centroids(lat, lng)
+    centroids_df = pd.read_parquet(path, columns=["zip_code_prefix", "lat", "lng"])
+    prefixes = centroids_df["zip_code_prefix"].to_numpy(dtype=np.int64)
+    lat[prefixes] = centroids_df["lat"].to_numpy()
+    lng[prefixes] = centroids_df["lng"].to_numpy()
+    return Centroids(lat, lng)
+
+
+def locate(centroids: Centroids, zip_prefixes: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Function: Get the centroid of the zip code prefix of every row, NaN if it is missing or not located"""
+    prefixes = zip_prefixes.to_numpy(dtype=np.float64, na_value=np.nan)
+    known = (prefixes >= 0) & (prefixes < ZIP_PREFIXES)
+    index = np.where(known, prefixes, 0).astype(np.int64)
+    return np.where(known, centroids.lat[index], np.nan), np.where(known, centroids.lng[index], np.nan)
+
+
+@profiling.profiled
+def create_map_df(centroids: Centroids, zip_prefixes: pd.Series, orders: np.ndarray,
+                  revenue: np.ndarray) -> tuple[pd.DataFrame, float]:
+    """Function: Get a dataframe of the orders and revenue of every bin with orders, located at the centroid of
+    its zip code prefixes weighted by orders, from rows of zip code prefixes with their orders and revenue.
+    Also get the share of the orders that could not be located, in percent"""
+    lat, lng = locate(centroids, zip_prefixes)
+    located = ~np.isnan(lat)
+    south, _, west, east = BOUNDS
+    columns = int(np.ceil((east - west) / BIN_DEGREES))
+    bins = np.floor((lat[located] - south) / BIN_DEGREES).astype(np.int64) * columns + \
+        np.floor((lng[located] - west) / BIN_DEGREES).astype(np.int64)
+
+    orders, revenue = np.asarray(orders, dtype=np.float64), np.asarray(revenue, dtype=np.float64)
+    bin_orders = np.bincount(bins, weights=orders[located])
+    occupied = np.flatnonzero(bin_orders)
+    bin_orders = bin_orders[occupied]
+    result_df = pd.DataFrame({
+        "lat": np.bincount(bins, weights=lat[located] * orders[located])[occupied] / bin_orders,
+        "lng": np.bincount(bins, weights=lng[located] * orders[located])[occupied] / bin_orders,
+        "orders": np.rint(bin_orders).astype(np.int64),
+        "revenue": np.bincount(bins, weights=revenue[located])[occupied]
+    })
+    total = orders.sum()
+    return result_df, float(orders[~located].sum() / total * 100) if total else 0.0
@@ -0,0 +1,270 @@
+"""Incremental ingest of delta files into the loaded datasets and their aggregates.
+
+New orders, payments and reviews arrive as delta files in loader.DELTA_DIRECTORY,
+with the schema of the dataset named by their filename. A watcher thread polls
+the directory, and every delta is folded into the live state of the dashboard
+without going back to the rows already ingested:
+
+- the daily rollups, sketches and delivery sketch of the delta are built and added to the
+  current ones, which costs the size of the delta plus the size of the
+  aggregates (days x groups), never a rescan of the history;
+- the review messages and the order items of the delta are added to the review
+  and seller indexes once they are built, with a binary search per row and a
+  copy of their sorted arrays;
+- the RFM state of every customer (frequency, monetary, last purchase day) is
+  updated in place, only for the customers of the delta;
+- the rows are appended to the dataframes still used by the row-level paths,
+  a memory copy that doesn't parse or group anything again.
+
+Deltas are append-only: a row of a known order adds to its revenue but doesn't
+count the order again or change its status. Ingested files are moved to
+loader.APPLIED_DELTA_DIRECTORY, from which loader.py appends them again after
+a restart.
+"""
+import os
+import time
+import datetime
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import loader
+import rollup
+import sketch
+import reviews
+import sellers
+import delivery
+
+# Seconds between two scans of the delta directory
+WATCH_INTERVAL_SECONDS = 5
+
+# Files modified more recently than this are assumed to still be written
+SETTLE_SECONDS = 2
+
+REJECTED_DELTA_DIRECTORY = os.path.join(loader.DELTA_DIRECTORY, "rejected")
+
+logger = logging.getLogger(__name__)
+
+
+class CustomerState:
+    """Frequency, monetary value and last purchase day of every customer, updated in place by deltas.
+    Arrays grow by doubling, so adding a delta costs its number of rows"""
+
+    def __init__(self):
+        self.index = {}
+        self.customer_ids = []
+        self.frequency = np.zeros(0, dtype=np.int64)
+        self.monetary = np.zeros(0, dtype=np.float64)
+        self.last_day = np.zeros(0, dtype=np.int64)
+        self.recent_day = np.iinfo(np.int64).min
+
+    def reserve(self, customers: int) -> None:
+        """Procedure: Make room for customers customers in the arrays"""
+        capacity = len(self.frequency)
+        if customers <= capacity:
+            return
+        capacity = max(customers, 2 * capacity)
+        self.frequency = np.concatenate([self.frequency, np.zeros(capacity - len(self.frequency), dtype=np.int64)])
+        self.monetary = np.concatenate([self.monetary, np.zeros(capacity - len(self.monetary), dtype=np.float64)])
+        self.last_day = np.concatenate([self.last_day, np.full(capacity - len(self.last_day),
+                                                               np.iinfo(np.int64).min, dtype=np.int64)])
+
+    def update(self, orders_df: pd.DataFrame, first_rows: np.ndarray) -> None:
+        """Procedure: Add rows of the order customers payments dataset, first_rows flagging the first row
+        of every order not seen before"""
+        days = rollup.day_numbers(orders_df["order_purchase_timestamp"])
+        self.recent_day = max(self.recent_day, int(days.max(initial=np.iinfo(np.int64).min)))
+
+        delivered = (orders_df["order_status"] == "delivered").to_numpy(dtype=bool, na_value=False)
+        codes, uniques = pd.factorize(orders_df["customer_unique_id"][delivered])
+        valid = codes >= 0
+        known_customers = len(self.customer_ids)
+        positions = np.fromiter((self.index.setdefault(customer_id, len(self.index)) for customer_id in uniques),
+                                dtype=np.int64, count=len(uniques))
+        self.customer_ids.extend(np.asarray(uniques, dtype=object)[positions >= known_customers])
+        self.reserve(len(self.index))
+
+        rows = positions[codes[valid]]
+        np.add.at(self.frequency, rows[first_rows[delivered][valid]], 1)
+        np.add.at(self.monetary, rows, orders_df["payment_value"][delivered][valid].fillna(0).to_numpy())
+        np.maximum.at(self.last_day, rows, days[delivered][valid])
+
+    def create_rfm_df(self) -> pd.DataFrame:
+        """Function: Get the RFM dataframe of every customer, as main.create_rfm_df over all the rows"""
+        customers = len(self.customer_ids)
+        result_df = pd.DataFrame({
+            "customer_id": pd.array(self.customer_ids, dtype=loader.CATEGORY_STRING_DTYPE),
+            "frequency": self.frequency[:customers],
+            "monetary": self.monetary[:customers],
+            "recency": self.recent_day - self.last_day[:customers]
+        })
+        return result_df.sort_values(by="customer_id", ignore_index=True)
+
+
+class LiveData:
+    """Datasets of the dashboard with their rollups, sketches, indexes and RFM state, kept up to date with the
+    delta files. Every delta replaces the rollups, sketches (the delivery sketch included) and review index it
+    changes, so readers holding the previous ones are not affected, while the RFM and seller states are read
+    under the lock. The rows of the deltas are only appended to a dataset when it is next read"""
+
+    def __init__(self, datasets: dict):
+        self.lock = threading.RLock()
+        self.datasets = dict(datasets)
+        self.pending = {name: [] for name in datasets}
+        orders_df = datasets["order_customers_payments"]
+        # The datasets are sorted on their date column
+        purchases = orders_df["order_purchase_timestamp"]
+        self.purchase_range = (purchases.iloc[0], purchases.iloc[-1]) if len(purchases) else (pd.NaT, pd.NaT)
+        first_rows = ~orders_df["order_id"].duplicated().to_numpy()
+        # The 64-bit hashes of the orders seen so far, sorted, 8 bytes per order
+        self.known_orders = np.unique(loader.hash_values(orders_df["order_id"].dropna()))
+        self.rollups = rollup.build_rollups(orders_df, datasets["orders_order_items_products_category"],
+                                            datasets["order_reviews"], first_rows)
+        self.sketches = sketch.build_sketches(datasets["orders_order_items_products_category"])
+        self.delivery = delivery.build_delivery_sketch(orders_df, first_rows)
+        self.customers = CustomerState()
+        self.customers.update(orders_df, first_rows)
+        # Built on first use, then kept up to date with the deltas
+        self.message_index = None
+        self.seller_state = None
+        self.version = 0
+        # Datasets with deltas the memoized aggregates don't have yet
+        self.changed = set()
+        self.ingested = []
+
+    def new_order_rows(self, orders_df: pd.DataFrame) -> np.ndarray:
+        """Function: Get the first row of every order of orders_df not seen before, marking them as seen"""
+        hashes = loader.hash_values(orders_df["order_id"])
+        _, known = loader.find_sorted(self.known_orders, hashes)
+        first_rows = orders_df["order_id"].notna().to_numpy() & ~known & ~pd.Series(hashes).duplicated().to_numpy()
+        new_orders = np.sort(hashes[first_rows])
+        self.known_orders = np.insert(self.known_orders, np.searchsorted(self.known_orders, new_orders), new_orders)
+        return first_rows
+
+    def apply_delta(self, name: str, delta_df: pd.DataFrame) -> None:
+        """Procedure: Add the rows of a delta of a dataset to the datasets and to every aggregate"""
+        with self.lock:
+            deltas = {dataset: delta_df if dataset == name else self.datasets[dataset].iloc[:0]
+                      for dataset in loader.DATASETS}
+            orders_df = deltas["order_customers_payments"]
+            first_rows = self.new_order_rows(orders_df)
+            delta_rollups = rollup.build_rollups(orders_df, deltas["orders_order_items_products_category"],
+                                                 deltas["order_reviews"], first_rows)
+            self.rollups = {key: rollup.add_rollups(value, delta_rollups[key]) for key, value in self.rollups.items()}
+            delta_sketches = sketch.build_sketches(deltas["orders_order_items_products_category"])
+            self.sketches = {key: sketch.add_sketches(value, delta_sketches[key])
+                             for key, value in self.sketches.items()}
+            self.delivery = delivery.add_delivery_sketches(self.delivery,
+                                                           delivery.build_delivery_sketch(orders_df, first_rows))
+            self.customers.update(orders_df, first_rows)
+            purchases = orders_df["order_purchase_timestamp"].dropna()
+            if len(purchases):
+                first, last = self.purchase_range
+                self.purchase_range = (purchases.min() if pd.isna(first) else min(first, purchases.min()),
+                                       purchases.max() if pd.isna(last) else max(last, purchases.max()))
+            if name == "order_reviews" and self.message_index is not None:
+                self.message_index = reviews.add_reviews(self.message_index, delta_df)
+            if name == "orders_order_items_products_category" and self.seller_state is not None:
+                self.seller_state.add_items(delta_df)
+            if name == "order_reviews" and self.seller_state is not None:
+                self.seller_state.add_reviews(delta_df)
+            self.pending[name].append(delta_df)
+            self.changed.add(name)
+            self.version += 1
+
+    def publish(self) -> set:
+        """Function: Get the datasets with deltas ingested since the last call"""
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            return changed
+
+    def dataset(self, name: str) -> pd.DataFrame:
+        """Function: Get a dataset with the rows of every ingested delta"""
+        with self.lock:
+            if self.pending[name]:
+                delta_df = pd.concat(self.pending[name], ignore_index=True)
+                self.datasets = {**self.datasets, name: loader.append_dataset(self.datasets[name], delta_df, name)}
+                self.pending[name] = []
+            return self.datasets[name]
+
+    def apply_pending(self) -> int:
+        """Function: Ingest every settled delta file of the delta directory, returning how many were applied.
+        A file that can't be read is moved to the rejected directory instead"""
+        applied = 0
+        for path in pending_delta_files():
+            name = loader.delta_dataset(os.path.basename(path))
+            start = time.perf_counter()
+            try:
+                delta_df = loader.read_dataset_file(path, name)
+            except (OSError, ValueError, KeyError) as error:
+                logger.error("Rejected delta %s: %s", path, error)
+                move_file(path, REJECTED_DELTA_DIRECTORY)
+                continue
+            self.apply_delta(name, delta_df)
+            move_file(path, loader.APPLIED_DELTA_DIRECTORY)
+
+            seconds = time.perf_counter() - start
+            self.ingested.append({"file": os.path.basename(path), "dataset": name, "rows": len(delta_df),
+                                  "seconds": seconds})
+            logger.info("Ingested %s into %s: %d rows in %.3f s", path, name, len(delta_df), seconds)
+            applied += 1
+        return applied
+
+    def review_index(self) -> reviews.ReviewIndex:
+        """Function: Get the index of the review messages with every ingested delta"""
+        with self.lock:
+            if self.message_index is None:
+                self.message_index = reviews.build_review_index(self.dataset("order_reviews"))
+            return self.message_index
+
+    def seller_index(self, sellers_df: pd.DataFrame) -> sellers.SellerIndex:
+        """Function: Get the seller index with every ingested delta, the sellers located by sellers_df"""
+        with self.lock:
+            if self.seller_state is None:
+                self.seller_state = sellers.SellerState(sellers_df)
+                self.seller_state.add_reviews(self.dataset("order_reviews"))
+                self.seller_state.add_items(self.dataset("orders_order_items_products_category"))
+            return self.seller_state.create_index()
+
+    def create_rfm_df(self) -> pd.DataFrame:
+        """Function: Get the RFM dataframe of every customer over all the orders"""
+        with self.lock:
+            return self.customers.create_rfm_df()
+
+    def is_whole_timeframe(self, start_date: datetime.date, end_date: datetime.date) -> bool:
+        """Function: Check whether the timeframe covers every order"""
+        first, last = self.purchase_range
+        return pd.isna(first) or (start_date <= first.date() and end_date >= last.date())
+
+
+def pending_delta_files() -> list:
+    """Function: Get the delta files waiting in the delta directory, oldest name first"""
+    if not os.path.isdir(loader.DELTA_DIRECTORY):
+        return []
+    settled = time.time() - SETTLE_SECONDS
+    paths = [os.path.join(loader.DELTA_DIRECTORY, filename) for filename in sorted(os.listdir(loader.DELTA_DIRECTORY))
+             if loader.delta_dataset(filename) is not None]
+    return [path for path in paths if os.path.isfile(path) and os.path.getmtime(path) < settled]
+
+
+def move_file(path: str, directory: str) -> None:
+    """Procedure: Move a file into a directory, creating it if needed"""
+    os.makedirs(directory, exist_ok=True)
+    os.replace(path, os.path.join(directory, os.path.basename(path)))
+
+
+def watch_deltas(live_data: LiveData, stop: threading.Event, interval: float = WATCH_INTERVAL_SECONDS) -> None:
+    """Procedure: Ingest the delta files as they arrive, until stop is set"""
+    while not stop.wait(interval):
+        try:
+            live_data.apply_pending()
+        except Exception:
+            logger.exception("Ingesting the delta files failed")
+
+
+def start_watcher(live_data: LiveData, interval: float = WATCH_INTERVAL_SECONDS) -> threading.Event:
+    """Function: Start a daemon thread watching the delta directory, returning the event that stops it"""
+    stop = threading.Event()
+    threading.Thread(target=watch_deltas, args=(live_data, stop, interval), name="delta-watcher",
+                     daemon=True).start()
+    return stop
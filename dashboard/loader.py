@@ -0,0 +1,472 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import profiling
+
+DATA_DIRECTORY = "data"
+CACHE_DIRECTORY = os.path.join(DATA_DIRECTORY, ".cache")
+
+# New rows of the datasets arrive as delta files named after their dataset, e.g. order_reviews_20181018.csv,
+# and are moved to the applied directory once ingested
+DELTA_DIRECTORY = os.path.join(DATA_DIRECTORY, "deltas")
+APPLIED_DELTA_DIRECTORY = os.path.join(DELTA_DIRECTORY, "applied")
+DELTA_EXTENSIONS = (".csv", ".parquet")
+
+# Bump whenever the schemas or the cached layout change so stale caches are rebuilt
+CACHE_VERSION = 4
+
+# Rows per Parquet row group of the cache, small enough for the SQL backend to skip
+# the row groups outside a timeframe using their min/max statistics
+CACHE_ROW_GROUP_SIZE = 128 * 1024
+
+# Engine of the dashboard aggregations, chosen with the DASHBOARD_BACKEND environment variable
+BACKENDS = ["pandas", "duckdb", "streaming"]
+BACKEND = os.environ.get("DASHBOARD_BACKEND", "pandas").lower()
+
+# Rows the streaming backend reads at a time, chosen with the DASHBOARD_CHUNK_SIZE environment variable
+DEFAULT_CHUNK_SIZE = 100_000
+CHUNK_SIZE = os.environ.get("DASHBOARD_CHUNK_SIZE", str(DEFAULT_CHUNK_SIZE)).replace("_", "")
+
+logger = logging.getLogger(__name__)
+
+ORDER_DTYPES = {
+    "order_id": "string",
+    "customer_id": "string",
+    "order_status": "string"
+}
+
+# Hex identifiers and low-cardinality strings, dictionary-encoded once loaded
+ORDER_CATEGORICAL_COLUMNS = ["order_id", "customer_id", "order_status"]
+
+# Dictionary of the categorical columns, the unique strings are kept once in Arrow memory
+CATEGORY_STRING_DTYPE = "string[pyarrow]"
+
+ORDER_DATETIME_COLUMNS = [
+    "order_purchase_timestamp",
+    "order_approved_at",
+    "order_delivered_carrier_date",
+    "order_delivered_customer_date",
+    "order_estimated_delivery_date"
+]
+
+DATASETS = {
+    "order_customers_payments": {
+        "filename": "order_customers_payments_dataset.csv",
+        "dtypes": {
+            **ORDER_DTYPES,
+            "customer_unique_id": "string",
+            "customer_zip_code_prefix": "Int32",
+            "customer_city": "string",
+            "customer_state": "string",
+            "payment_sequential": "float64",
+            "payment_type": "string",
+            "payment_installments": "float64",
+            "payment_value": "float64"
+        },
+        "datetime_columns": ORDER_DATETIME_COLUMNS,
+        "categorical_columns": ORDER_CATEGORICAL_COLUMNS + [
+            "customer_unique_id", "customer_city", "customer_state", "payment_type"
+        ],
+        "sort_column": "order_purchase_timestamp"
+    },
+    "orders_order_items_products_category": {
+        "filename": "orders_order_items_products_category_dataset.csv",
+        "dtypes": {
+            **ORDER_DTYPES,
+            "order_item_id": "float64",
+            "product_id": "string",
+            "seller_id": "string",
+            "price": "float64",
+            "freight_value": "float64",
+            "product_category_name": "string",
+            "product_name_lenght": "float64",
+            "product_description_lenght": "float64",
+            "product_photos_qty": "float64",
+            "product_weight_g": "float64",
+            "product_length_cm": "float64",
+            "product_height_cm": "float64",
+            "product_width_cm": "float64",
+            "product_category_name_english": "string"
+        },
+        "datetime_columns": ORDER_DATETIME_COLUMNS + ["shipping_limit_date"],
+        "categorical_columns": ORDER_CATEGORICAL_COLUMNS + [
+            "product_id", "seller_id", "product_category_name", "product_category_name_english"
+        ],
+        "sort_column": "order_purchase_timestamp"
+    },
+    "order_reviews": {
+        "filename": "order_reviews_dataset.csv",
+        "dtypes": {
+            "review_id": "string",
+            "order_id": "string",
+            "review_score": "int64",
+            "review_comment_title": "string",
+            "review_comment_message": "string"
+        },
+        "datetime_columns": ["review_creation_date", "review_answer_timestamp"],
+        "categorical_columns": [],
+        "sort_column": "review_creation_date"
+    }
+}
+
+# Dimension table of the sellers, joined to the order items on seller_id
+SELLERS_DATASET = {
+    "filename": "sellers_dataset.csv",
+    "dtypes": {
+        "seller_id": "string",
+        "seller_zip_code_prefix": "Int32",
+        "seller_city": "string",
+        "seller_state": "string"
+    },
+    "categorical_columns": ["seller_city", "seller_state"]
+}
+
+
+def selected_backend() -> str:
+    """Function: Get the configured aggregation backend"""
+    if BACKEND not in BACKENDS:
+        raise ValueError("Unknown DASHBOARD_BACKEND {!r}, expected one of {}".format(BACKEND, BACKENDS))
+    return BACKEND
+
+
+def selected_chunk_size() -> int:
+    """Function: Get the configured rows per chunk of the streaming backend"""
+    if not CHUNK_SIZE.isdigit() or int(CHUNK_SIZE) == 0:
+        raise ValueError("Invalid DASHBOARD_CHUNK_SIZE {!r}, expected a positive number of rows".format(CHUNK_SIZE))
+    return int(CHUNK_SIZE)
+
+
+def data_path(filename: str) -> str:
+    """Function: Get data file"""
+    return os.path.join(DATA_DIRECTORY, filename)
+
+
+def cache_path(filename: str) -> str:
+    """Function: Get cache file"""
+    return os.path.join(CACHE_DIRECTORY, filename)
+
+
+@profiling.profiled
+def set_datetime_columns(dataframe: pd.DataFrame, datetime_columns: list) -> None:
+    """Procedure: Change the data type of datetime_columns to datetime. Columns read as datetimes, from
+    Parquet, are left as they are, as to_datetime samples their values before returning them unchanged"""
+    for column in datetime_columns:
+        if not pd.api.types.is_datetime64_any_dtype(dataframe[column]):
+            dataframe[column] = pd.to_datetime(dataframe[column], format="ISO8601")
+
+
+def encode_categorical_columns(dataframe: pd.DataFrame, categorical_columns: list) -> None:
+    """Procedure: Change the data type of categorical_columns to categorical, with integer codes and
+    the sorted unique strings stored once as categories. Missing values keep the code -1"""
+    for column in categorical_columns:
+        series = dataframe[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            categories = pd.Index(series.cat.categories, dtype=CATEGORY_STRING_DTYPE)
+        else:
+            # The unique strings are sorted by Arrow, then the codes are renumbered in that order
+            codes, uniques = pd.factorize(series)
+            uniques = pd.Index(uniques, dtype=CATEGORY_STRING_DTYPE)
+            order = uniques.argsort()
+            ranks = np.empty(len(order), dtype=codes.dtype)
+            ranks[order] = np.arange(len(order), dtype=codes.dtype)
+            codes = np.where(codes >= 0, ranks[codes], -1)
+            categories = uniques[order]
+        dataframe[column] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories))
+
+
+def append_categorical(base: pd.Series, delta: pd.Series) -> pd.Series:
+    """Function: Get a categorical series followed by the values of delta, keeping the categories sorted.
+    The codes of base are only renumbered when delta brings new values"""
+    categories = base.cat.categories
+    codes = base.cat.codes.to_numpy()
+    delta = delta.astype(CATEGORY_STRING_DTYPE)
+    new_values = pd.Index(delta.dropna().unique(), dtype=CATEGORY_STRING_DTYPE).difference(categories)
+    if len(new_values):
+        renumbered = categories.append(new_values).sort_values()
+        codes = np.where(codes >= 0, renumbered.get_indexer(categories)[codes], -1)
+        categories = renumbered
+    codes = np.concatenate([codes, categories.get_indexer(delta)])
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories)))
+
+
+def append_dataset(dataframe: pd.DataFrame, delta_df: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Function: Get a dataset with the rows of a delta of the same schema, still sorted on its sort_column
+    and with its categorical columns dictionary-encoded. The delta rows are sorted and merged in after the
+    rows of the same time, so every column is copied once and the dataset is never sorted again"""
+    spec = DATASETS[name]
+    delta_df = delta_df.sort_values(by=spec["sort_column"], kind="stable", ignore_index=True)
+
+    # Missing times are sorted last, as sort_values does
+    times = dataframe[spec["sort_column"]].to_numpy(dtype="datetime64[ns]")
+    delta_times = delta_df[spec["sort_column"]].to_numpy(dtype="datetime64[ns]")
+    order = None
+    if len(times) and len(delta_times) and not np.isnat(delta_times[0]) and \
+            (np.isnat(times[-1]) or times[-1] > delta_times[0]):
+        delta_positions = np.arange(len(delta_times)) + np.where(
+            np.isnat(delta_times), len(times), np.searchsorted(times, delta_times, side="right"))
+        order = np.empty(len(times) + len(delta_times), dtype=np.int64)
+        rows = np.ones(len(order), dtype=bool)
+        rows[delta_positions] = False
+        order[rows] = np.arange(len(times))
+        order[delta_positions] = np.arange(len(delta_times)) + len(times)
+
+    columns = {}
+    for column in dataframe.columns:
+        if column in spec["categorical_columns"]:
+            values = append_categorical(dataframe[column], delta_df[column]).array
+        else:
+            values = pd.concat([dataframe[column], delta_df[column]], ignore_index=True).array
+        columns[column] = values if order is None else values.take(order)
+    return pd.DataFrame(columns, copy=False)
+
+
+def decode_categorical_columns(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get a dataframe with its categorical columns decoded back to strings, for display"""
+    columns = dataframe.select_dtypes(include="category").columns
+    return dataframe.astype({column: "string" for column in columns}) if len(columns) else dataframe
+
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """Function: Get the 64-bit hash of every value of a series, the same for a string whatever its dtype.
+    The categories of a categorical series with fewer categories than values are hashed once, and missing
+    values hash to 0"""
+    if isinstance(values.dtype, pd.CategoricalDtype) and len(values.cat.categories) <= len(values):
+        codes = values.cat.codes.to_numpy()
+        hashes = pd.util.hash_array(values.cat.categories.to_numpy(dtype=object))
+        return np.where(codes >= 0, hashes[codes] if len(hashes) else 0, 0).astype(np.uint64)
+    missing = values.isna().to_numpy()
+    return np.where(missing, 0, pd.util.hash_array(values.to_numpy(dtype=object, na_value=""))).astype(np.uint64)
+
+
+def find_sorted(sorted_values: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Function: Get the position of every value in sorted_values, where it would be inserted if it isn't
+    there, and whether it is there"""
+    positions = np.searchsorted(sorted_values, values)
+    if not len(sorted_values):
+        return positions, np.zeros(len(positions), dtype=bool)
+    return positions, sorted_values[np.minimum(positions, len(sorted_values) - 1)] == values
+
+
+def partition_ids(keys: pd.Series, partitions: int) -> np.ndarray:
+    """Function: Get the hash partition of every join key"""
+    return hash_values(keys) % np.uint64(partitions)
+
+
+def write_partitions(chunks, key: str, partitions: int, directory: str) -> list:
+    """Function: Hash partition a stream of dataframes on key into Parquet files, returning their paths"""
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, "part-{:04d}.parquet".format(i)) for i in range(partitions)]
+    writers, schema = None, None
+
+    for chunk in chunks:
+        if writers is None:
+            schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+            writers = [pq.ParquetWriter(path, schema) for path in paths]
+        for partition, part_df in chunk.groupby(partition_ids(chunk[key], partitions)):
+            writers[partition].write_table(pa.Table.from_pandas(part_df, schema=schema, preserve_index=False))
+
+    if writers is None:
+        raise ValueError("Cannot partition an empty table into {}".format(directory))
+    for writer in writers:
+        writer.close()
+    return paths
+
+
+def file_fingerprint(path: str) -> dict:
+    """Function: Get the modification time and size of a file"""
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Function: Get the SHA-256 hash of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_cache_meta(meta_file: str) -> dict | None:
+    """Function: Get the metadata of a cache file, or None if there is none"""
+    try:
+        with open(meta_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_meta(meta_file: str, meta: dict) -> None:
+    """Procedure: Atomically write the metadata of a cache file"""
+    tmp_file = meta_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=2)
+    os.replace(tmp_file, meta_file)
+
+
+def source_fingerprint(path: str) -> dict:
+    """Function: Get the modification time, size and content hash of a source file"""
+    return {**file_fingerprint(path), "sha256": file_sha256(path)}
+
+
+def is_source_unchanged(path: str, recorded: dict) -> bool:
+    """Function: Check whether a source file still matches its recorded fingerprint.
+
+    The cheap mtime/size check is tried first. If only the mtime changed, the
+    file is hashed and counts as unchanged when the content is identical.
+    """
+    if not os.path.exists(path):
+        return False
+
+    fingerprint = file_fingerprint(path)
+    if fingerprint["mtime_ns"] == recorded["mtime_ns"] and fingerprint["size"] == recorded["size"]:
+        return True
+    if fingerprint["size"] != recorded["size"] or file_sha256(path) != recorded["sha256"]:
+        return False
+
+    recorded.update(fingerprint)
+    return True
+
+
+def is_cache_fresh(source_file: str, meta_file: str) -> bool:
+    """Function: Check whether the cache of source_file is still valid"""
+    meta = read_cache_meta(meta_file)
+    if meta is None or meta.get("version") != CACHE_VERSION or meta.get("source") != source_file:
+        return False
+
+    mtime_ns = meta["mtime_ns"]
+    if not is_source_unchanged(source_file, meta):
+        return False
+    if meta["mtime_ns"] != mtime_ns:
+        write_cache_meta(meta_file, meta)
+    return True
+
+
+def source_path(name: str) -> str:
+    """Function: Get the source file of a dataset, preferring the Parquet output of etl.py over the CSV"""
+    return preferred_file(data_path(DATASETS[name]["filename"]))
+
+
+def preferred_file(csv_file: str) -> str:
+    """Function: Get the Parquet file next to a CSV file if there is one, else the CSV file"""
+    parquet_file = os.path.splitext(csv_file)[0] + ".parquet"
+    return parquet_file if os.path.exists(parquet_file) else csv_file
+
+
+def delta_dataset(filename: str) -> str | None:
+    """Function: Get the dataset of a delta file from its name, or None if it is not a delta file"""
+    if not filename.endswith(DELTA_EXTENSIONS):
+        return None
+    matches = [name for name in DATASETS if filename.startswith(name)]
+    return max(matches, key=len) if matches else None
+
+
+def applied_delta_files(name: str) -> list:
+    """Function: Get the delta files of a dataset that were already ingested, in ingestion order"""
+    if not os.path.isdir(APPLIED_DELTA_DIRECTORY):
+        return []
+    return [os.path.join(APPLIED_DELTA_DIRECTORY, filename) for filename in sorted(os.listdir(APPLIED_DELTA_DIRECTORY))
+            if delta_dataset(filename) == name]
+
+
+def read_source_dataset(name: str) -> pd.DataFrame:
+    """Function: Read a dataset from its source file using the explicit schema, sorted on its sort_column,
+    with its categorical columns dictionary-encoded"""
+    return read_dataset_file(source_path(name), name)
+
+
+def read_dataset_file(source_file: str, name: str) -> pd.DataFrame:
+    """Function: Read a CSV or Parquet file of a dataset using the explicit schema, sorted on its sort_column,
+    with its categorical columns dictionary-encoded"""
+    spec = DATASETS[name]
+    with profiling.Stage("loader.read:" + os.path.basename(source_file)) as stage:
+        if source_file.endswith(".parquet"):
+            dataframe = pd.read_parquet(source_file).astype(spec["dtypes"])
+        else:
+            dataframe = pd.read_csv(source_file, dtype=spec["dtypes"])
+        stage.rows_out = len(dataframe)
+    set_datetime_columns(dataframe, spec["datetime_columns"])
+    dataframe = dataframe.sort_values(by=spec["sort_column"], kind="stable", ignore_index=True)
+    encode_categorical_columns(dataframe, spec["categorical_columns"])
+    return dataframe
+
+
+def load_dataset(name: str) -> tuple[pd.DataFrame, dict]:
+    """Function: Load a dataset from its Parquet cache, rebuilding the cache when the source file changed,
+    followed by its ingested delta files"""
+    source_file = source_path(name)
+    parquet_file = cache_path(name + ".parquet")
+    meta_file = cache_path(name + ".json")
+
+    start = time.perf_counter()
+    if os.path.exists(parquet_file) and is_cache_fresh(source_file, meta_file):
+        # Parquet keeps the dictionary encoding, only the categories are moved back to Arrow strings
+        with profiling.Stage("loader.read:" + os.path.basename(parquet_file)) as stage:
+            dataframe = pd.read_parquet(parquet_file)
+            stage.rows_out = len(dataframe)
+        encode_categorical_columns(dataframe, DATASETS[name]["categorical_columns"])
+        source = "cache"
+    else:
+        dataframe = read_source_dataset(name)
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        tmp_file = parquet_file + ".tmp"
+        dataframe.to_parquet(tmp_file, index=False, row_group_size=CACHE_ROW_GROUP_SIZE)
+        os.replace(tmp_file, parquet_file)
+        write_cache_meta(meta_file, {
+            "version": CACHE_VERSION,
+            "source": source_file,
+            **source_fingerprint(source_file)
+        })
+        source = os.path.splitext(source_file)[1].lstrip(".")
+
+    # The cache only holds the source file, the ingested deltas are appended to it
+    for delta_file in applied_delta_files(name):
+        dataframe = append_dataset(dataframe, read_dataset_file(delta_file, name), name)
+
+    stats = {"source": source, "rows": len(dataframe), "seconds": time.perf_counter() - start}
+    logger.info("Loaded %s from %s: %d rows in %.3f s", name, source, stats["rows"], stats["seconds"])
+    return dataframe, stats
+
+
+def load_sellers() -> pd.DataFrame:
+    """Function: Read the sellers dataset using its explicit schema, without rows if its file is missing"""
+    spec = SELLERS_DATASET
+    source_file = preferred_file(data_path(spec["filename"]))
+    if not os.path.exists(source_file):
+        logger.warning("No sellers dataset %s, sellers will have no city or state", source_file)
+        dataframe = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in spec["dtypes"].items()})
+    elif source_file.endswith(".parquet"):
+        dataframe = pd.read_parquet(source_file).astype(spec["dtypes"])
+    else:
+        dataframe = pd.read_csv(source_file, dtype=spec["dtypes"])
+    encode_categorical_columns(dataframe, spec["categorical_columns"])
+    return dataframe
+
+
+def cached_dataset_file(name: str) -> str:
+    """Function: Get the Parquet cache file of a dataset, rebuilding it when the source file changed"""
+    parquet_file = cache_path(name + ".parquet")
+    if not (os.path.exists(parquet_file) and is_cache_fresh(source_path(name), cache_path(name + ".json"))):
+        load_dataset(name)
+    return parquet_file
+
+
+def load_datasets() -> tuple[dict, dict]:
+    """Function: Load every dashboard dataset, returning the dataframes and the cold-load timings"""
+    start = time.perf_counter()
+    datasets, stats = {}, {}
+    for name in DATASETS:
+        with profiling.Stage("loader.load:" + name) as stage:
+            datasets[name], stats[name] = load_dataset(name)
+            stage.rows_out = len(datasets[name])
+
+    cold_seconds = time.perf_counter() - start
+    logger.info("Cold load of all datasets took %.3f s", cold_seconds)
+    return datasets, {"cold_seconds": cold_seconds, "datasets": stats}
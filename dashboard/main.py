@@ -1,25 +1,125 @@
-import os
+import time
+import uuid
+import datetime
+from collections import deque
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import streamlit as st
 import matplotlib.pyplot as plt
 from babel.numbers import format_currency
+import rfm
+import charts
+import loader
+import metrics
+import rollup
+import sketch
+import ingest
+import profiling
+import reviews
+import sellers
+import delivery
+import cohorts
+import geo
+import scheduler
+import streaming
+import sql_backend
+from loader import load_datasets
+from timeframe import slice_timeframe
 
-DATA_DIRECTORY = "data"
 sns.set_theme(style='dark')
 
 
-def data_path(filename: str) -> str:
-    """Function: Get data file"""
-    return os.path.join(DATA_DIRECTORY, filename)
+@st.cache_resource(show_spinner="Loading datasets...")
+def get_datasets() -> tuple[dict, dict]:
+    """Function: Get the process-wide copy of all datasets, shared by every session"""
+    return load_datasets()
 
 
-def set_datetime_columns(dataframe: pd.DataFrame, datetime_columns: list) -> None:
-    """Procedure: Change the data type of datetiem_columns to datetime"""
-    for column in datetime_columns:
-        dataframe[column] = pd.to_datetime(dataframe[column])
+@st.cache_resource(show_spinner="Building daily rollups and sketches...")
+def get_live_data() -> ingest.LiveData:
+    """Function: Get the process-wide datasets and aggregates, kept up to date with the delta files
+    by a watcher thread"""
+    datasets, _ = get_datasets()
+    live_data = ingest.LiveData(datasets)
+    ingest.start_watcher(live_data)
+    return live_data
 
 
+def get_rollups() -> dict:
+    """Function: Get the current daily rollups of the datasets"""
+    return get_live_data().rollups
+
+
+def get_sketches() -> dict:
+    """Function: Get the current daily distinct count sketches of the datasets"""
+    return get_live_data().sketches
+
+
+@st.cache_resource(show_spinner="Indexing the review messages...", max_entries=1)
+def get_review_index(version: int) -> reviews.ReviewIndex:
+    """Function: Get the process-wide index of the review messages of a version of the data"""
+    if streaming.is_enabled():
+        return reviews.build_review_index(streaming.stream_review_messages(loader.selected_chunk_size()))
+    if sql_backend.is_enabled():
+        return reviews.build_review_index(sql_backend.create_review_messages_df(get_sql_connection()))
+    return get_live_data().review_index()
+
+
+@st.cache_resource(show_spinner="Indexing the sellers...", max_entries=1)
+def get_seller_index(version: int) -> sellers.SellerIndex:
+    """Function: Get the process-wide seller index of a version of the data"""
+    if streaming.is_enabled():
+        return streaming.stream_seller_index(loader.load_sellers(), loader.selected_chunk_size())
+    if not sql_backend.is_enabled():
+        return get_live_data().seller_index(loader.load_sellers())
+    items_df = sql_backend.select_columns(get_sql_connection(), "orders_order_items_products_category",
+                                          sellers.ITEM_COLUMNS)
+    reviews_df = sql_backend.select_columns(get_sql_connection(), "order_reviews", sellers.REVIEW_COLUMNS)
+    return sellers.build_seller_index(items_df, reviews_df, loader.load_sellers())
+
+
+@st.cache_resource(show_spinner="Sketching the delivery times...")
+def get_backend_delivery_sketch() -> delivery.DeliverySketch:
+    """Function: Get the process-wide delivery sketch of the streaming or SQL backend"""
+    if streaming.is_enabled():
+        return streaming.stream_delivery_sketch(loader.selected_chunk_size())
+    return delivery.build_delivery_sketch(
+        sql_backend.select_columns(get_sql_connection(), "order_customers_payments", delivery.ORDER_COLUMNS))
+
+
+def get_delivery_sketch() -> delivery.DeliverySketch:
+    """Function: Get the current delivery sketch of the orders"""
+    if loader.selected_backend() == "pandas":
+        return get_live_data().delivery
+    return get_backend_delivery_sketch()
+
+
+@st.cache_resource(show_spinner="Locating the zip code prefixes...")
+def get_centroids() -> geo.Centroids:
+    """Function: Get the process-wide centroids of the zip code prefixes"""
+    return geo.load_centroids()
+
+
+def get_data_version() -> int:
+    """Function: Get the version of the data the process-wide indexes are built on, only the pandas backend
+    ingests deltas"""
+    return get_live_data().version if loader.selected_backend() == "pandas" else 0
+
+
+@st.cache_resource(show_spinner="Connecting to the SQL engine...")
+def get_sql_connection():
+    """Function: Get the process-wide connection of the SQL backend, shared by every session"""
+    return sql_backend.connect()
+
+
+@profiling.profiled
+def create_total_orders_revenue(dataframe: pd.DataFrame) -> tuple:
+    """Function: Get the number of orders and the total revenue"""
+    return dataframe["order_id"].nunique(), dataframe["payment_value"].sum()
+
+
+@profiling.profiled
 def create_monthly_orders_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get a dataframe of the amount and income for each month"""
     result_df = dataframe[dataframe["order_status"] == "delivered"]. \
@@ -39,9 +139,10 @@ def create_monthly_orders_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     return result_df
 
 
+@profiling.profiled
 def create_sum_order_items_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get a dataframe of the amount and income of each product category"""
-    result_df = dataframe.groupby(by="product_category_name_english").agg({
+    result_df = dataframe.groupby(by="product_category_name_english", observed=True).agg({
         "product_id": "nunique",
         "price": "sum"
     }).reset_index().sort_values(by="product_id", ascending=False)
@@ -52,17 +153,21 @@ def create_sum_order_items_df(dataframe: pd.DataFrame) -> pd.DataFrame:
         "price": "revenue"
     }, inplace=False)
 
-    return result_df
+    return loader.decode_categorical_columns(result_df)
 
 
+@profiling.profiled
 def create_payment_type_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get payment method type dataframe"""
     result_df = dataframe["payment_type"].value_counts().sort_values(ascending=False)
+    # A categorical column also counts its categories missing from the timeframe
+    result_df = result_df[result_df > 0]
     result_df.to_frame()
     result_df = result_df.reset_index()
-    return result_df
+    return loader.decode_categorical_columns(result_df)
 
 
+@profiling.profiled
 def create_payment_installments_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get dataframe of number of installment users"""
     result_df = dataframe["payment_installments"].value_counts().sort_values(ascending=False)
@@ -77,9 +182,10 @@ def create_payment_installments_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     return result_df
 
 
+@profiling.profiled
 def create_customer_order_revenue_city(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get a dataframe of the number of orders and total revenue for each city"""
-    result_df = dataframe.groupby(by="customer_city").agg({
+    result_df = dataframe.groupby(by="customer_city", observed=True).agg({
         "order_id": "nunique",
         "payment_value": "sum"
     }).reset_index().sort_values(by="order_id", ascending=False)
@@ -90,12 +196,13 @@ def create_customer_order_revenue_city(dataframe: pd.DataFrame) -> pd.DataFrame:
         "payment_value": "revenue"
     }, inplace=True)
 
-    return result_df
+    return loader.decode_categorical_columns(result_df)
 
 
+@profiling.profiled
 def create_customer_order_revenue_state(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get a dataframe of the number of orders and total revenue for each state"""
-    result_df = dataframe.groupby(by="customer_state").agg({
+    result_df = dataframe.groupby(by="customer_state", observed=True).agg({
         "order_id": "nunique",
         "payment_value": "sum"
     }).reset_index().sort_values(by="order_id", ascending=False)
@@ -106,9 +213,27 @@ def create_customer_order_revenue_state(dataframe: pd.DataFrame) -> pd.DataFrame
         "payment_value": "revenue"
     }, inplace=True)
 
+    return loader.decode_categorical_columns(result_df)
+
+
+@profiling.profiled
+def create_customer_order_revenue_zip(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get a dataframe of the number of orders and total revenue for each zip code prefix"""
+    result_df = dataframe.groupby(by="customer_zip_code_prefix", observed=True).agg({
+        "order_id": "nunique",
+        "payment_value": "sum"
+    }).reset_index().sort_values(by="order_id", ascending=False)
+
+    result_df.rename(columns={
+        "customer_zip_code_prefix": "customer_zip_code_prefix",
+        "order_id": "order",
+        "payment_value": "revenue"
+    }, inplace=True)
+
     return result_df
 
 
+@profiling.profiled
 def create_customer_scores_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get customer satisfaction score dataframe"""
     result_df = dataframe["review_score"].value_counts()
@@ -121,6 +246,7 @@ def create_customer_scores_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     return result_df
 
 
+@profiling.profiled
 def create_satisfied_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get dataframe of number of satisfied/dissatisfied customers"""
     result_df = dataframe.groupby(by="satisfaction")["count"].sum()
@@ -130,47 +256,923 @@ def create_satisfied_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     return result_df
 
 
+@profiling.profiled
 def create_rfm_df(dataframe: pd.DataFrame) -> pd.DataFrame:
     """Function: Get RFM (Recency, Frequency, Monetary) dataframe"""
-    result_df = dataframe[dataframe["order_status"] == "delivered"].\
-        groupby(by="customer_unique_id", as_index=False).agg({
-        "order_purchase_timestamp": "max",
-        "order_id": "nunique",
-        "payment_value": "sum"
+    delivered_df = dataframe[dataframe["order_status"] == "delivered"]
+    customer_codes, customer_ids = pd.factorize(delivered_df["customer_unique_id"], sort=True)
+    customers = len(customer_ids)
+
+    # Recency on integer day numbers, every order belongs to a single customer
+    order_days = rollup.day_numbers(delivered_df["order_purchase_timestamp"])
+    last_order_days = np.full(customers, np.iinfo(np.int64).min)
+    np.maximum.at(last_order_days, customer_codes, order_days)
+    first_rows = ~delivered_df["order_id"].duplicated().to_numpy()
+
+    result_df = pd.DataFrame({
+        "customer_id": customer_ids,
+        "frequency": np.bincount(customer_codes[first_rows], minlength=customers),
+        "monetary": np.bincount(customer_codes, weights=delivered_df["payment_value"].fillna(0).to_numpy(),
+                                minlength=customers)
     })
+    recent_day = rollup.day_numbers(dataframe["order_purchase_timestamp"]).max(initial=np.iinfo(np.int64).min)
+    result_df["recency"] = recent_day - last_order_days
 
-    result_df.rename(columns={
-        "customer_unique_id": "customer_id",
-        "order_purchase_timestamp": "max_order_purchase_timestamp",
-        "order_id": "frequency",
-        "payment_value": "monetary"
-    }, inplace=True)
+    return result_df
 
-    result_df["max_order_purchase_timestamp"] = result_df["max_order_purchase_timestamp"].dt.date
-    recent_date = dataframe["order_purchase_timestamp"].dt.date.max()
-    result_df["recency"] = result_df["max_order_purchase_timestamp"].apply(lambda x: (recent_date - x).days)
-    result_df.drop("max_order_purchase_timestamp", axis=1, inplace=True)
 
-    return result_df
+@profiling.profiled
+def create_cohort_df(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the monthly cohort retention dataframe of the delivered orders, as create_rfm_df"""
+    return cohorts.create_cohort_df(dataframe[dataframe["order_status"] == "delivered"])
+
+
+def create_aggregation_tasks(datasets: dict, start_date: datetime.date, end_date: datetime.date) -> list:
+    """Function: Get the dependency graph of every dashboard aggregation over the timeframe"""
+    orders_df, items_df, reviews_df = [
+        slice_timeframe(datasets[name], loader.DATASETS[name]["sort_column"], start_date, end_date)
+        for name in ["order_customers_payments", "orders_order_items_products_category", "order_reviews"]
+    ]
+    return [
+        scheduler.Task("total_orders_revenue", create_total_orders_revenue, (orders_df,)),
+        scheduler.Task("monthly_orders_df", create_monthly_orders_df, (orders_df,)),
+        scheduler.Task("sum_order_items_df", create_sum_order_items_df, (items_df,)),
+        scheduler.Task("payment_type_df", create_payment_type_df, (orders_df,)),
+        scheduler.Task("payment_installments_df", create_payment_installments_df, (orders_df,)),
+        scheduler.Task("customer_order_revenue_city", create_customer_order_revenue_city, (orders_df,)),
+        scheduler.Task("customer_order_revenue_state", create_customer_order_revenue_state, (orders_df,)),
+        scheduler.Task("customer_scores_df", create_customer_scores_df, (reviews_df,)),
+        scheduler.Task("satisfied_df", create_satisfied_df, dependencies=["customer_scores_df"]),
+        scheduler.Task("rfm_df", create_rfm_df, (orders_df,)),
+        scheduler.Task("cohort_df", create_cohort_df, (orders_df,))
+    ]
+
+
+# Tab aggregates are memoized per timeframe and shared across sessions
+TAB_CACHE_ENTRIES = 64
+
+
+def get_timeframe_df(name: str, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the rows of a dataset within the timeframe, end_date included"""
+    return slice_timeframe(get_live_data().dataset(name), loader.DATASETS[name]["sort_column"], start_date, end_date)
+
+
+@st.cache_data(show_spinner=False)
+def get_streaming_date_range() -> tuple:
+    """Function: Get the first and last order purchase timestamps of the streaming backend"""
+    return streaming.date_range(loader.selected_chunk_size())
+
+
+@st.cache_data(show_spinner="Streaming the datasets...", max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_streaming_aggregates(start_date: datetime.date, end_date: datetime.date) -> dict:
+    """Function: Get every aggregation of the timeframe from one pass of the streaming backend"""
+    return streaming.stream_aggregates(start_date, end_date, loader.selected_chunk_size())
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_orders_tab(start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the aggregates of the monthly orders and revenue tab"""
+    if streaming.is_enabled():
+        aggregates = compute_streaming_aggregates(start_date, end_date)
+        return (
+            aggregates["total_orders"],
+            aggregates["total_revenue"],
+            aggregates["monthly_orders_df"],
+            aggregates["customer_order_revenue_city"],
+            aggregates["customer_order_revenue_state"]
+        )
+    if sql_backend.is_enabled():
+        connection = get_sql_connection()
+        total_orders, total_revenue = sql_backend.total_orders_revenue(connection, start_date, end_date)
+        return (
+            total_orders,
+            total_revenue,
+            sql_backend.create_monthly_orders_df(connection, start_date, end_date),
+            sql_backend.create_customer_order_revenue_df(connection, "customer_city", start_date, end_date),
+            sql_backend.create_customer_order_revenue_df(connection, "customer_state", start_date, end_date)
+        )
+
+    rollups = get_rollups()
+    total_orders, total_revenue = rollup.total_orders_revenue(rollups, start_date, end_date)
+    return (
+        total_orders,
+        total_revenue,
+        rollup.create_monthly_orders_df(rollups, start_date, end_date),
+        rollup.create_customer_order_revenue_df(rollups, "customer_city", start_date, end_date),
+        rollup.create_customer_order_revenue_df(rollups, "customer_state", start_date, end_date)
+    )
 
 
-if __name__ == '__main__':
-    # Loading dataset 1
-    dataset_1_df = pd.read_csv(data_path("order_customers_payments_dataset.csv"))
-    datetime_colums = ["order_purchase_timestamp", "order_approved_at", "order_delivered_carrier_date",
-                       "order_delivered_customer_date", "order_estimated_delivery_date"]
-    set_datetime_columns(dataset_1_df, datetime_colums)
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_product_category_tab(start_date: datetime.date, end_date: datetime.date,
+                                 exact: bool = False) -> pd.DataFrame:
+    """Function: Get the aggregates of the product category performance tab. Unless exact, the distinct
+    products of the pandas backend are estimated from the daily sketches"""
+    if streaming.is_enabled():
+        return compute_streaming_aggregates(start_date, end_date)["sum_order_items_df"]
+    if sql_backend.is_enabled():
+        return sql_backend.create_sum_order_items_df(get_sql_connection(), start_date, end_date)
+    if not exact:
+        return sketch.create_sum_order_items_df(get_sketches(), get_rollups(), start_date, end_date)
+    return create_sum_order_items_df(get_timeframe_df("orders_order_items_products_category", start_date, end_date))
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_payment_tab(start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the aggregates of the payment methods tab"""
+    if streaming.is_enabled():
+        aggregates = compute_streaming_aggregates(start_date, end_date)
+        return aggregates["payment_type_df"], aggregates["payment_installments_df"]
+    if sql_backend.is_enabled():
+        connection = get_sql_connection()
+        return (
+            sql_backend.create_payment_type_df(connection, start_date, end_date),
+            sql_backend.create_payment_installments_df(connection, start_date, end_date)
+        )
+
+    rollups = get_rollups()
+    return (
+        rollup.create_payment_type_df(rollups, start_date, end_date),
+        rollup.create_payment_installments_df(rollups, start_date, end_date)
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_review_tab(start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the aggregates of the customer reviews tab"""
+    if streaming.is_enabled():
+        customer_scores_df = compute_streaming_aggregates(start_date, end_date)["customer_scores_df"]
+    elif sql_backend.is_enabled():
+        customer_scores_df = sql_backend.create_customer_scores_df(get_sql_connection(), start_date, end_date)
+    else:
+        customer_scores_df = rollup.create_customer_scores_df(get_rollups(), start_date, end_date)
+    return customer_scores_df, create_satisfied_df(customer_scores_df)
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_rfm_tab(start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the aggregates of the RFM analysis tab, only the rows it shows are kept,
+    with their customer ids decoded"""
+    if streaming.is_enabled():
+        rfm_df = compute_streaming_aggregates(start_date, end_date)["rfm_df"]
+    elif sql_backend.is_enabled():
+        rfm_df = sql_backend.create_rfm_df(get_sql_connection(), start_date, end_date)
+    elif get_live_data().is_whole_timeframe(start_date, end_date):
+        rfm_df = get_live_data().create_rfm_df()
+    else:
+        rfm_df = create_rfm_df(get_timeframe_df("order_customers_payments", start_date, end_date))
+    rfm_df = rfm.score_rfm(rfm_df)
+    return (
+        rfm_df[["recency", "frequency", "monetary"]].mean(),
+        loader.decode_categorical_columns(rfm.top_k(rfm_df, "recency", ascending=True)),
+        loader.decode_categorical_columns(rfm.top_k(rfm_df, "frequency")),
+        loader.decode_categorical_columns(rfm.top_k(rfm_df, "monetary")),
+        rfm.create_segment_summary_df(rfm_df)
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_cohort_tab(start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the monthly cohort retention dataframe of the timeframe"""
+    if streaming.is_enabled():
+        return compute_streaming_aggregates(start_date, end_date)["cohort_df"]
+    if sql_backend.is_enabled():
+        return sql_backend.create_cohort_df(get_sql_connection(), start_date, end_date)
+    return create_cohort_df(get_timeframe_df("order_customers_payments", start_date, end_date))
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_map_tab(start_date: datetime.date, end_date: datetime.date, column: str) -> tuple:
+    """Function: Get the binned orders and revenue of the timeframe located by the customer or seller zip code
+    prefix column, with the share of the orders that could not be located"""
+    if column == "seller_zip_code_prefix":
+        totals_df = sellers.create_seller_totals_df(get_seller_index(get_data_version()), start_date, end_date)
+        return geo.create_map_df(get_centroids(), totals_df[column], totals_df["orders"], totals_df["revenue"])
+
+    if streaming.is_enabled():
+        zip_df = compute_streaming_aggregates(start_date, end_date)["customer_order_revenue_zip"]
+    elif sql_backend.is_enabled():
+        zip_df = sql_backend.create_customer_order_revenue_df(get_sql_connection(), column, start_date, end_date)
+    else:
+        zip_df = create_customer_order_revenue_zip(get_timeframe_df("order_customers_payments", start_date, end_date))
+    return geo.create_map_df(get_centroids(), zip_df[column], zip_df["order"], zip_df["revenue"])
+
+
+# Sellers and locations listed by the seller performance tab
+TOP_SELLERS = 10
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_seller_tab(start_date: datetime.date, end_date: datetime.date, column: str) -> tuple:
+    """Function: Get the number of active sellers and the best sellers, states and cities by column"""
+    seller_totals_df = sellers.create_seller_totals_df(get_seller_index(get_data_version()), start_date, end_date)
+    return (
+        len(seller_totals_df),
+        sellers.top_sellers(seller_totals_df, column, TOP_SELLERS),
+        sellers.top_sellers(sellers.create_location_df(seller_totals_df, "seller_state"), column, TOP_SELLERS),
+        sellers.top_sellers(sellers.create_location_df(seller_totals_df, "seller_city"), column, TOP_SELLERS)
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=TAB_CACHE_ENTRIES)
+@profiling.profiled
+def compute_delivery_tab(start_date: datetime.date, end_date: datetime.date, state: str | None) -> tuple:
+    """Function: Get the delivery figures of every customer state, and of every month for one state or all"""
+    delivery_sketch = get_delivery_sketch()
+    return (
+        delivery.create_state_delivery_df(delivery_sketch, start_date, end_date),
+        delivery.create_monthly_delivery_df(delivery_sketch, start_date, end_date, state)
+    )
+
+
+# Memoized aggregates of the pandas backend reading each dataset, directly or through its rollups and indexes
+DATASET_TABS = {
+    "order_customers_payments": [
+        compute_orders_tab, compute_payment_tab, compute_rfm_tab, compute_cohort_tab, compute_map_tab,
+        compute_delivery_tab
+    ],
+    "orders_order_items_products_category": [compute_product_category_tab, compute_seller_tab, compute_map_tab],
+    "order_reviews": [compute_review_tab, compute_seller_tab, compute_map_tab]
+}
+
+
+BEST_COLORS = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
+WORST_COLORS = ["#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#1230AE"]
+
+
+def plot_monthly_orders(monthly_orders_df: pd.DataFrame, column: str, title: str,
+                        plain_y: bool = False) -> plt.Figure:
+    """Function: Get the line chart of a monthly orders column"""
+    fig, ax = plt.subplots(figsize=(16, 8))
+    ax.plot(
+        monthly_orders_df["order_month"],
+        monthly_orders_df[column],
+        marker='o',
+        linewidth=0.75,
+        color="#1230AE"
+    )
+    ax.set_title(title, loc="left", fontsize=18)
+    if plain_y:
+        ax.ticklabel_format(style='plain', axis='y')
+    ax.tick_params(axis='y', labelsize=15)
+    ax.tick_params(axis='x', labelsize=15, rotation=90)
+    return fig
+
+
+def plot_best_city_state(best_city_df: pd.DataFrame, best_state_df: pd.DataFrame, column: str,
+                         title: str) -> plt.Figure:
+    """Function: Get the bar charts of the best cities and states by column"""
+    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
+
+    sns.barplot(x="customer_city", y=column, data=best_city_df, palette=BEST_COLORS, ax=ax[0], hue="customer_city")
+    ax[0].set_ylabel(None)
+    ax[0].set_xlabel(None)
+    ax[0].set_title(title + " City", loc="center", fontsize=25)
+    ax[0].tick_params(axis='y', labelsize=20)
+    ax[0].tick_params(axis='x', labelsize=18)
+
+    sns.barplot(x="customer_state", y=column, data=best_state_df, palette=BEST_COLORS, ax=ax[1],
+                hue="customer_state")
+    ax[1].set_ylabel(None)
+    ax[1].set_xlabel(None)
+    ax[1].yaxis.set_label_position("right")
+    ax[1].yaxis.tick_right()
+    ax[1].set_title(title + " State", loc="center", fontsize=25)
+    ax[1].tick_params(axis='y', labelsize=20)
+    ax[1].tick_params(axis='x', labelsize=20)
+    return fig
+
+
+def plot_category_performance(best_df: pd.DataFrame, worst_df: pd.DataFrame, column: str) -> plt.Figure:
+    """Function: Get the bar charts of the best and worst product categories by column"""
+    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
+
+    sns.barplot(x=column, y="product_category", data=best_df, palette=BEST_COLORS, ax=ax[0], hue="product_category")
+    ax[0].set_ylabel(None)
+    ax[0].set_xlabel(None)
+    ax[0].set_title("Best Performing Product Category", loc="left", fontsize=25)
+    ax[0].tick_params(axis='y', labelsize=20)
+    ax[0].tick_params(axis='x', labelsize=20)
+
+    sns.barplot(x=column, y="product_category", data=worst_df, palette=WORST_COLORS, ax=ax[1],
+                hue="product_category")
+    ax[1].set_ylabel(None)
+    ax[1].set_xlabel(None)
+    ax[1].invert_xaxis()
+    ax[1].yaxis.set_label_position("right")
+    ax[1].yaxis.tick_right()
+    ax[1].set_title("Worst Performing Product Category", loc="right", fontsize=25)
+    ax[1].tick_params(axis='y', labelsize=20)
+    ax[1].tick_params(axis='x', labelsize=20)
+    return fig
+
+
+def plot_payment_methods(payment_type_df: pd.DataFrame, payment_installments_df: pd.DataFrame) -> plt.Figure:
+    """Function: Get the bar charts of the payment types and of the use of installments"""
+    fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
+
+    sns.barplot(x="payment_type", y="count", data=payment_type_df, palette=BEST_COLORS, ax=ax[0],
+                hue="payment_type")
+    ax[0].set_ylabel(None)
+    ax[0].set_xlabel(None)
+    ax[0].set_title("Best Payment Type", loc="center", fontsize=25)
+    ax[0].tick_params(axis='y', labelsize=20)
+    ax[0].tick_params(axis='x', labelsize=20)
+
+    sns.barplot(x="use_installment", y="count", data=payment_installments_df, palette=["#D3D3D3", "#1230AE"],
+                ax=ax[1], hue="use_installment", legend=False)
+    ax[1].set_ylabel(None)
+    ax[1].set_xlabel(None)
+    ax[1].yaxis.set_label_position("right")
+    ax[1].yaxis.tick_right()
+    ax[1].set_title("Use Installment?", loc="center", fontsize=25)
+    ax[1].tick_params(axis='y', labelsize=20)
+    ax[1].tick_params(axis='x', labelsize=20)
+    return fig
+
+
+def plot_review_scores(customer_scores_df: pd.DataFrame) -> plt.Figure:
+    """Function: Get the bar chart of the review scores, the most frequent one highlighted"""
+    colors = ["#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
+    colors[int(customer_scores_df["count"].argmax())] = "#1230AE"
+
+    fig, ax = plt.subplots(figsize=(16, 8))
+    sns.barplot(x="review_score", y="count", data=customer_scores_df,
+                palette=colors, hue="review_score", legend=False, ax=ax)
+    ax.set_ylabel(None)
+    ax.set_xlabel(None)
+    ax.set_title("Customer Review Score", loc="left", fontsize=20)
+    ax.tick_params(axis='y', labelsize=15)
+    ax.tick_params(axis='x', labelsize=15)
+    return fig
+
+
+def plot_rfm_customers(top_df: pd.DataFrame, column: str) -> plt.Figure:
+    """Function: Get the bar chart of the best customers by an RFM parameter"""
+    fig, ax = plt.subplots(figsize=(16, 8))
+    sns.barplot(y="customer_id", x=column, data=top_df, palette=BEST_COLORS, hue="customer_id", ax=ax)
+    ax.set_ylabel(None)
+    ax.set_xlabel(None)
+    ax.tick_params(axis='y', labelsize=18)
+    ax.tick_params(axis='x', labelsize=20)
+    return fig
+
+
+def plot_cohort_heatmap(cohort_df: pd.DataFrame, column: str, title: str) -> plt.Figure:
+    """Function: Get the heatmap of a cohort column, cohorts as rows and months since the first order as
+    columns, the cells yet to come left blank"""
+    labels = cohort_df["cohort"].unique()
+    ages = len(cohort_df) // len(labels)
+    values = cohort_df[column].to_numpy(dtype=np.float64).reshape(len(labels), ages)
+    future = cohort_df["retention"].isna().to_numpy().reshape(len(labels), ages)
+    # Retention is 100% at age 0, the colors are scaled on the later months
+    vmax = np.nanmax(np.where(future, np.nan, values)[:, 1:]) if column == "retention" and ages > 1 else None
+    fig, ax = plt.subplots(figsize=(16, max(6, 0.4 * len(labels))))
+    sns.heatmap(values, mask=future, vmax=vmax, annot=values.size <= 600, fmt=".0f", cmap="Blues", cbar=True,
+                xticklabels=range(ages), yticklabels=labels, annot_kws={"fontsize": 9}, ax=ax)
+    ax.set_title(title, loc="left", fontsize=18)
+    ax.set_xlabel("Months since the first order", fontsize=15)
+    ax.set_ylabel(None)
+    ax.tick_params(axis='both', labelsize=12)
+    return fig
+
+
+def plot_delivery_quantiles(monthly_delivery_df: pd.DataFrame, duration: str, title: str) -> plt.Figure:
+    """Function: Get the line chart of the monthly percentiles of a delivery duration"""
+    fig, ax = plt.subplots(figsize=(16, 8))
+    for quantile, color in zip(delivery.QUANTILES, ["#1230AE", "#6C48C5", "#C68FE6"]):
+        label = "p{:g}".format(quantile * 100)
+        ax.plot(
+            monthly_delivery_df["order_month"],
+            monthly_delivery_df["{}_{}".format(duration, label)],
+            marker='o',
+            linewidth=0.75,
+            color=color,
+            label=label
+        )
+    ax.set_title(title, loc="left", fontsize=18)
+    ax.legend(fontsize=15)
+    ax.tick_params(axis='y', labelsize=15)
+    ax.tick_params(axis='x', labelsize=15, rotation=90)
+    return fig
+
+
+def plot_orders_map(map_df: pd.DataFrame, column: str, title: str) -> plt.Figure:
+    """Function: Get the bubble map of a column of the binned orders, the areas of the bubbles proportional
+    to it"""
+    south, north, west, east = geo.BOUNDS
+    values = map_df[column].to_numpy(dtype=np.float64)
+    # Largest bubbles first, so the small ones stay visible on top
+    order = np.argsort(-values, kind="stable")
+    sizes = values / values.max() * 400 if len(values) and values.max() > 0 else values
+    fig, ax = plt.subplots(figsize=(12, 12))
+    points = ax.scatter(map_df["lng"].to_numpy()[order], map_df["lat"].to_numpy()[order], s=sizes[order],
+                        c=values[order], cmap="Blues", alpha=0.8, edgecolors="#1230AE", linewidths=0.5)
+    if len(values):
+        fig.colorbar(points, ax=ax, shrink=0.6)
+    ax.set_xlim(west, east)
+    ax.set_ylim(south, north)
+    ax.set_aspect("equal")
+    ax.set_title(title, loc="left", fontsize=18)
+    ax.set_xlabel("Longitude", fontsize=15)
+    ax.set_ylabel("Latitude", fontsize=15)
+    ax.tick_params(axis='both', labelsize=12)
+    return fig
+
+
+def format_brl(value: float | None) -> str:
+    """Function: Get an amount formatted as Brazilian reais"""
+    return "-" if value is None else format_currency(value, "BRL", locale="pt_BR")
+
+
+def format_percentage(value: float | None) -> str:
+    """Function: Get a percentage rounded to two decimals"""
+    return "-" if value is None else "{}%".format(round(value, 2))
+
+
+def show_orders_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the monthly orders and revenue tab"""
+    total_orders, total_revenue, monthly_orders_df, customer_order_revenue_city, customer_order_revenue_state = \
+        compute_orders_tab(start_date, end_date)
+
+    figures = metrics.orders_metrics(total_orders, total_revenue, customer_order_revenue_city,
+                                     customer_order_revenue_state)
+
+    st.subheader('Monthly Orders and Revenue')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Total orders", value=figures["total_orders"])
+    with col2:
+        st.metric("Total Revenue", value=format_brl(figures["total_revenue"]))
+
+    charts.show_chart(plot_monthly_orders, monthly_orders_df, column="order_count",
+                      title="Number of Orders per Month")
+
+    charts.show_chart(plot_monthly_orders, monthly_orders_df, column="revenue",
+                      title="Total of Revenue per Month", plain_y=True)
+
+    st.write(" ")
+
+    st.subheader('Best Number of Orders by City and State')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("City with the most orders", value=metrics.format_label(figures["top_city_by_orders"]))
+        st.metric("Total orders for the city above", value=figures["top_city_orders"])
+
+    with col2:
+        st.metric("State with the most orders", value=metrics.format_label(figures["top_state_by_orders"], upper=True))
+        st.metric("Total orders for the state above", value=figures["top_state_orders"])
+
+    charts.show_chart(plot_best_city_state,
+                      customer_order_revenue_city.sort_values(by="order", ascending=False).head(5),
+                      customer_order_revenue_state.sort_values(by="order", ascending=False).head(5),
+                      column="order", title="Best Number of Orders by")
+
+    st.write(" ")
+
+    st.subheader('Best Total Revenue by City and State')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("City with the most total revenue", value=metrics.format_label(figures["top_city_by_revenue"]))
+        st.metric("Total revenue for the city above", value=format_brl(figures["top_city_revenue"]))
+
+    with col2:
+        st.metric("State with the most total revenue",
+                  value=metrics.format_label(figures["top_state_by_revenue"], upper=True))
+        st.metric("Total revenue for the state above", value=format_brl(figures["top_state_revenue"]))
+
+    charts.show_chart(plot_best_city_state,
+                      customer_order_revenue_city.sort_values(by="revenue", ascending=False).head(5),
+                      customer_order_revenue_state.sort_values(by="revenue", ascending=False).head(5),
+                      column="revenue", title="Best Total Revenue by")
+
+
+def show_product_category_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the product category performance tab"""
+    sum_order_items_df = compute_product_category_tab(start_date, end_date,
+                                                      st.session_state.get("exact_distinct", False))
+
+    figures = metrics.category_metrics(sum_order_items_df)
+
+    st.subheader("Best Performing Product Category by Number of Orders")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Best Orders Category", value=metrics.format_label(figures["best_category_by_orders"]))
+    with col2:
+        st.metric("Num of Orders", value=figures["best_category_orders"])
+
+    charts.show_chart(plot_category_performance,
+                      sum_order_items_df.sort_values(by="count", ascending=False).head(5),
+                      sum_order_items_df.sort_values(by="count", ascending=False).tail(5),
+                      column="count")
 
-    # Loading dataset 2
-    dataset_2_df = pd.read_csv(data_path("orders_order_items_products_category_dataset.csv"))
-    set_datetime_columns(dataset_2_df, ["shipping_limit_date"])
+    st.write(" ")
 
-    # Loading dataset 3
-    order_reviews_df = pd.read_csv(data_path("order_reviews_dataset.csv"))
-    set_datetime_columns(order_reviews_df, ["review_creation_date", "review_answer_timestamp"])
+    st.subheader("Best Performing Product Category by Total Revenue")
 
-    min_date = dataset_1_df["order_purchase_timestamp"].min()
-    max_date = dataset_1_df["order_purchase_timestamp"].max()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Best Revenue Category", value=metrics.format_label(figures["best_category_by_revenue"]))
+    with col2:
+        st.metric("Total Revenue Category", value=format_brl(figures["best_category_revenue"]))
+
+    charts.show_chart(plot_category_performance,
+                      sum_order_items_df.sort_values(by="revenue", ascending=False).head(5),
+                      sum_order_items_df.sort_values(by="revenue", ascending=False).tail(5),
+                      column="revenue")
+
+
+def show_payment_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the payment methods tab"""
+    payment_type_df, payment_installments_df = compute_payment_tab(start_date, end_date)
+
+    figures = metrics.payment_metrics(payment_type_df, payment_installments_df)
+
+    st.subheader("Best Payment Method")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Best Payment Method", value=metrics.format_label(figures["best_payment_method"]))
+    with col2:
+        st.metric("Percentage using installments", value=format_percentage(figures["installment_percentage"]))
+
+    charts.show_chart(plot_payment_methods, payment_type_df.head(5), payment_installments_df.head(5))
+
+
+def show_review_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the customer reviews tab"""
+    customer_scores_df, satisfied_df = compute_review_tab(start_date, end_date)
+
+    figures = metrics.review_metrics(satisfied_df)
+
+    st.subheader("Customer Review Scores")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Percentage of satisfied (4-5:star:)", value=format_percentage(figures["satisfied_percentage"]))
+    with col2:
+        st.metric("Percentage of dissatisfied (1-3:star:)",
+                  value=format_percentage(figures["not_satisfied_percentage"]))
+
+    charts.show_chart(plot_review_scores, customer_scores_df)
+
+    st.subheader("New Review Messages")
+    show_review_browser(start_date, end_date)
+
+
+@st.fragment
+def show_review_browser(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show one page of the review messages matching the search, reran alone on every change"""
+    index = get_review_index(get_data_version())
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        query = st.text_input("Search the titles and messages", key="review_query",
+                              placeholder="Keywords, e.g. entrega atrasada")
+    with col2:
+        scores = st.multiselect("Scores", [1, 2, 3, 4, 5], default=[1, 2, 3, 4, 5], key="review_scores")
+
+    positions = reviews.search_reviews(index, start_date, end_date, scores, query)
+    pages = max(1, -(-len(positions) // reviews.PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key="review_page")
+    page = min(page, pages)
+
+    st.dataframe(reviews.review_page(index, positions, page - 1), hide_index=True, use_container_width=True)
+    st.caption("Reviews {:,}-{:,} of {:,}".format(min((page - 1) * reviews.PAGE_SIZE + 1, len(positions)),
+                                                  min(page * reviews.PAGE_SIZE, len(positions)), len(positions)))
+
+
+# Label -> column of the cohort heatmap
+COHORT_MEASURES = {
+    "Retention (%)": "retention",
+    "Customers": "customers",
+    "Orders": "orders",
+    "Revenue (R$)": "revenue"
+}
+
+
+def show_rfm_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the RFM analysis tab"""
+    rfm_means, top_recency_df, top_frequency_df, top_monetary_df, segment_summary_df = \
+        compute_rfm_tab(start_date, end_date)
+
+    figures = metrics.rfm_metrics(rfm_means)
+
+    st.subheader("Best Customer Based on RFM Parameters")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Average Recency (days)",
+                  value="-" if figures["average_recency"] is None else round(figures["average_recency"], 1))
+    with col2:
+        st.metric("Average Frequency",
+                  value="-" if figures["average_frequency"] is None else round(figures["average_frequency"], 2))
+    with col3:
+        st.metric("Average Monetary", value=format_brl(figures["average_monetary"]))
+
+    st.caption('There is no customer name, only customer_unique_id')
+
+    st.subheader("By Recency (days)")
+
+    charts.show_chart(plot_rfm_customers, top_recency_df, column="recency")
+
+    st.subheader("By Frequency")
+    charts.show_chart(plot_rfm_customers, top_frequency_df, column="frequency")
+
+    st.subheader("By Monetary (R$)")
+    charts.show_chart(plot_rfm_customers, top_monetary_df, column="monetary")
+
+    st.subheader("Customer Segments")
+    st.caption("Customers are scored 1-5 on each RFM parameter by quintile (5 is best) "
+               "and segmented by their recency and frequency scores")
+    st.dataframe(segment_summary_df, hide_index=True, use_container_width=True)
+
+    st.subheader("Monthly Cohorts")
+    label = st.selectbox("Cohort measure", list(COHORT_MEASURES), key="cohort_measure")
+    cohort_df = compute_cohort_tab(start_date, end_date)
+    if cohort_df.empty:
+        st.caption("No delivered orders within the timeframe")
+        return
+    charts.show_chart(plot_cohort_heatmap, cohort_df, column=COHORT_MEASURES[label],
+                      title="{} by Month of First Order".format(label))
+    st.caption("Customers are grouped by the month of their first delivered order within the timeframe. "
+               "Retention is the share of a cohort ordering again that many months later")
+
+
+# Label -> delivery duration of the delivery performance tab
+DELIVERY_DURATIONS = {
+    "Delivery time (days)": "delivery_days",
+    "Carrier handoff (days)": "carrier_days",
+    "Approval lag (hours)": "approval_hours"
+}
+
+
+def show_delivery_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the delivery performance tab"""
+    col1, col2 = st.columns(2)
+    with col1:
+        label = st.selectbox("Duration", list(DELIVERY_DURATIONS), key="delivery_duration")
+    state_df, _ = compute_delivery_tab(start_date, end_date, None)
+    with col2:
+        state = st.selectbox("Customer state", ["All states"] + list(state_df["customer_state"].iloc[:-1]),
+                             key="delivery_state")
+    state = None if state == "All states" else state
+    state_df, monthly_df = compute_delivery_tab(start_date, end_date, state)
+    duration = DELIVERY_DURATIONS[label]
+    total = state_df.iloc[-1]
+
+    st.subheader("Delivery Performance")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Median delivery time (days)",
+                  value="-" if pd.isna(total["delivery_days_p50"]) else round(total["delivery_days_p50"], 1))
+    with col2:
+        st.metric("90th percentile delivery time (days)",
+                  value="-" if pd.isna(total["delivery_days_p90"]) else round(total["delivery_days_p90"], 1))
+    with col3:
+        st.metric("Median approval lag (hours)",
+                  value="-" if pd.isna(total["approval_hours_p50"]) else round(total["approval_hours_p50"], 1))
+    with col4:
+        st.metric("Late deliveries", value=format_percentage(None if pd.isna(total["late_rate"])
+                                                             else total["late_rate"]))
+
+    charts.show_chart(plot_delivery_quantiles, monthly_df, duration=duration,
+                      title="{} per Month, {}".format(label, metrics.format_label(state, upper=True)
+                                                      if state else "All States"))
+    charts.show_chart(plot_monthly_orders, monthly_df, column="late_rate",
+                      title="Late Deliveries per Month (%)")
+
+    st.subheader("By Customer State")
+    columns = {"customer_state": "State", "orders": "Orders", "late_rate": "Late (%)"}
+    columns.update({"{}_p{:g}".format(duration, quantile * 100): "{} p{:g}".format(label, quantile * 100)
+                    for quantile in delivery.QUANTILES})
+    st.dataframe(state_df[list(columns)].round(1).rename(columns=columns), hide_index=True,
+                 use_container_width=True)
+    st.caption("Percentiles are within {:.0%} of the exact ones. An order is late when it reaches the customer "
+               "on a later day than estimated".format(delivery.RELATIVE_ERROR))
+
+
+# Display names of the seller and location columns
+SELLER_COLUMNS = {
+    "seller_id": "Seller",
+    "seller_state": "State",
+    "seller_city": "City",
+    "sellers": "Sellers",
+    "revenue": "Revenue (R$)",
+    "orders": "Orders",
+    "products": "Distinct products",
+    "review_score": "Average review score",
+    "on_time_rate": "On-time shipping (%)"
+}
+
+
+def format_seller_df(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the displayed columns of seller or location totals"""
+    columns = [column for column in SELLER_COLUMNS if column in dataframe.columns]
+    result_df = dataframe[columns].round({"revenue": 2, "review_score": 2, "on_time_rate": 1})
+    return result_df.rename(columns=SELLER_COLUMNS)
+
+
+def show_seller_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the seller performance tab"""
+    ranking = st.selectbox("Rank by", list(sellers.RANKINGS), key="seller_ranking")
+    column = sellers.RANKINGS[ranking]
+    active_sellers, top_sellers_df, top_states_df, top_cities_df = compute_seller_tab(start_date, end_date, column)
+
+    st.subheader("Best Sellers by {}".format(ranking))
+    st.metric("Sellers with sales", value=active_sellers)
+    if column in sellers.RANKED_COUNTS:
+        st.caption("Only the sellers with at least {} {} are ranked".format(
+            sellers.MIN_RANKED_COUNT, "reviews" if column == "review_score" else "shipped items"))
+    st.dataframe(format_seller_df(top_sellers_df), hide_index=True, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Best Seller States")
+        st.dataframe(format_seller_df(top_states_df), hide_index=True, use_container_width=True)
+    with col2:
+        st.subheader("Best Seller Cities")
+        st.dataframe(format_seller_df(top_cities_df), hide_index=True, use_container_width=True)
+    st.caption("An order with items of several sellers counts for each of them")
+
+    st.subheader("Seller Details")
+    show_seller_details(start_date, end_date, None if top_sellers_df.empty else top_sellers_df.loc[0, "seller_id"])
+
+
+@st.fragment
+def show_seller_details(start_date: datetime.date, end_date: datetime.date, default_seller: str | None) -> None:
+    """Procedure: Show the figures and monthly orders of one seller, reran alone when the seller changes"""
+    seller_id = st.text_input("Seller id", value=default_seller or "", key="seller_id").strip()
+    index = get_seller_index(get_data_version())
+    code = sellers.find_seller(index, seller_id)
+    if code is None:
+        st.caption("No seller {!r}".format(seller_id) if seller_id else "Enter a seller id")
+        return
+
+    seller_df = sellers.create_seller_totals_df(index, start_date, end_date, [code])
+    if seller_df.empty:
+        st.caption("The seller sold nothing within the timeframe")
+        return
+    seller = seller_df.iloc[0].replace({np.nan: None})
+
+    st.caption("{}, {}".format(metrics.format_label(seller["seller_city"]),
+                               metrics.format_label(seller["seller_state"], upper=True)))
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("Revenue", value=format_brl(seller["revenue"]))
+    with col2:
+        st.metric("Orders", value=int(seller["orders"]))
+    with col3:
+        st.metric("Distinct products", value=int(seller["products"]))
+    with col4:
+        st.metric("Average review score",
+                  value="-" if seller["review_score"] is None else round(seller["review_score"], 2))
+    with col5:
+        st.metric("On-time shipping", value=format_percentage(seller["on_time_rate"]))
+
+    monthly_df = sellers.create_seller_monthly_df(index, code, start_date, end_date)
+    charts.show_chart(plot_monthly_orders, monthly_df, column="order_count", title="Number of Orders per Month")
+    charts.show_chart(plot_monthly_orders, monthly_df, column="revenue", title="Total of Revenue per Month",
+                      plain_y=True)
+
+
+# Label -> zip code prefix column locating the orders of the map tab
+MAP_SIDES = {
+    "Customers": "customer_zip_code_prefix",
+    "Sellers": "seller_zip_code_prefix"
+}
+MAP_MEASURES = {
+    "Orders": "orders",
+    "Revenue": "revenue"
+}
+
+
+def show_map_tab(start_date: datetime.date, end_date: datetime.date) -> None:
+    """Procedure: Show the orders map tab"""
+    col1, col2 = st.columns(2)
+    with col1:
+        side = st.selectbox("Locate by", list(MAP_SIDES), key="map_side")
+    with col2:
+        measure = st.selectbox("Measure", list(MAP_MEASURES), key="map_measure")
+    map_df, unlocated = compute_map_tab(start_date, end_date, MAP_SIDES[side])
+
+    st.subheader("Orders Map")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Located orders", value=int(map_df["orders"].sum()))
+    with col2:
+        st.metric("Located revenue", value=format_brl(map_df["revenue"].sum()))
+    with col3:
+        st.metric("Orders not located", value=format_percentage(unlocated))
+
+    charts.show_chart(plot_orders_map, map_df, column=MAP_MEASURES[measure],
+                      title="{} by {} Location".format(measure, side[:-1]))
+    st.caption("Orders are located at the centroid of the zip code prefix of the {}, in cells of {:g} degrees. "
+               "{}".format(side.lower(), geo.BIN_DEGREES,
+                           "An order of several sellers counts for each of them, and their revenue is the price "
+                           "of their items." if side == "Sellers" else "The revenue is the payment value."))
+
+
+TABS = {
+    "Monthly Orders and Revenue": show_orders_tab,
+    "Product Category Performance": show_product_category_tab,
+    "Payment Methods": show_payment_tab,
+    "Customer Reviews": show_review_tab,
+    "RFM Analysis": show_rfm_tab,
+    "Seller Performance": show_seller_tab,
+    "Delivery Performance": show_delivery_tab,
+    "Orders Map": show_map_tab
+}
+
+
+# Reruns of a session kept for the JSON lines export of the debug panel
+PROFILE_EXPORT_RERUNS = 50
+
+
+def record_profile(recorder: profiling.Recorder) -> int:
+    """Function: Add the records of a rerun to the session and process totals and to the log file,
+    returning the number of the rerun in the session"""
+    records = recorder.sorted_records()
+    session_id = st.session_state.setdefault("profiling_session", uuid.uuid4().hex)
+    rerun = st.session_state["profiling_reruns"] = st.session_state.get("profiling_reruns", 0) + 1
+    st.session_state.setdefault("profiling_totals", profiling.StageTotals()).add(records)
+    profiling.PROCESS_TOTALS.add(records)
+
+    json_lines = profiling.to_json_lines(records, session=session_id, rerun=rerun, timestamp=time.time())
+    st.session_state.setdefault("profiling_log", deque(maxlen=PROFILE_EXPORT_RERUNS)).append(json_lines)
+    profiling.append_log(json_lines)
+    return rerun
+
+
+def show_profiling_panel(recorder: profiling.Recorder, rerun: int) -> None:
+    """Procedure: Show the stages of the rerun and the totals of the session in the sidebar, with their exports"""
+    records = recorder.sorted_records()
+
+    records_df = pd.DataFrame({
+        "stage": [". " * record.depth + record.stage for record in records],
+        "wall (ms)": [record.wall_seconds * 1000 for record in records],
+        "CPU (ms)": [record.cpu_seconds * 1000 for record in records],
+        "rows in": pd.array([record.rows_in for record in records], dtype="Int64"),
+        "rows out": pd.array([record.rows_out for record in records], dtype="Int64"),
+        "memory (MB)": [None if record.memory_delta_bytes is None else record.memory_delta_bytes / 2 ** 20
+                        for record in records]
+    })
+    with st.sidebar.expander("Profiling", expanded=True):
+        st.caption("Rerun {}: {:.1f} ms in {} profiled stages, {:.1f} ms of the whole rerun".format(
+            rerun, sum(record.wall_seconds for record in records if record.depth == 0) * 1000, len(records),
+            (time.perf_counter() - recorder.started) * 1000))
+        st.dataframe(records_df, hide_index=True, use_container_width=True)
+        st.caption("Session totals")
+        st.dataframe(st.session_state["profiling_totals"].create_totals_df(), hide_index=True,
+                     use_container_width=True)
+        st.download_button("Session profile (JSON lines)", "".join(st.session_state["profiling_log"]),
+                           file_name="profile.jsonl", mime="application/x-ndjson")
+        st.download_button("Process metrics (Prometheus)", profiling.PROCESS_TOTALS.to_prometheus(),
+                           file_name="metrics.prom", mime="text/plain")
+
+
+def show_dashboard() -> None:
+    """Procedure: Show the whole dashboard"""
+    load_start = time.perf_counter()
+    if streaming.is_enabled():
+        # The source files are read in chunks for every timeframe, nothing is kept loaded
+        min_date, max_date = get_streaming_date_range()
+        load_caption = "Data streamed in chunks of {:,} rows".format(loader.selected_chunk_size())
+    elif sql_backend.is_enabled():
+        # The SQL engine reads the Parquet files itself, nothing is loaded into pandas
+        min_date, max_date = sql_backend.date_range(get_sql_connection())
+        load_caption = "Data queried by DuckDB in {:.1f} ms".format((time.perf_counter() - load_start) * 1000)
+    else:
+        # Loading datasets (cached once per process, the dataframes must not be modified)
+        _, load_stats = get_datasets()
+        live_data = get_live_data()
+        warm_load_seconds = time.perf_counter() - load_start
+        load_caption = "Data loaded in {:.0f} ms (cold), {:.1f} ms (this rerun)".format(
+            load_stats["cold_seconds"] * 1000, warm_load_seconds * 1000)
+
+        # Aggregates memoized before the last ingested deltas are stale, only those reading their datasets
+        for name in live_data.publish():
+            for compute_tab in DATASET_TABS[name]:
+                compute_tab.clear()
+        if live_data.ingested:
+            load_caption += ", {} delta files ingested".format(len(live_data.ingested))
+
+        min_date, max_date = live_data.purchase_range
 
     with st.sidebar:
         st.image("https://streamlit.io/images/brand/streamlit-logo-primary-colormark-darktext.png")
@@ -183,385 +1185,38 @@ if __name__ == '__main__':
             value=[min_date, max_date]
         )
 
+        if loader.selected_backend() == "pandas":
+            st.toggle("Exact distinct counts", key="exact_distinct",
+                      help="Count the distinct products of every category over the rows of the timeframe instead of "
+                           "estimating them from daily sketches (standard error {:.1%})".format(sketch.STANDARD_ERROR))
+
         st.caption("Use light mode for best visualization. Change from \"⋮\" → \"Settings\" → \"Theme\"")
+        st.caption(load_caption)
+        chart_stats_placeholder = st.empty()
 
-    # Perform date filtering on 3 main datasets
-    main_1_df = dataset_1_df[(dataset_1_df["order_purchase_timestamp"] >= str(start_date))
-                             & (dataset_1_df["order_purchase_timestamp"] <= str(end_date))]
-    main_2_df = dataset_2_df[(dataset_2_df["order_purchase_timestamp"] >= str(start_date))
-                             & (dataset_2_df["order_purchase_timestamp"] <= str(end_date))]
-    main_3_df = order_reviews_df[(order_reviews_df["review_creation_date"] >= str(start_date))
-                                 & (order_reviews_df["review_creation_date"] <= str(end_date))]
-
-    # Preparing various dataframes
-    monthly_orders_df = create_monthly_orders_df(main_1_df)
-    sum_order_items_df = create_sum_order_items_df(main_2_df)
-    payment_type_df = create_payment_type_df(main_1_df)
-    payment_installments_df = create_payment_installments_df(main_1_df)
-    customer_order_revenue_city = create_customer_order_revenue_city(main_1_df)
-    customer_order_revenue_state = create_customer_order_revenue_state(main_1_df)
-    customer_scores_df = create_customer_scores_df(main_3_df)
-    satisfied_df = create_satisfied_df(customer_scores_df)
-    rfm_df = create_rfm_df(main_1_df)
-
-    # Dashboard
+    # Dashboard, only the selected tab is computed and rendered
     st.header('E-Commerce Public Dataset Analysis :sparkles:')
 
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "Monthly Orders and Revenue",
-        "Product Category Performance",
-        "Payment Methods",
-        "Customer Reviews",
-        "RFM Analysis"
-    ])
-
-    with tab1:
-        st.subheader('Monthly Orders and Revenue')
-
-        col1, col2 = st.columns(2)
-        with col1:
-            total_orders = main_1_df["order_id"].nunique()
-            st.metric("Total orders", value=total_orders)
-        with col2:
-            total_revenue = format_currency(main_1_df["payment_value"].sum(), "BRL", locale="pt_BR")
-            st.metric("Total Revenue", value=total_revenue)
-
-        fig, ax = plt.subplots(figsize=(16, 8))
-        ax.plot(
-            monthly_orders_df["order_month"],
-            monthly_orders_df["order_count"],
-            marker='o',
-            linewidth=0.75,
-            color="#1230AE"
-        )
-        ax.set_title("Number of Orders per Month", loc="left", fontsize=18)
-        ax.tick_params(axis='y', labelsize=15)
-        ax.tick_params(axis='x', labelsize=15, rotation=90)
+    selected_tab = st.radio("Tab", list(TABS), horizontal=True, label_visibility="collapsed", key="tab")
+    TABS[selected_tab](start_date, end_date)
 
-        st.pyplot(fig)
+    chart_stats = charts.CHART_CACHE.stats()
+    chart_stats_placeholder.caption("Charts: {} cache hits, {} rendered ({:.1f} MB), {:.1f} MB cached".format(
+        chart_stats["hits"], chart_stats["misses"], chart_stats["rendered_bytes"] / 2 ** 20,
+        chart_stats["cached_bytes"] / 2 ** 20))
 
-        fig, ax = plt.subplots(figsize=(16, 8))
-        ax.plot(
-            monthly_orders_df["order_month"],
-            monthly_orders_df["revenue"],
-            marker='o',
-            linewidth=0.75,
-            color="#1230AE"
-        )
-        ax.set_title("Total of Revenue per Month", loc="left", fontsize=18)
-        ax.ticklabel_format(style='plain', axis='y')
-        ax.tick_params(axis='y', labelsize=15)
-        ax.tick_params(axis='x', labelsize=15, rotation=90)
-
-        st.pyplot(fig)
-
-        st.write(" ")
-
-        st.subheader('Best Number of Orders by City and State')
-
-        col1, col2 = st.columns(2)
-        with col1:
-            best_total_order_city_idx = customer_order_revenue_city["order"].idxmax()
-            best_total_order_city = customer_order_revenue_city.loc[best_total_order_city_idx, "customer_city"]
-            best_total_order_city = " ".join(best_total_order_city.split("_")).capitalize()
-            st.metric("City with the most orders", value=best_total_order_city)
-
-            best_total_order_city_value = customer_order_revenue_city.loc[best_total_order_city_idx, "order"]
-            st.metric("Total orders for the city above", value=best_total_order_city_value)
-
-        with col2:
-            best_total_order_state_idx = customer_order_revenue_state["order"].idxmax()
-            best_total_order_state = customer_order_revenue_state.loc[best_total_order_state_idx, "customer_state"]
-            best_total_order_state = " ".join(best_total_order_state.split("_")).upper()
-            st.metric("State with the most orders", value=best_total_order_state)
-
-            best_total_order_state_value = customer_order_revenue_state.loc[best_total_order_state_idx, "order"]
-            st.metric("Total orders for the state above", value=best_total_order_state_value)
-
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
-        colors = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-
-        sns.barplot(x="customer_city", y="order",
-                    data=customer_order_revenue_city.sort_values(by="order", ascending=False).head(5),
-                    palette=colors, ax=ax[0], hue="customer_city")
-        ax[0].set_ylabel(None)
-        ax[0].set_xlabel(None)
-        ax[0].set_title("Best Number of Orders by City", loc="center", fontsize=25)
-        ax[0].tick_params(axis='y', labelsize=20)
-        ax[0].tick_params(axis='x', labelsize=18)
-
-        sns.barplot(x="customer_state", y="order",
-                    data=customer_order_revenue_state.sort_values(by="order", ascending=False).head(5),
-                    palette=colors, ax=ax[1], hue="customer_state")
-        ax[1].set_ylabel(None)
-        ax[1].set_xlabel(None)
-        ax[1].yaxis.set_label_position("right")
-        ax[1].yaxis.tick_right()
-        ax[1].set_title("Best Number of Orders by State", loc="center", fontsize=25)
-        ax[1].tick_params(axis='y', labelsize=20)
-        ax[1].tick_params(axis='x', labelsize=20)
-
-        st.pyplot(fig)
-
-        st.write(" ")
-
-        st.subheader('Best Total Revenue by City and State')
-
-        col1, col2 = st.columns(2)
-        with col1:
-            best_total_revenue_city_idx = customer_order_revenue_city["revenue"].idxmax()
-            best_total_revenue_city = customer_order_revenue_city.loc[best_total_revenue_city_idx, "customer_city"]
-            best_total_revenue_city = " ".join(best_total_revenue_city.split("_")).capitalize()
-            st.metric("City with the most total revenue", value=best_total_revenue_city)
-
-            best_total_revenue_city_value = customer_order_revenue_city.loc[best_total_revenue_city_idx, "revenue"]
-            best_total_revenue_city_value = format_currency(best_total_revenue_city_value, "BRL", locale="pt_BR")
-            st.metric("Total revenue for the city above", value=best_total_revenue_city_value)
-
-        with col2:
-            best_total_revenue_state_idx = customer_order_revenue_state["revenue"].idxmax()
-            best_total_revenue_state = customer_order_revenue_state.loc[best_total_revenue_state_idx, "customer_state"]
-            best_total_revenue_state = " ".join(best_total_revenue_state.split("_")).upper()
-            st.metric("State with the most total revenue", value=best_total_revenue_state)
-
-            best_total_revenue_state_value = customer_order_revenue_state.loc[best_total_revenue_state_idx, "revenue"]
-            best_total_revenue_state_value = format_currency(best_total_revenue_state_value, "BRL", locale="pt_BR")
-            st.metric("Total revenue for the state above", value=best_total_revenue_state_value)
-
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
-        colors = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-
-        sns.barplot(x="customer_city", y="revenue",
-                    data=customer_order_revenue_city.sort_values(by="revenue", ascending=False).head(5),
-                    palette=colors, ax=ax[0], hue="customer_city")
-        ax[0].set_ylabel(None)
-        ax[0].set_xlabel(None)
-        ax[0].set_title("Best Total Revenue by City", loc="center", fontsize=25)
-        ax[0].tick_params(axis='y', labelsize=20)
-        ax[0].tick_params(axis='x', labelsize=18)
-
-        sns.barplot(x="customer_state", y="revenue",
-                    data=customer_order_revenue_state.sort_values(by="revenue", ascending=False).head(5),
-                    palette=colors, ax=ax[1], hue="customer_state")
-        ax[1].set_ylabel(None)
-        ax[1].set_xlabel(None)
-        ax[1].yaxis.set_label_position("right")
-        ax[1].yaxis.tick_right()
-        ax[1].set_title("Best Total Revenue by State", loc="center", fontsize=25)
-        ax[1].tick_params(axis='y', labelsize=20)
-        ax[1].tick_params(axis='x', labelsize=20)
-
-        st.pyplot(fig)
-
-    with tab2:
-        st.subheader("Best Performing Product Category by Number of Orders")
-
-        col1, col2 = st.columns(2)
-        best_orders_category_idx = sum_order_items_df["count"].idxmax()
-        with col1:
-            best_orders_category = sum_order_items_df.loc[best_orders_category_idx, "product_category"]
-            best_orders_category = " ".join(best_orders_category.split("_")).capitalize()
-            st.metric("Best Orders Category", value=best_orders_category)
-        with col2:
-            num_orders_category = sum_order_items_df.loc[best_orders_category_idx, "count"]
-            st.metric("Num of Orders", value=num_orders_category)
-
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
-
-        colors_1 = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-        sns.barplot(x="count", y="product_category",
-                    data=sum_order_items_df.sort_values(by="count", ascending=False).head(5),
-                    palette=colors_1, ax=ax[0], hue="product_category")
-        ax[0].set_ylabel(None)
-        ax[0].set_xlabel(None)
-        ax[0].set_title("Best Performing Product Category", loc="left", fontsize=25)
-        ax[0].tick_params(axis='y', labelsize=20)
-        ax[0].tick_params(axis='x', labelsize=20)
-
-        colors_2 = ["#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#1230AE"]
-        sns.barplot(x="count", y="product_category",
-                    data=sum_order_items_df.sort_values(by="count", ascending=False).tail(5),
-                    palette=colors_2, ax=ax[1], hue="product_category")
-        ax[1].set_ylabel(None)
-        ax[1].set_xlabel(None)
-        ax[1].invert_xaxis()
-        ax[1].yaxis.set_label_position("right")
-        ax[1].yaxis.tick_right()
-        ax[1].set_title("Worst Performing Product Category", loc="right", fontsize=25)
-        ax[1].tick_params(axis='y', labelsize=20)
-        ax[1].tick_params(axis='x', labelsize=20)
-
-        st.pyplot(fig)
-
-        st.write(" ")
-
-        st.subheader("Best Performing Product Category by Total Revenue")
-
-        col1, col2 = st.columns(2)
-        best_revenue_category_idx = sum_order_items_df["revenue"].idxmax()
-        with col1:
-            best_revenue_category = sum_order_items_df.loc[best_revenue_category_idx, "product_category"]
-            best_revenue_category = " ".join(best_revenue_category.split("_")).capitalize()
-            st.metric("Best Revenue Category", value=best_revenue_category)
-        with col2:
-            total_revenue_category = sum_order_items_df.loc[best_revenue_category_idx, "revenue"]
-            total_revenue_category = format_currency(total_revenue_category, "BRL", locale="pt_BR")
-            st.metric("Total Revenue Category", value=total_revenue_category)
-
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
-
-        colors_1 = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-        sns.barplot(x="revenue", y="product_category",
-                    data=sum_order_items_df.sort_values(by="revenue", ascending=False).head(5),
-                    palette=colors_1, ax=ax[0], hue="product_category")
-        ax[0].set_ylabel(None)
-        ax[0].set_xlabel(None)
-        ax[0].set_title("Best Performing Product Category", loc="left", fontsize=25)
-        ax[0].tick_params(axis='y', labelsize=20)
-        ax[0].tick_params(axis='x', labelsize=20)
-
-        colors_2 = ["#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#1230AE"]
-        sns.barplot(x="revenue", y="product_category",
-                    data=sum_order_items_df.sort_values(by="revenue", ascending=False).tail(5),
-                    palette=colors_2, ax=ax[1], hue="product_category")
-        ax[1].set_ylabel(None)
-        ax[1].set_xlabel(None)
-        ax[1].invert_xaxis()
-        ax[1].yaxis.set_label_position("right")
-        ax[1].yaxis.tick_right()
-        ax[1].set_title("Worst Performing Product Category", loc="right", fontsize=25)
-        ax[1].tick_params(axis='y', labelsize=20)
-        ax[1].tick_params(axis='x', labelsize=20)
-
-        st.pyplot(fig)
-
-    with (tab3):
-        st.subheader("Best Payment Method")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            best_payment_method_idx = payment_type_df["count"].idxmax()
-            best_payment_method = payment_type_df.loc[best_payment_method_idx, "payment_type"]
-            best_payment_method = " ".join(best_payment_method.split("_")).capitalize()
-            st.metric("Best Payment Method", value=best_payment_method)
-        with col2:
-            percentage_installment_idx = int(
-                payment_installments_df[payment_installments_df["use_installment"] == True].index[0])
-            percentage_installment = payment_installments_df.loc[percentage_installment_idx, "count"] / int(
-                payment_installments_df["count"].sum())
-            percentage_installment = "{}%".format(round(percentage_installment * 100, 2))
-            st.metric("Percentage using installments", value=percentage_installment)
-
-        fig, ax = plt.subplots(nrows=1, ncols=2, figsize=(24, 8))
-
-        colors_1 = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-        sns.barplot(x="payment_type", y="count", data=payment_type_df.head(5), palette=colors_1, ax=ax[0],
-                    hue="payment_type")
-        ax[0].set_ylabel(None)
-        ax[0].set_xlabel(None)
-        ax[0].set_title("Best Payment Type", loc="center", fontsize=25)
-        ax[0].tick_params(axis='y', labelsize=20)
-        ax[0].tick_params(axis='x', labelsize=20)
-
-        colors_2 = ["#D3D3D3", "#1230AE"]
-        sns.barplot(x="use_installment", y="count", data=payment_installments_df.head(5), palette=colors_2, ax=ax[1],
-                    hue="use_installment", legend=False)
-        ax[1].set_ylabel(None)
-        ax[1].set_xlabel(None)
-        ax[1].yaxis.set_label_position("right")
-        ax[1].yaxis.tick_right()
-        ax[1].set_title("Use Installment?", loc="center", fontsize=25)
-        ax[1].tick_params(axis='y', labelsize=20)
-        ax[1].tick_params(axis='x', labelsize=20)
-
-        st.pyplot(fig)
-
-    with (tab4):
-        st.subheader("Customer Review Scores")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            satisfied_idx = int(
-                satisfied_df[satisfied_df["satisfaction"] == "satisfied"].index[0])
-            satisfied_value = satisfied_df.loc[satisfied_idx, "count"]
-            satisfied_value = satisfied_value / satisfied_df["count"].sum()
-            satisfied_value = "{}%".format(round(satisfied_value * 100, 2))
-            st.metric("Percentage of satisfied (4-5:star:)", value=satisfied_value)
-        with col2:
-            not_satisfied_idx = int(
-                satisfied_df[satisfied_df["satisfaction"] == "not satisfied"].index[0])
-            not_satisfied_value = satisfied_df.loc[not_satisfied_idx, "count"]
-            not_satisfied_value = not_satisfied_value / satisfied_df["count"].sum()
-            not_satisfied_value = "{}%".format(round(not_satisfied_value * 100, 2))
-            st.metric("Percentage of dissatisfied (1-3:star:)", value=not_satisfied_value)
-
-        colors = ["#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-        colors[int(customer_scores_df["count"].argmax())] = "#1230AE"
-
-        fig, ax = plt.subplots(figsize=(16, 8))
-        sns.barplot(x="review_score", y="count", data=customer_scores_df,
-                    palette=colors, hue="review_score", legend=False)
-        ax.set_ylabel(None)
-        ax.set_xlabel(None)
-        ax.set_title("Customer Review Score", loc="left", fontsize=20)
-        ax.tick_params(axis='y', labelsize=15)
-        ax.tick_params(axis='x', labelsize=15)
-
-        st.pyplot(fig)
-
-        st.subheader("New Review Messages")
-
-        st.write(
-            main_3_df[~main_3_df["review_comment_message"].isna()].\
-                sort_values(by="review_creation_date", ascending=False).reset_index()\
-                [["review_creation_date", "review_score", "review_comment_title", "review_comment_message"]]
-        )
 
-    with tab5:
-        st.subheader("Best Customer Based on RFM Parameters")
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            avg_recency = round(rfm_df.recency.mean(), 1)
-            st.metric("Average Recency (days)", value=avg_recency)
-        with col2:
-            avg_frequency = round(rfm_df.frequency.mean(), 2)
-            st.metric("Average Frequency", value=avg_frequency)
-        with col3:
-            avg_monetary = format_currency(rfm_df.monetary.mean(), "BRL", locale="pt_BR")
-            st.metric("Average Monetary", value=avg_monetary)
-
-        st.caption('There is no customer name, only customer_unique_id')
-
-        colors = ["#1230AE", "#D3D3D3", "#D3D3D3", "#D3D3D3", "#D3D3D3"]
-
-        st.subheader("By Recency (days)")
-
-        fig, ax = plt.subplots(figsize=(16, 8))
-        sns.barplot(y="customer_id", x="recency", data=rfm_df.sort_values(by="recency", ascending=True).head(5),
-                    palette=colors, hue="customer_id")
-        ax.set_ylabel(None)
-        ax.set_xlabel(None)
-        ax.tick_params(axis='y', labelsize=18)
-        ax.tick_params(axis='x', labelsize=20)
-        st.pyplot(fig)
-
-        st.subheader("By Frequency")
-        fig, ax = plt.subplots(figsize=(16, 8))
-        sns.barplot(y="customer_id", x="frequency", data=rfm_df.sort_values(by="frequency", ascending=False).head(5),
-                    palette=colors, hue="customer_id")
-        ax.set_ylabel(None)
-        ax.set_xlabel(None)
-        ax.tick_params(axis='y', labelsize=18)
-        ax.tick_params(axis='x', labelsize=20)
-        st.pyplot(fig)
-
-        st.subheader("By Monetary (R$)")
-        fig, ax = plt.subplots(figsize=(16, 8))
-        sns.barplot(y="customer_id", x="monetary", data=rfm_df.sort_values(by="monetary", ascending=False).head(5),
-                    palette=colors, hue="customer_id")
-        ax.set_ylabel(None)
-        ax.set_xlabel(None)
-        ax.tick_params(axis='y', labelsize=18)
-        ax.tick_params(axis='x', labelsize=20)
-        st.pyplot(fig)
+if __name__ == '__main__':
+    # Hooks only record while a recorder is active, the debug panel is shown by opening the page with ?debug=1
+    # or ?debug=memory
+    debug = st.query_params.get("debug", "")
+    debug = debug if debug in profiling.MODES else ""
+    profile_mode = debug or (profiling.MODE if profiling.MODE in profiling.MODES else "")
+    if profile_mode:
+        with profiling.Recorder(trace_memory=profile_mode == "memory") as rerun_recorder:
+            show_dashboard()
+        rerun_number = record_profile(rerun_recorder)
+        if debug:
+            show_profiling_panel(rerun_recorder, rerun_number)
+    else:
+        show_dashboard()
@@ -0,0 +1,82 @@
+"""Headline figures of the dashboard, derived from the aggregations of a timeframe.
+
+The tabs of main.py and the batch reports of report.py show the same figures,
+so both derive them here from the same aggregation dataframes. Labels are kept
+as they appear in the datasets and amounts unformatted; format_label and the
+tabs take care of their display. A figure over an empty timeframe is None.
+"""
+import pandas as pd
+
+
+def format_label(value: str | None, upper: bool = False) -> str:
+    """Function: Get a dataset label such as sao_paulo for display, as Sao paulo (or SAO PAULO if upper)"""
+    if value is None:
+        return "-"
+    label = " ".join(value.split("_"))
+    return label.upper() if upper else label.capitalize()
+
+
+def best_row(dataframe: pd.DataFrame, column: str) -> pd.Series | None:
+    """Function: Get the row with the highest value of column, the first one on ties, None if there are no rows"""
+    if dataframe.empty:
+        return None
+    return dataframe.loc[dataframe[column].idxmax()]
+
+
+def scalar(value):
+    """Function: Get a numpy scalar as a plain Python value"""
+    return value.item() if hasattr(value, "item") else value
+
+
+def share(dataframe: pd.DataFrame, column: str, value) -> float | None:
+    """Function: Get the percentage of the count of the rows whose column equals value, None if there are none"""
+    total = dataframe["count"].sum()
+    if total == 0:
+        return None
+    return float(dataframe.loc[dataframe[column] == value, "count"].sum() / total * 100)
+
+
+def orders_metrics(total_orders: int, total_revenue: float, customer_order_revenue_city: pd.DataFrame,
+                   customer_order_revenue_state: pd.DataFrame) -> dict:
+    """Function: Get the figures of the monthly orders and revenue tab"""
+    metrics = {"total_orders": int(total_orders), "total_revenue": float(total_revenue)}
+    for dimension, dataframe in [("city", customer_order_revenue_city), ("state", customer_order_revenue_state)]:
+        for column, measure in [("order", "orders"), ("revenue", "revenue")]:
+            row = best_row(dataframe, column)
+            label = None if row is None else str(row["customer_" + dimension])
+            metrics["top_{}_by_{}".format(dimension, measure)] = label
+            metrics["top_{}_{}".format(dimension, measure)] = None if row is None else scalar(row[column])
+    return metrics
+
+
+def category_metrics(sum_order_items_df: pd.DataFrame) -> dict:
+    """Function: Get the figures of the product category performance tab"""
+    metrics = {}
+    for column, measure in [("count", "orders"), ("revenue", "revenue")]:
+        row = best_row(sum_order_items_df, column)
+        metrics["best_category_by_" + measure] = None if row is None else str(row["product_category"])
+        metrics["best_category_" + measure] = None if row is None else scalar(row[column])
+    return metrics
+
+
+def payment_metrics(payment_type_df: pd.DataFrame, payment_installments_df: pd.DataFrame) -> dict:
+    """Function: Get the figures of the payment methods tab"""
+    row = best_row(payment_type_df, "count")
+    return {
+        "best_payment_method": None if row is None else str(row["payment_type"]),
+        "installment_percentage": share(payment_installments_df, "use_installment", True)
+    }
+
+
+def review_metrics(satisfied_df: pd.DataFrame) -> dict:
+    """Function: Get the figures of the customer reviews tab"""
+    return {
+        "satisfied_percentage": share(satisfied_df, "satisfaction", "satisfied"),
+        "not_satisfied_percentage": share(satisfied_df, "satisfaction", "not satisfied")
+    }
+
+
+def rfm_metrics(rfm_means: pd.Series) -> dict:
+    """Function: Get the figures of the RFM analysis tab from the mean recency, frequency and monetary value"""
+    return {"average_" + column: None if pd.isna(rfm_means[column]) else float(rfm_means[column])
+            for column in ["recency", "frequency", "monetary"]}
@@ -0,0 +1,261 @@
+"""Profiling hooks of the dashboard pipeline.
+
+The stages of the pipeline (reading a dataset, parsing its dates, slicing a
+timeframe, every create_* aggregation, rendering a chart) are wrapped by
+profiled or Stage. While a Recorder is active on the current thread, every
+stage records its wall time, its CPU time and the rows it got and returned.
+Without an active recorder a hook costs one thread-local lookup, so the hooks
+stay in place in production.
+
+CPU time is the time of the calling thread, so the other sessions don't count
+in it. A recorder tracing memory also records the peak memory delta of every
+stage: the highest memory allocated during the stage beyond what was
+allocated when it started. Memory is traced by tracemalloc, which slows down
+allocation-heavy stages such as chart rendering about twofold, so it is only
+on when asked for. The tracing is process-wide, so memory deltas are
+approximate while several sessions trace memory at once.
+"""
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from dataclasses import dataclass, asdict
+import pandas as pd
+
+# Every rerun of every session is profiled when set to 1, with the memory deltas when set to memory.
+# Otherwise only the sessions opened with ?debug=1 or ?debug=memory are
+MODES = ["1", "memory"]
+MODE = os.environ.get("DASHBOARD_PROFILE", "")
+
+# The records of every profiled rerun are appended as JSON lines to this file when set
+LOG_FILE = os.environ.get("DASHBOARD_PROFILE_LOG", "")
+
+METRIC_PREFIX = "dashboard_stage_"
+TOTAL_COLUMNS = ["calls", "wall_seconds", "cpu_seconds", "rows_in", "rows_out", "memory_delta_bytes"]
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_recorders = 0
+_tracing_started = False
+
+
+@dataclass
+class StageRecord:
+    """Measures of one run of a stage"""
+    stage: str
+    depth: int  # number of enclosing stages
+    start_seconds: float  # since the recorder started
+    wall_seconds: float
+    cpu_seconds: float
+    rows_in: int | None
+    rows_out: int | None
+    memory_delta_bytes: int | None  # None unless memory is traced
+
+
+class Stage:
+    """Context manager recording a stage on the active recorder of the thread, if any.
+    rows_out can be set within the block"""
+    __slots__ = ("name", "rows_in", "rows_out", "recorder", "start_wall", "start_cpu", "start_memory", "peak")
+
+    def __init__(self, name: str, rows_in: int | None = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.recorder = getattr(_local, "recorder", None)
+
+    def __enter__(self) -> "Stage":
+        if self.recorder is not None:
+            self.recorder.enter(self)
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        if self.recorder is not None:
+            self.recorder.exit(self)
+        return False
+
+
+class Recorder:
+    """Records of the stages run by one thread, such as one rerun of a session, in their start order"""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self.records = []
+        self.stack = []
+
+    def enter(self, stage: Stage) -> None:
+        """Procedure: Start measuring a stage"""
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for every stage, so the enclosing stage keeps the peak reached so far
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            stage.start_memory = stage.peak = memory
+        self.stack.append(stage)
+        stage.start_cpu = time.thread_time()
+        stage.start_wall = time.perf_counter()
+
+    def exit(self, stage: Stage) -> None:
+        """Procedure: Record a stage started by enter"""
+        wall_seconds = time.perf_counter() - stage.start_wall
+        cpu_seconds = time.thread_time() - stage.start_cpu
+        self.stack.pop()
+        memory_delta = None
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, stage.peak)
+            tracemalloc.reset_peak()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            memory_delta = peak - stage.start_memory
+        self.records.append(StageRecord(
+            stage=stage.name,
+            depth=len(self.stack),
+            start_seconds=stage.start_wall - self.started,
+            wall_seconds=wall_seconds,
+            cpu_seconds=cpu_seconds,
+            rows_in=stage.rows_in,
+            rows_out=stage.rows_out,
+            memory_delta_bytes=memory_delta
+        ))
+
+    def sorted_records(self) -> list:
+        """Function: Get the records in their start order"""
+        return sorted(self.records, key=lambda record: record.start_seconds)
+
+    def __enter__(self) -> "Recorder":
+        global _tracing_recorders, _tracing_started
+        _local.recorder = self
+        if not self.trace_memory:
+            return self
+        with _tracing_lock:
+            if _tracing_recorders == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_started = True
+            _tracing_recorders += 1
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        global _tracing_recorders, _tracing_started
+        _local.recorder = None
+        if not self.trace_memory:
+            return False
+        with _tracing_lock:
+            _tracing_recorders -= 1
+            # Tracing started by someone else is left running
+            if _tracing_recorders == 0 and _tracing_started:
+                tracemalloc.stop()
+                _tracing_started = False
+        return False
+
+
+class StageTotals:
+    """Thread-safe totals of the records of every stage, over reruns"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, records: list) -> None:
+        """Procedure: Add records to the totals"""
+        with self.lock:
+            for record in records:
+                total = self.totals.setdefault(record.stage, dict(zip(TOTAL_COLUMNS, [0, 0.0, 0.0, 0, 0, None])))
+                total["calls"] += 1
+                total["wall_seconds"] += record.wall_seconds
+                total["cpu_seconds"] += record.cpu_seconds
+                total["rows_in"] += record.rows_in or 0
+                total["rows_out"] += record.rows_out or 0
+                if record.memory_delta_bytes is not None:
+                    total["memory_delta_bytes"] = max(total["memory_delta_bytes"] or 0, record.memory_delta_bytes)
+
+    def create_totals_df(self) -> pd.DataFrame:
+        """Function: Get a dataframe of the totals of every stage, the slowest first"""
+        with self.lock:
+            result_df = pd.DataFrame.from_dict(self.totals, orient="index", columns=TOTAL_COLUMNS)
+        result_df = result_df.rename_axis("stage").reset_index()
+        return result_df.sort_values(by="wall_seconds", ascending=False, ignore_index=True)
+
+    def to_prometheus(self) -> str:
+        """Function: Get the totals in the Prometheus text exposition format. The memory delta is the
+        highest of a stage, left out when memory isn't traced, the other metrics are counters"""
+        metrics = [
+            ("calls_total", "calls", "counter", "Profiled runs of a dashboard pipeline stage"),
+            ("wall_seconds_total", "wall_seconds", "counter", "Wall time spent in a stage"),
+            ("cpu_seconds_total", "cpu_seconds", "counter", "CPU time of the calling thread spent in a stage"),
+            ("rows_in_total", "rows_in", "counter", "Rows given to a stage"),
+            ("rows_out_total", "rows_out", "counter", "Rows returned by a stage"),
+            ("memory_delta_bytes", "memory_delta_bytes", "gauge", "Highest peak memory delta of a stage")
+        ]
+        with self.lock:
+            lines = []
+            for metric, key, metric_type, description in metrics:
+                name = METRIC_PREFIX + metric
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} {}".format(name, metric_type))
+                for stage, total in sorted(self.totals.items()):
+                    if total[key] is None:
+                        continue
+                    lines.append('{}{{stage="{}"}} {}'.format(name, escape_label(stage), total[key]))
+            return "\n".join(lines) + "\n"
+
+
+# Totals of every session of the process
+PROCESS_TOTALS = StageTotals()
+
+
+def escape_label(value: str) -> str:
+    """Function: Get a Prometheus label value with its backslashes, quotes and newlines escaped"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def count_rows(value) -> int | None:
+    """Function: Get the number of rows of a dataframe or series, or the total of the dataframes and series
+    of a tuple, list or dict. None if there are none"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (tuple, list)):
+        return None
+    counts = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+    return sum(counts) if counts else None
+
+
+def stage_name(function) -> str:
+    """Function: Get the stage name of a function, as module.function"""
+    # Streamlit runs main.py as __main__
+    module = "main" if function.__module__ == "__main__" else function.__module__
+    return "{}.{}".format(module, function.__qualname__)
+
+
+def profiled(function):
+    """Function: Get a function recording a stage, with the rows of its dataframe arguments and result,
+    whenever a recorder is active"""
+    name = stage_name(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "recorder", None) is None:
+            return function(*args, **kwargs)
+        with Stage(name, count_rows(args)) as stage:
+            result = function(*args, **kwargs)
+            stage.rows_out = count_rows(result)
+        return result
+
+    return wrapper
+
+
+def to_json_lines(records: list, **fields) -> str:
+    """Function: Get records as JSON lines, each with the extra fields"""
+    return "".join(json.dumps({**fields, **asdict(record)}) + "\n" for record in records)
+
+
+def append_log(text: str, path: str = LOG_FILE) -> None:
+    """Procedure: Append JSON lines to the log file, if one is set"""
+    if path:
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(text)
@@ -0,0 +1,213 @@
+"""Headless batch reports of the dashboard figures over many timeframes.
+
+Every window (a month, a quarter, a year or the whole history, optionally
+restricted to the customers of one state) gets the full set of headline
+figures of the dashboard tabs. They are computed by the same create_*
+aggregations of main.py and derived by metrics.py, so they match what the
+dashboard shows for the same timeframe with exact distinct counts. Only the
+aggregations the figures are derived from are run, on the rows of the window
+sliced once.
+
+The datasets are loaded once by the parent process. Windows are then spread
+over a process pool. With the fork start method (Linux, macOS) the workers
+share the parent's copy of the data copy-on-write. Otherwise every worker
+loads its own copy from the Parquet cache once. A window only slices the
+sorted datasets by binary search, so its cost depends on its own rows.
+
+Usage: python dashboard/report.py [--periods month quarter] [--by-state] [--workers 4]
+       [--output reports/report.parquet] [--output reports/report.json]
+"""
+import os
+import time
+import logging
+import argparse
+import datetime
+import multiprocessing
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import main
+import loader
+import metrics
+import scheduler
+from timeframe import slice_timeframe
+
+PERIODS = {"month": "M", "quarter": "Q", "year": "Y", "all": None}
+OUTPUT_FORMATS = [".parquet", ".json"]
+
+logger = logging.getLogger(__name__)
+
+# Datasets of a worker process, set by init_worker
+_datasets = None
+# Order ids of the customers of every (orders dataframe id, state), built on the first window of the state
+_state_order_ids = {}
+
+
+@dataclass
+class Window:
+    """A timeframe of a report, end_date included, optionally restricted to the customers of one state"""
+    period: str
+    label: str
+    start_date: datetime.date
+    end_date: datetime.date
+    state: str | None = None
+
+
+def create_windows(first_date: datetime.date, last_date: datetime.date, periods: list,
+                   states: list | None = None) -> list:
+    """Function: Get the windows of every period covering the dates, each period clipped to the dates,
+    for every state too when states are given"""
+    windows = []
+    for period in periods:
+        if PERIODS[period] is None:
+            windows.append(Window(period, "all", first_date, last_date))
+            continue
+        for span in pd.period_range(first_date, last_date, freq=PERIODS[period]):
+            windows.append(Window(period, str(span), max(span.start_time.date(), first_date),
+                                  min(span.end_time.date(), last_date)))
+    for state in states or []:
+        windows.extend(Window(window.period, window.label, window.start_date, window.end_date, state)
+                       for window in windows if window.state is None)
+    return windows
+
+
+def init_worker(datasets: dict | None = None) -> None:
+    """Procedure: Set the datasets of a worker process, loading them when they are not inherited"""
+    global _datasets
+    if datasets is not None:
+        _datasets = datasets
+    elif _datasets is None:
+        _datasets, _ = loader.load_datasets()
+
+
+def state_order_ids(datasets: dict, state: str) -> pd.Index:
+    """Function: Get the order ids of the customers of a state"""
+    orders_df = datasets["order_customers_payments"]
+    key = (id(orders_df), state)
+    if key not in _state_order_ids:
+        order_ids = orders_df.loc[orders_df["customer_state"] == state, "order_id"].dropna().unique()
+        _state_order_ids[key] = pd.Index(order_ids.astype(object))
+    return _state_order_ids[key]
+
+
+def window_datasets(datasets: dict, window: Window) -> dict:
+    """Function: Get the rows of every dataset within the window. Items and reviews belong to a state
+    through their order"""
+    sliced = {name: slice_timeframe(dataframe, loader.DATASETS[name]["sort_column"], window.start_date,
+                                    window.end_date)
+              for name, dataframe in datasets.items()}
+    if window.state is None:
+        return sliced
+
+    order_ids = state_order_ids(datasets, window.state)
+    return {name: dataframe[dataframe["order_id"].isin(order_ids)] for name, dataframe in sliced.items()}
+
+
+def create_report_tasks(datasets: dict) -> list:
+    """Function: Get the dependency graph of the aggregations the figures are derived from, over datasets
+    already sliced to a window"""
+    orders_df = datasets["order_customers_payments"]
+    return [
+        scheduler.Task("total_orders_revenue", main.create_total_orders_revenue, (orders_df,)),
+        scheduler.Task("sum_order_items_df", main.create_sum_order_items_df,
+                       (datasets["orders_order_items_products_category"],)),
+        scheduler.Task("payment_type_df", main.create_payment_type_df, (orders_df,)),
+        scheduler.Task("payment_installments_df", main.create_payment_installments_df, (orders_df,)),
+        scheduler.Task("customer_order_revenue_city", main.create_customer_order_revenue_city, (orders_df,)),
+        scheduler.Task("customer_order_revenue_state", main.create_customer_order_revenue_state, (orders_df,)),
+        scheduler.Task("customer_scores_df", main.create_customer_scores_df, (datasets["order_reviews"],)),
+        scheduler.Task("satisfied_df", main.create_satisfied_df, dependencies=["customer_scores_df"]),
+        scheduler.Task("rfm_df", main.create_rfm_df, (orders_df,))
+    ]
+
+
+def compute_window(datasets: dict, window: Window) -> dict:
+    """Function: Get the figures of the dashboard tabs over a window"""
+    results, _ = scheduler.run_tasks(create_report_tasks(window_datasets(datasets, window)), 1)
+    total_orders, total_revenue = results["total_orders_revenue"]
+    return {
+        **asdict(window),
+        **metrics.orders_metrics(total_orders, total_revenue, results["customer_order_revenue_city"],
+                                 results["customer_order_revenue_state"]),
+        **metrics.category_metrics(results["sum_order_items_df"]),
+        **metrics.payment_metrics(results["payment_type_df"], results["payment_installments_df"]),
+        **metrics.review_metrics(results["satisfied_df"]),
+        **metrics.rfm_metrics(results["rfm_df"][["recency", "frequency", "monetary"]].mean())
+    }
+
+
+def compute_worker_window(window: Window) -> dict:
+    """Function: Get the figures of a window in a worker process"""
+    return compute_window(_datasets, window)
+
+
+def create_report_df(datasets: dict, windows: list, workers: int | None = None) -> pd.DataFrame:
+    """Function: Get a dataframe of the figures of every window, in the order of windows, computed on
+    workers processes (one per CPU by default, in this process if 1)"""
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1 or len(windows) <= 1:
+        rows = [compute_window(datasets, window) for window in windows]
+    else:
+        # Forked workers inherit the loaded datasets, spawned ones load them from the cache
+        global _datasets
+        if "fork" in multiprocessing.get_all_start_methods():
+            context, initargs = multiprocessing.get_context("fork"), ()
+            _datasets = datasets
+        else:
+            context, initargs = multiprocessing.get_context(), (None,)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=initargs) as executor:
+            rows = list(executor.map(compute_worker_window, windows,
+                                     chunksize=max(1, len(windows) // (4 * workers))))
+
+    logger.info("Computed %d windows on %d workers in %.3f s", len(windows), workers, time.perf_counter() - start)
+    return pd.DataFrame(rows)
+
+
+def write_report(report_df: pd.DataFrame, path: str) -> None:
+    """Procedure: Write a report as Parquet or as a JSON array of records, after the extension of path"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in OUTPUT_FORMATS:
+        raise ValueError("Unknown report format {!r}, expected one of {}".format(extension, OUTPUT_FORMATS))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if extension == ".parquet":
+        report_df.to_parquet(path, index=False)
+    else:
+        report_df.to_json(path, orient="records", date_format="iso", indent=1)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Compute the dashboard figures over many timeframes")
+    parser.add_argument("--periods", nargs="+", choices=list(PERIODS), default=["month", "quarter"],
+                        help="windows of the report")
+    parser.add_argument("--by-state", action="store_true", help="also compute every window for every customer state")
+    parser.add_argument("--from", dest="first_date", type=datetime.date.fromisoformat, default=None,
+                        help="first day of the report (default: first order)")
+    parser.add_argument("--to", dest="last_date", type=datetime.date.fromisoformat, default=None,
+                        help="last day of the report (default: last order)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--output", action="append", default=None,
+                        help="output file, .parquet or .json (repeatable, default: reports/report.parquet)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # The timings of every aggregation of every window are left out
+    logging.getLogger(scheduler.__name__).setLevel(logging.WARNING)
+    datasets, _ = loader.load_datasets()
+    purchases = datasets["order_customers_payments"]["order_purchase_timestamp"].dropna()
+    if purchases.empty:
+        parser.error("The datasets have no orders")
+    states = sorted(datasets["order_customers_payments"]["customer_state"].dropna().unique()) if args.by_state \
+        else None
+    windows = create_windows(args.first_date or purchases.iloc[0].date(), args.last_date or purchases.iloc[-1].date(),
+                             args.periods, states)
+
+    report_df = create_report_df(datasets, windows, args.workers)
+    for path in args.output or [os.path.join("reports", "report.parquet")]:
+        write_report(report_df, path)
+        print("{:<40} {} windows".format(path, len(report_df)))
+
+
+if __name__ == '__main__':
+    main_cli()
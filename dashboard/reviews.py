@@ -0,0 +1,154 @@
+"""Indexed browser of the review messages.
+
+The reviews with a message are sorted newest first once, so the reviews of a
+timeframe are one contiguous range found by binary search, and the score
+filter is a lookup over that range. Keywords are matched through an inverted
+index built once over the titles and messages: every word, lowercased and
+with its accents removed (so "não" matches "nao"), maps to the sorted
+positions of the reviews containing it, and the positions of several words are
+intersected starting with the rarest. Only one page of rows is ever turned
+into a dataframe, so the payload sent to the browser doesn't depend on the
+number of matching reviews.
+"""
+import re
+import unicodedata
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import profiling
+from timeframe import timeframe_bounds
+
+PAGE_SIZE = 20
+
+REVIEW_COLUMNS = ["review_creation_date", "review_score", "review_comment_title", "review_comment_message"]
+SEARCH_COLUMNS = ["review_comment_title", "review_comment_message"]
+
+# Words are runs of letters and digits once the accents are removed
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+@dataclass
+class ReviewIndex:
+    """Reviews with a message sorted newest first, with the inverted index of their words"""
+    reviews_df: pd.DataFrame
+    negated_timestamps: np.ndarray  # minus the creation timestamps, ascending
+    scores: np.ndarray
+    vocabulary: dict  # word -> index of its postings
+    offsets: np.ndarray  # postings of word w are postings[offsets[w]:offsets[w + 1]]
+    postings: np.ndarray
+
+
+def tokenize(text: str) -> list:
+    """Function: Get the words of a text, lowercased and without accents"""
+    return TOKEN_PATTERN.findall(unicodedata.normalize("NFKD", text).encode("ascii", errors="ignore").decode().lower())
+
+
+@profiling.profiled
+def build_review_index(reviews_df: pd.DataFrame) -> ReviewIndex:
+    """Function: Get the index of the reviews with a message"""
+    reviews_df = reviews_df.loc[reviews_df["review_comment_message"].notna() &
+                                reviews_df["review_creation_date"].notna(), REVIEW_COLUMNS]
+    reviews_df = reviews_df.sort_values(by="review_creation_date", ascending=False, kind="stable", ignore_index=True)
+
+    # Every distinct text is tokenized once, then its words are repeated for each review having it
+    texts = reviews_df[SEARCH_COLUMNS[0]].fillna("") + " " + reviews_df[SEARCH_COLUMNS[1]].fillna("")
+    text_codes, unique_texts = pd.factorize(texts)
+    vocabulary = {}
+    text_words = [np.array([vocabulary.setdefault(word, len(vocabulary)) for word in set(tokenize(text))],
+                           dtype=np.int32) for text in unique_texts]
+    lengths = np.array([len(words) for words in text_words], dtype=np.int64)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]] if len(lengths) else lengths
+    flat_words = np.concatenate(text_words) if text_words else np.zeros(0, dtype=np.int32)
+
+    review_lengths = lengths[text_codes]
+    positions = np.repeat(np.arange(len(texts), dtype=np.int32), review_lengths)
+    within = np.arange(review_lengths.sum()) - np.repeat(np.cumsum(review_lengths) - review_lengths, review_lengths)
+    codes = flat_words[np.repeat(starts[text_codes], review_lengths) + within]
+
+    # Postings sorted by word then position
+    order = np.lexsort((positions, codes))
+    codes, positions = codes[order], positions[order]
+
+    return ReviewIndex(
+        reviews_df=reviews_df,
+        negated_timestamps=-reviews_df["review_creation_date"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        scores=reviews_df["review_score"].to_numpy(dtype=np.int8),
+        vocabulary=vocabulary,
+        offsets=np.r_[0, np.cumsum(np.bincount(codes, minlength=len(vocabulary)))],
+        postings=positions
+    )
+
+
+@profiling.profiled
+def add_reviews(index: ReviewIndex, reviews_df: pd.DataFrame) -> ReviewIndex:
+    """Function: Get the index with the reviews of a delta added. Only the new reviews are tokenized, the postings
+    of the indexed ones are moved to their new positions, which keeps them sorted"""
+    delta = build_review_index(reviews_df)
+    # The indexed reviews stay before the new ones created at the same time
+    old_positions = np.arange(len(index.scores)) + np.searchsorted(delta.negated_timestamps,
+                                                                   index.negated_timestamps, side="left")
+    new_positions = np.arange(len(delta.scores)) + np.searchsorted(index.negated_timestamps,
+                                                                   delta.negated_timestamps, side="right")
+    order = np.empty(len(index.scores) + len(delta.scores), dtype=np.int64)
+    order[old_positions] = np.arange(len(index.scores))
+    order[new_positions] = np.arange(len(delta.scores)) + len(index.scores)
+
+    vocabulary = dict(index.vocabulary)
+    delta_codes = np.array([vocabulary.setdefault(word, len(vocabulary)) for word in delta.vocabulary],
+                           dtype=np.int64)
+    codes = np.concatenate([np.repeat(np.arange(len(index.vocabulary)), np.diff(index.offsets)),
+                            delta_codes[np.repeat(np.arange(len(delta.vocabulary)), np.diff(delta.offsets))]])
+    positions = np.concatenate([old_positions[index.postings], new_positions[delta.postings]])
+    # The indexed postings are one sorted run, so the stable sort mostly merges in the new ones
+    postings = np.argsort(codes * len(order) + positions, kind="stable")
+    codes, positions = codes[postings], positions[postings]
+
+    return ReviewIndex(
+        reviews_df=pd.concat([index.reviews_df, delta.reviews_df], ignore_index=True).take(order).
+        reset_index(drop=True),
+        negated_timestamps=np.concatenate([index.negated_timestamps, delta.negated_timestamps])[order],
+        scores=np.concatenate([index.scores, delta.scores])[order],
+        vocabulary=vocabulary,
+        offsets=np.r_[0, np.cumsum(np.bincount(codes, minlength=len(vocabulary)))],
+        postings=positions.astype(np.int32)
+    )
+
+
+def timeframe_range(index: ReviewIndex, start_date: datetime.date, end_date: datetime.date) -> tuple[int, int]:
+    """Function: Get the positions bounding the reviews created within the timeframe, end_date included"""
+    start, end = timeframe_bounds(start_date, end_date).astype(np.int64)
+    return (int(np.searchsorted(index.negated_timestamps, -end, side="right")),
+            int(np.searchsorted(index.negated_timestamps, -start, side="right")))
+
+
+def search_reviews(index: ReviewIndex, start_date: datetime.date, end_date: datetime.date,
+                   scores: list | None = None, query: str = "") -> np.ndarray:
+    """Function: Get the positions of the reviews within the timeframe, with one of the scores (all if None)
+    and every word of the query, newest first"""
+    low, high = timeframe_range(index, start_date, end_date)
+    words = set(tokenize(query))
+    if words:
+        if not words <= index.vocabulary.keys():
+            return np.zeros(0, dtype=np.int32)
+        postings = sorted((index.postings[index.offsets[code]:index.offsets[code + 1]]
+                           for code in (index.vocabulary[word] for word in words)), key=len)
+        positions = postings[0]
+        for other in postings[1:]:
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        positions = positions[np.searchsorted(positions, low):np.searchsorted(positions, high)]
+    else:
+        positions = None
+
+    if scores is not None:
+        allowed = np.zeros(max(index.scores.max(initial=0), max(scores, default=0)) + 1, dtype=bool)
+        allowed[list(scores)] = True
+        if positions is None:
+            return (np.flatnonzero(allowed[index.scores[low:high]]) + low).astype(np.int32)
+        positions = positions[allowed[index.scores[positions]]]
+    return np.arange(low, high, dtype=np.int32) if positions is None else positions
+
+
+def review_page(index: ReviewIndex, positions: np.ndarray, page: int, page_size: int = PAGE_SIZE) -> pd.DataFrame:
+    """Function: Get the rows of one page (from 0) of the reviews at positions"""
+    return index.reviews_df.iloc[positions[page * page_size:(page + 1) * page_size]].reset_index(drop=True)
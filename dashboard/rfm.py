@@ -0,0 +1,95 @@
+"""RFM scoring, customer segmentation and top-k selection.
+
+Works on the dataframe returned by create_rfm_df (customer_id, frequency,
+monetary, recency). Every step is vectorized: scores come from quantile
+bin edges, segments from a lookup table indexed by the R and F scores, and top-k
+from a partial selection, so no step loops over customers or sorts the whole
+frame for a handful of rows.
+"""
+import numpy as np
+import pandas as pd
+
+SCORE_BINS = 5
+
+SEGMENTS = [
+    "champions",
+    "loyal_customers",
+    "potential_loyalists",
+    "new_customers",
+    "promising",
+    "need_attention",
+    "about_to_sleep",
+    "cant_lose",
+    "at_risk",
+    "hibernating"
+]
+
+# Segment of every (recency score, frequency score) pair, the usual RFM segment map
+SEGMENT_MAP = {
+    (1, 1): "hibernating", (1, 2): "hibernating", (2, 1): "hibernating", (2, 2): "hibernating",
+    (1, 3): "at_risk", (1, 4): "at_risk", (2, 3): "at_risk", (2, 4): "at_risk",
+    (1, 5): "cant_lose", (2, 5): "cant_lose",
+    (3, 1): "about_to_sleep", (3, 2): "about_to_sleep",
+    (3, 3): "need_attention",
+    (3, 4): "loyal_customers", (3, 5): "loyal_customers", (4, 4): "loyal_customers", (4, 5): "loyal_customers",
+    (4, 1): "promising",
+    (5, 1): "new_customers",
+    (4, 2): "potential_loyalists", (4, 3): "potential_loyalists",
+    (5, 2): "potential_loyalists", (5, 3): "potential_loyalists",
+    (5, 4): "champions", (5, 5): "champions"
+}
+
+SEGMENT_CODES = np.zeros((SCORE_BINS, SCORE_BINS), dtype=np.int8)
+for (r_score, f_score), segment in SEGMENT_MAP.items():
+    SEGMENT_CODES[r_score - 1, f_score - 1] = SEGMENTS.index(segment)
+
+
+def quantile_scores(values: pd.Series, ascending: bool = True, bins: int = SCORE_BINS) -> np.ndarray:
+    """Function: Get the 1..bins quantile score of every value, the highest value (lowest if not ascending)
+    scoring bins. The bin edges come from a linear-time quantile selection and equal values
+    always get the same score"""
+    values = values.to_numpy(dtype=np.float64)
+    if not ascending:
+        values = -values
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int8)
+    edges = np.quantile(values, np.arange(1, bins) / bins)
+    return (np.searchsorted(edges, values, side="left") + 1).astype(np.int8)
+
+
+def score_rfm(rfm_df: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the RFM dataframe with its R/F/M quintile scores and customer segment"""
+    result_df = rfm_df.copy()
+    result_df["r_score"] = quantile_scores(rfm_df["recency"], ascending=False)
+    result_df["f_score"] = quantile_scores(rfm_df["frequency"])
+    result_df["m_score"] = quantile_scores(rfm_df["monetary"])
+    result_df["segment"] = pd.Categorical.from_codes(
+        SEGMENT_CODES[result_df["r_score"].to_numpy() - 1, result_df["f_score"].to_numpy() - 1],
+        categories=SEGMENTS
+    )
+    return result_df
+
+
+def top_k(dataframe: pd.DataFrame, column: str, k: int = 5, ascending: bool = False) -> pd.DataFrame:
+    """Function: Get the k rows with the largest (smallest if ascending) column values, in order,
+    using a partial selection instead of a full sort"""
+    values = dataframe[column].to_numpy()
+    keys = values if ascending else -values
+    if len(keys) > k:
+        candidates = np.argpartition(keys, k)[:k]
+    else:
+        candidates = np.arange(len(keys))
+    return dataframe.iloc[candidates[np.argsort(keys[candidates], kind="stable")]]
+
+
+def create_segment_summary_df(scored_rfm_df: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get the number of customers and average R/F/M of every customer segment"""
+    result_df = scored_rfm_df.groupby(by="segment", observed=True).agg(
+        customers=("customer_id", "size"),
+        avg_recency=("recency", "mean"),
+        avg_frequency=("frequency", "mean"),
+        avg_monetary=("monetary", "mean"),
+        total_monetary=("monetary", "sum")
+    ).reset_index()
+    result_df.insert(2, "share", result_df["customers"] / result_df["customers"].sum())
+    return result_df.sort_values(by="customers", ascending=False, ignore_index=True)
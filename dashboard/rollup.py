@@ -0,0 +1,228 @@
+"""Daily rollups of the additive dashboard measures.
+
+Each rollup holds, per day and per value of one dimension, the prefix sums of
+additive measures. Any timeframe is then answered with one subtraction of two
+prefix rows, so a filter change costs O(groups) (O(days) for the monthly
+series) instead of a scan over the filtered rows.
+
+Distinct order counts are additive across days and across the dimensions used
+here because every order has a single purchase timestamp, customer and status.
+Revenue is stored in integer cents so the prefix sums are exact. The distinct
+products of a category are not additive across days, they are estimated from
+the sketches of sketch.py.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import profiling
+
+ORDER_DIMENSIONS = ["customer_city", "customer_state", "order_status"]
+
+
+@dataclass
+class Rollup:
+    """Prefix sums of additive measures per day and dimension value"""
+    first_day: int
+    groups: np.ndarray
+    measures: list
+    prefix: np.ndarray  # shape (days + 1, groups, measures), row 0 is all zeros
+
+    @property
+    def days(self) -> int:
+        return self.prefix.shape[0] - 1
+
+
+def day_numbers(timestamps: pd.Series) -> np.ndarray:
+    """Function: Get the number of days since the epoch of every timestamp"""
+    return timestamps.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+
+
+def to_cents(values: pd.Series) -> np.ndarray:
+    """Function: Get monetary values as integer cents, missing values counting as zero"""
+    return np.round(values.fillna(0).to_numpy(dtype=np.float64) * 100).astype(np.int64)
+
+
+def build_rollup(days: np.ndarray, groups: pd.Series, measures: dict) -> Rollup:
+    """Function: Get the rollup of measures (name -> per row weights, None to count rows) per day and group.
+    Rows with a missing group are left out, as groupby does"""
+    codes, categories = pd.factorize(groups, sort=True)
+    valid = codes >= 0
+    days, codes = days[valid], codes[valid]
+
+    first_day = int(days.min()) if len(days) else 0
+    n_days = int(days.max()) - first_day + 1 if len(days) else 0
+    flat_index = (days - first_day) * len(categories) + codes
+
+    prefix = np.zeros((n_days + 1, len(categories), len(measures)), dtype=np.int64)
+    for i, weights in enumerate(measures.values()):
+        weights = None if weights is None else weights[valid]
+        daily = np.bincount(flat_index, weights=weights, minlength=n_days * len(categories))
+        prefix[1:, :, i] = np.rint(daily).astype(np.int64).reshape(n_days, len(categories)).cumsum(axis=0)
+
+    return Rollup(first_day, np.asarray(categories), list(measures), prefix)
+
+
+@profiling.profiled
+def build_rollups(orders_df: pd.DataFrame, items_df: pd.DataFrame, reviews_df: pd.DataFrame,
+                  first_rows: np.ndarray | None = None) -> dict:
+    """Function: Get the daily rollups of the order customers payments, orders order items products category
+    and order reviews datasets. first_rows flags the first row of every order to count, by default the first
+    row of every order of orders_df"""
+    rollups = {}
+
+    # Distinct orders are counted on one row per order, revenue on every payment row
+    orders_days = day_numbers(orders_df["order_purchase_timestamp"])
+    if first_rows is None:
+        first_rows = ~orders_df["order_id"].duplicated().to_numpy()
+    revenue = to_cents(orders_df["payment_value"])
+    for dimension in ORDER_DIMENSIONS:
+        order_rollup = build_rollup(orders_days[first_rows], orders_df[dimension][first_rows], {"order": None})
+        revenue_rollup = build_rollup(orders_days, orders_df[dimension], {"revenue": revenue})
+        rollups[dimension] = merge_rollups(order_rollup, revenue_rollup)
+
+    rollups["payment_type"] = build_rollup(orders_days, orders_df["payment_type"], {"count": None})
+
+    installments = orders_df["payment_installments"]
+    rollups["use_installment"] = build_rollup(orders_days, (installments > 1).where(installments.notna()),
+                                              {"count": None})
+
+    rollups["product_category"] = build_rollup(day_numbers(items_df["order_purchase_timestamp"]),
+                                               items_df["product_category_name_english"],
+                                               {"revenue": to_cents(items_df["price"])})
+
+    rollups["review_score"] = build_rollup(day_numbers(reviews_df["review_creation_date"]),
+                                           reviews_df["review_score"], {"count": None})
+    return rollups
+
+
+def merge_rollups(left: Rollup, right: Rollup) -> Rollup:
+    """Function: Get one rollup holding the measures of two rollups over the same groups"""
+    first_day = min(left.first_day, right.first_day)
+    last_day = max(left.first_day + left.days, right.first_day + right.days)
+    groups = np.union1d(left.groups, right.groups)
+    prefix = np.zeros((last_day - first_day + 1, len(groups), len(left.measures) + len(right.measures)),
+                      dtype=np.int64)
+
+    offset = 0
+    for rollup in (left, right):
+        columns = slice(offset, offset + len(rollup.measures))
+        group_index = np.searchsorted(groups, rollup.groups)
+        start = rollup.first_day - first_day
+        prefix[start:start + rollup.days + 1, group_index, columns] = rollup.prefix
+        # Past its last day a prefix sum stays at its total
+        prefix[start + rollup.days + 1:, group_index, columns] = rollup.prefix[-1]
+        offset += len(rollup.measures)
+
+    return Rollup(first_day, groups, left.measures + right.measures, prefix)
+
+
+def add_rollups(left: Rollup, right: Rollup) -> Rollup:
+    """Function: Get the rollup of the measures of two rollups added up, such as a rollup and the rollup
+    of a delta. The cost depends on the days and groups of the rollups, not on the rows they summarize"""
+    if right.days == 0 or len(right.groups) == 0:
+        return left
+    if left.days == 0 or len(left.groups) == 0:
+        return right
+    if left.measures != right.measures:
+        raise ValueError("Rollups of measures {} and {} can't be added".format(left.measures, right.measures))
+
+    first_day = min(left.first_day, right.first_day)
+    last_day = max(left.first_day + left.days, right.first_day + right.days)
+    groups = np.union1d(left.groups, right.groups)
+    prefix = np.zeros((last_day - first_day + 1, len(groups), len(left.measures)), dtype=np.int64)
+
+    for rollup in (left, right):
+        # A rollup holding every group is added without gathering its columns
+        group_index = slice(None) if len(rollup.groups) == len(groups) else np.searchsorted(groups, rollup.groups)
+        start = rollup.first_day - first_day
+        prefix[start:start + rollup.days + 1, group_index] += rollup.prefix
+        prefix[start + rollup.days + 1:, group_index] += rollup.prefix[-1]
+
+    return Rollup(first_day, groups, left.measures, prefix)
+
+
+def day_range(rollup: Rollup, start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the prefix rows bounding the timeframe, end_date included"""
+    epoch = datetime.date(1970, 1, 1)
+    start = (start_date - epoch).days - rollup.first_day
+    end = (end_date - epoch).days - rollup.first_day + 1
+    return int(np.clip(start, 0, rollup.days)), int(np.clip(end, 0, rollup.days))
+
+
+def rollup_totals(rollup: Rollup, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the measures of every group over the timeframe"""
+    start, end = day_range(rollup, start_date, end_date)
+    totals = rollup.prefix[end] - rollup.prefix[start]
+    return pd.DataFrame(totals, index=rollup.groups, columns=rollup.measures)
+
+
+@profiling.profiled
+def create_monthly_orders_df(rollups: dict, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the amount and income of delivered orders for each month"""
+    rollup = rollups["order_status"]
+    start, end = day_range(rollup, start_date, end_date)
+    delivered = np.searchsorted(rollup.groups, "delivered")
+    if delivered == len(rollup.groups) or rollup.groups[delivered] != "delivered":
+        return pd.DataFrame({"order_month": [], "order_count": [], "revenue": []})
+
+    # Only the months from the first to the last day with delivered orders are kept, as resample does
+    prefix = rollup.prefix[start:end + 1, delivered, :]
+    active_days = np.flatnonzero(np.diff(prefix[:, 0]))
+    if len(active_days) == 0:
+        return pd.DataFrame({"order_month": [], "order_count": [], "revenue": []})
+    base_day = np.datetime64(rollup.first_day + start, "D")
+    first_day, last_day = base_day + active_days[0], base_day + active_days[-1]
+
+    months = np.arange(first_day.astype("datetime64[M]"), last_day.astype("datetime64[M]") + 1)
+    bounds = np.concatenate([[first_day], months[1:].astype("datetime64[D]"), [last_day + 1]])
+    sums = np.diff(prefix[(bounds - base_day).astype(np.int64)], axis=0)
+
+    return pd.DataFrame({
+        "order_month": pd.DatetimeIndex(months).strftime('%Y-%m'),
+        "order_count": sums[:, 0],
+        "revenue": sums[:, 1] / 100
+    })
+
+
+@profiling.profiled
+def create_customer_order_revenue_df(rollups: dict, dimension: str,
+                                     start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the number of orders and total revenue for each city or state"""
+    result_df = rollup_totals(rollups[dimension], start_date, end_date)
+    result_df = result_df[result_df["order"] > 0].rename_axis(dimension).reset_index()
+    result_df["revenue"] = result_df["revenue"] / 100
+    return result_df.sort_values(by="order", ascending=False)
+
+
+@profiling.profiled
+def create_payment_type_df(rollups: dict, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get payment method type dataframe"""
+    result_df = rollup_totals(rollups["payment_type"], start_date, end_date)["count"]
+    result_df = result_df[result_df > 0].sort_values(ascending=False)
+    return result_df.rename_axis("payment_type").reset_index()
+
+
+@profiling.profiled
+def create_payment_installments_df(rollups: dict, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get dataframe of number of installment users"""
+    result_df = rollup_totals(rollups["use_installment"], start_date, end_date)
+    result_df = result_df[result_df["count"] > 0].rename_axis("use_installment").reset_index()
+    result_df["use_installment"] = result_df["use_installment"].astype(bool)
+    return result_df.sort_values(by="count", ascending=False)
+
+
+@profiling.profiled
+def create_customer_scores_df(rollups: dict, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get customer satisfaction score dataframe"""
+    result_df = rollup_totals(rollups["review_score"], start_date, end_date)["count"]
+    result_df = result_df[result_df > 0].sort_values(ascending=False)
+    result_df = result_df.rename_axis("review_score").reset_index()
+    result_df["satisfaction"] = np.where(result_df["review_score"] >= 4, "satisfied", "not satisfied")
+    return result_df.sort_values(by="review_score", ascending=True)
+
+
+def total_orders_revenue(rollups: dict, start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the number of orders and the total revenue over the timeframe"""
+    totals = rollup_totals(rollups["order_status"], start_date, end_date).sum()
+    return int(totals["order"]), totals["revenue"] / 100
@@ -0,0 +1,99 @@
+"""Dependency-graph scheduler of independent aggregations.
+
+Tasks are declared with the names of the tasks whose results they take as
+arguments. Every task is submitted to a thread pool as soon as its
+dependencies are done, so independent aggregations overlap and the wall time
+of a refresh approaches the time of its longest chain of tasks. Threads share
+the loaded dataframes without copying them, and the numpy and pandas kernels
+doing the work release the GIL for most of their run time.
+"""
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Task:
+    """An aggregation called with its arguments followed by the results of its dependencies"""
+    name: str
+    function: Callable
+    arguments: tuple = ()
+    dependencies: list = field(default_factory=list)
+
+
+def topological_order(tasks: list) -> list:
+    """Function: Get the tasks ordered so that every task comes after its dependencies"""
+    by_name = {task.name: task for task in tasks}
+    if len(by_name) != len(tasks):
+        raise ValueError("Task names must be unique")
+
+    ordered, state = [], {}
+
+    def visit(task: Task, path: tuple) -> None:
+        if state.get(task.name) == "done":
+            return
+        if state.get(task.name) == "visiting":
+            raise ValueError("Dependency cycle: {}".format(" -> ".join(path + (task.name,))))
+        state[task.name] = "visiting"
+        for dependency in task.dependencies:
+            if dependency not in by_name:
+                raise ValueError("Task {!r} depends on unknown task {!r}".format(task.name, dependency))
+            visit(by_name[dependency], path + (task.name,))
+        state[task.name] = "done"
+        ordered.append(task)
+
+    for task in tasks:
+        visit(task, ())
+    return ordered
+
+
+def run_task(task: Task, dependency_results: list, started: float) -> tuple:
+    """Function: Get the result of a task and its timing"""
+    start = time.perf_counter()
+    result = task.function(*task.arguments, *dependency_results)
+    end = time.perf_counter()
+    return result, {
+        "start_seconds": start - started,
+        "seconds": end - start,
+        "thread": threading.current_thread().name
+    }
+
+
+def run_tasks(tasks: list, max_workers: int | None = None) -> tuple[dict, dict]:
+    """Function: Run a task graph on a thread pool, returning the results and the timings of every task.
+    With max_workers=1 the tasks run one after another in dependency order"""
+    ordered = topological_order(tasks)
+    results, timings = {}, {}
+    started = time.perf_counter()
+
+    if max_workers == 1:
+        for task in ordered:
+            results[task.name], timings[task.name] = run_task(
+                task, [results[name] for name in task.dependencies], started)
+    else:
+        pending = list(ordered)
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                thread_name_prefix="aggregation") as executor:
+            running = {}
+            while pending or running:
+                for task in [task for task in pending if all(name in results for name in task.dependencies)]:
+                    pending.remove(task)
+                    future = executor.submit(run_task, task, [results[name] for name in task.dependencies], started)
+                    running[future] = task
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    results[task.name], timings[task.name] = future.result()
+
+    wall_seconds = time.perf_counter() - started
+    for name, timing in timings.items():
+        logger.info("Task %s took %.3f s (started at %.3f s)", name, timing["seconds"], timing["start_seconds"])
+    logger.info("%d tasks took %.3f s wall, %.3f s in total", len(timings), wall_seconds,
+                sum(timing["seconds"] for timing in timings.values()))
+    return results, {"wall_seconds": wall_seconds, "tasks": timings}
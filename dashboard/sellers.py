@@ -0,0 +1,359 @@
+"""Seller performance index.
+
+The order items are joined once to the sellers and to the review scores of
+their orders, and folded into an index keyed by seller:
+
+- The additive measures (revenue in cents, items, orders, review scores,
+  shipped and on-time items) are summed per (seller, day) entry. Entries are
+  sorted by seller then day, with their prefix sums, so the totals of every
+  seller over a timeframe are the difference of two prefix rows found by
+  binary search. A filter change costs O(sellers log entries) whatever the
+  length of the timeframe, and memory grows with the (seller, day) pairs that
+  have sales, not with days x sellers as the dense rollups of rollup.py would
+  with 100k+ sellers.
+- A product counts once per seller over a timeframe, so distinct products are
+  not additive across days. The (seller, product, day) triples are kept
+  sorted by day with the previous day the seller sold the product, and a pair
+  is counted on its first sale within the timeframe: the one whose previous
+  sale is before the start.
+- The drill-down of a seller reads its contiguous entries.
+
+An order with items of several sellers counts as an order of each of them, and
+its review scores count for each of them too. An item ships on time when it
+is handed to the carrier by its shipping limit date.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import loader
+import rollup
+import profiling
+
+ITEM_COLUMNS = [
+    "order_id", "seller_id", "product_id", "price", "order_purchase_timestamp", "shipping_limit_date",
+    "order_delivered_carrier_date"
+]
+REVIEW_COLUMNS = ["order_id", "review_score"]
+MEASURES = ["revenue", "items", "orders", "review_score_sum", "reviews", "shipped", "on_time"]
+
+# Label -> column of the seller totals, highest first
+RANKINGS = {
+    "Revenue": "revenue",
+    "Orders": "orders",
+    "Distinct products": "products",
+    "Average review score": "review_score",
+    "On-time shipping rate": "on_time_rate"
+}
+
+# Sellers need this many reviews or shipped items to be ranked by their average score or on-time rate
+MIN_RANKED_COUNT = 5
+RANKED_COUNTS = {"review_score": "reviews", "on_time_rate": "shipped"}
+
+
+@dataclass
+class SellerIndex:
+    """Daily measures and sold products of every seller"""
+    # seller_id, seller_zip_code_prefix, seller_city, seller_state, sorted on seller_id, the seller codes
+    sellers_df: pd.DataFrame
+    seller_ids: np.ndarray
+    first_day: int
+    days: int
+    keys: np.ndarray  # seller code * days + day - first_day of every entry, ascending
+    prefix: np.ndarray  # (entries + 1, measures) prefix sums of the entries, row 0 is all zeros
+    product_days: np.ndarray  # day - first_day of every (seller, product, day), ascending
+    product_sellers: np.ndarray
+    product_previous_days: np.ndarray  # previous day of the (seller, product), -1 if none
+
+
+def object_values(values: pd.Series) -> np.ndarray:
+    """Function: Get the values of a series as a numpy object array of strings"""
+    return values.astype(object).to_numpy()
+
+
+def lookup(sorted_values: np.ndarray, values: pd.Series) -> np.ndarray:
+    """Function: Get the position of every value, present and not missing, in sorted_values.
+    The categories of a categorical series are looked up once"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return np.searchsorted(sorted_values, object_values(values.cat.categories.to_series()))[values.cat.codes]
+    return np.searchsorted(sorted_values, object_values(values))
+
+
+# Keys of a SellerState pack a code with a day, code * DAY_STRIDE + day, the days since the epoch shifted by
+# DAY_SHIFT to be positive. Triples sorted by day are keyed day * PAIR_STRIDE + id of their (seller, product)
+DAY_SHIFT = 1 << 19
+DAY_STRIDE = 1 << 20
+PAIR_STRIDE = 1 << 40
+
+
+def combine_hashes(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Function: Get the hash of every pair of 64-bit hashes"""
+    return first ^ (second * np.uint64(0x9E3779B97F4A7C15))
+
+
+def insert_sorted(keys: np.ndarray, new_keys: np.ndarray, *columns: tuple) -> tuple:
+    """Function: Get sorted keys with sorted new keys inserted, and every (values, new values) column with its new
+    values inserted at the same positions"""
+    positions = np.searchsorted(keys, new_keys)
+    return (np.insert(keys, positions, new_keys),
+            *(np.insert(values, positions, new_values, axis=0) for values, new_values in columns))
+
+
+def expand_ranges(low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Function: Get the positions of every range [low, high), one range after the other"""
+    counts = high - low
+    return np.repeat(low, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class SellerState:
+    """Sorted arrays the seller index is built from, to which chunks or deltas of the order items and reviews are
+    added without keeping their rows. Adding rows costs a binary search of the arrays for each of them plus one
+    copy of the arrays it inserts into, and building the index costs the prefix sums of the entries, with no
+    regrouping or sorting of the rows already added"""
+
+    def __init__(self, sellers_df: pd.DataFrame):
+        self.sellers_df = sellers_df.drop_duplicates("seller_id")
+        self.seller_ids = np.unique(object_values(self.sellers_df["seller_id"].dropna()))
+        # (seller, day) entries sorted on their key, with the sums of the measures
+        self.entry_keys = np.zeros(0, dtype=np.int64)
+        self.entry_sums = np.zeros((0, len(MEASURES)), dtype=np.int64)
+        # (order, seller) pairs: their sorted hashes, and their order hashes sorted with the entry of their first item
+        self.pair_hashes = np.zeros(0, dtype=np.uint64)
+        self.pair_orders = np.zeros(0, dtype=np.uint64)
+        self.pair_entries = np.zeros(0, dtype=np.int64)
+        # Sum and number of the review scores of every order, sorted on the order hashes
+        self.score_orders = np.zeros(0, dtype=np.uint64)
+        self.score_sums = np.zeros((0, 2), dtype=np.int64)
+        # (seller, product) pairs: their sorted hashes, with their ids in order of arrival
+        self.product_pairs = np.zeros(0, dtype=np.uint64)
+        self.product_pair_ids = np.zeros(0, dtype=np.int64)
+        # (seller, product, day) triples sorted on pair id * DAY_STRIDE + day, and sorted on their day key with
+        # their seller code and the previous day of their pair, -1 if none
+        self.triple_keys = np.zeros(0, dtype=np.int64)
+        self.day_keys = np.zeros(0, dtype=np.int64)
+        self.day_sellers = np.zeros(0, dtype=np.int64)
+        self.day_previous = np.zeros(0, dtype=np.int64)
+
+    def add_sellers(self, seller_ids: np.ndarray) -> None:
+        """Procedure: Add seller ids, renumbering the seller codes of the keys if some are new"""
+        merged_ids = np.union1d(self.seller_ids, seller_ids)
+        if len(merged_ids) == len(self.seller_ids):
+            return
+        codes = np.searchsorted(merged_ids, self.seller_ids)
+        self.entry_keys = codes[self.entry_keys // DAY_STRIDE] * DAY_STRIDE + self.entry_keys % DAY_STRIDE
+        self.pair_entries = codes[self.pair_entries // DAY_STRIDE] * DAY_STRIDE + self.pair_entries % DAY_STRIDE
+        self.day_sellers = codes[self.day_sellers]
+        self.seller_ids = merged_ids
+
+    def add_entries(self, keys: np.ndarray, sums: np.ndarray) -> None:
+        """Procedure: Add the sums of sorted unique entry keys"""
+        positions, found = loader.find_sorted(self.entry_keys, keys)
+        self.entry_sums[positions[found]] += sums[found]
+        self.entry_keys, self.entry_sums = insert_sorted(self.entry_keys, keys[~found], (self.entry_sums, sums[~found]))
+
+    @profiling.profiled
+    def add_items(self, items_df: pd.DataFrame) -> None:
+        """Procedure: Add rows of the orders order items products category dataset"""
+        items_df = items_df.loc[items_df["seller_id"].notna() & items_df["order_purchase_timestamp"].notna(),
+                                ITEM_COLUMNS]
+        self.add_sellers(object_values(items_df["seller_id"].drop_duplicates()))
+        codes = lookup(self.seller_ids, items_df["seller_id"]).astype(np.int64)
+        days = rollup.day_numbers(items_df["order_purchase_timestamp"]) + DAY_SHIFT
+        keys = codes * DAY_STRIDE + days
+        sellers = loader.hash_values(items_df["seller_id"])
+
+        # An order counts once per seller, on its first item, with the review scores of the order
+        orders = loader.hash_values(items_df["order_id"])
+        pairs = combine_hashes(orders, sellers)
+        first_rows = items_df["order_id"].notna().to_numpy() & ~pd.Series(pairs).duplicated().to_numpy() & \
+            ~loader.find_sorted(self.pair_hashes, pairs)[1]
+        self.pair_hashes = insert_sorted(self.pair_hashes, np.sort(pairs[first_rows]))[0]
+        order = np.argsort(orders[first_rows], kind="stable")
+        self.pair_orders, self.pair_entries = insert_sorted(self.pair_orders, orders[first_rows][order],
+                                                            (self.pair_entries, keys[first_rows][order]))
+        positions, found = loader.find_sorted(self.score_orders, orders)
+        scores = np.zeros((len(orders), 2), dtype=np.int64)
+        scored = first_rows & found
+        scores[scored] = self.score_sums[positions[scored]]
+
+        carrier = items_df["order_delivered_carrier_date"].to_numpy(dtype="datetime64[ns]")
+        limit = items_df["shipping_limit_date"].to_numpy(dtype="datetime64[ns]")
+        shipped = ~np.isnat(carrier) & ~np.isnat(limit)
+        weights = {
+            "revenue": rollup.to_cents(items_df["price"]),
+            "items": None,
+            "orders": first_rows,
+            "review_score_sum": scores[:, 0],
+            "reviews": scores[:, 1],
+            "shipped": shipped,
+            "on_time": shipped & (carrier <= limit)
+        }
+        entry_keys, entries = np.unique(keys, return_inverse=True)
+        sums = np.zeros((len(entry_keys), len(MEASURES)), dtype=np.int64)
+        for i, measure in enumerate(MEASURES):
+            sums[:, i] = np.rint(np.bincount(entries, weights=weights[measure], minlength=len(entry_keys)))
+        self.add_entries(entry_keys, sums)
+
+        # Every (seller, product, day) not added before
+        sold = items_df["product_id"].notna().to_numpy()
+        product_pairs = combine_hashes(loader.hash_values(items_df["product_id"])[sold], sellers[sold])
+        new_pairs = np.unique(product_pairs[~loader.find_sorted(self.product_pairs, product_pairs)[1]])
+        self.product_pairs, self.product_pair_ids = insert_sorted(
+            self.product_pairs, new_pairs, (self.product_pair_ids, np.arange(len(new_pairs)) + len(self.product_pairs)))
+        pair_ids = self.product_pair_ids[np.searchsorted(self.product_pairs, product_pairs)]
+        triple_keys, first_triples = np.unique(pair_ids * DAY_STRIDE + days[sold], return_index=True)
+        new_triples = ~loader.find_sorted(self.triple_keys, triple_keys)[1]
+        self.add_triples(triple_keys[new_triples], codes[sold][first_triples][new_triples])
+
+    def add_triples(self, keys: np.ndarray, seller_codes: np.ndarray) -> None:
+        """Procedure: Add sorted new triple keys with the codes of their sellers. The triples following them get
+        their day as the previous day of their pair"""
+        self.triple_keys = insert_sorted(self.triple_keys, keys)[0]
+        positions = np.searchsorted(self.triple_keys, keys)
+        changed = np.union1d(positions, np.minimum(positions + 1, len(self.triple_keys) - 1))
+        pair_ids, days = np.divmod(self.triple_keys[changed], DAY_STRIDE)
+        previous_ids, previous_days = np.divmod(self.triple_keys[np.maximum(changed - 1, 0)], DAY_STRIDE)
+        previous_days = np.where((changed > 0) & (previous_ids == pair_ids), previous_days, -1)
+
+        day_keys = days * PAIR_STRIDE + pair_ids
+        positions, found = loader.find_sorted(self.day_keys, day_keys)
+        self.day_previous[positions[found]] = previous_days[found]
+        order = np.argsort(day_keys[~found])
+        new_sellers = seller_codes[np.searchsorted(keys, self.triple_keys[changed][~found])]
+        self.day_keys, self.day_sellers, self.day_previous = insert_sorted(
+            self.day_keys, day_keys[~found][order], (self.day_sellers, new_sellers[order]),
+            (self.day_previous, previous_days[~found][order]))
+
+    @profiling.profiled
+    def add_reviews(self, reviews_df: pd.DataFrame) -> None:
+        """Procedure: Add rows of the order reviews dataset"""
+        reviews_df = reviews_df.loc[reviews_df["review_score"].notna() & reviews_df["order_id"].notna(),
+                                    REVIEW_COLUMNS]
+        orders, inverse = np.unique(loader.hash_values(reviews_df["order_id"]), return_inverse=True)
+        sums = np.column_stack([
+            np.bincount(inverse, weights=reviews_df["review_score"].to_numpy(dtype=np.float64), minlength=len(orders)),
+            np.bincount(inverse, minlength=len(orders))
+        ]).round().astype(np.int64)
+        positions, found = loader.find_sorted(self.score_orders, orders)
+        self.score_sums[positions[found]] += sums[found]
+        self.score_orders, self.score_sums = insert_sorted(self.score_orders, orders[~found],
+                                                           (self.score_sums, sums[~found]))
+
+        # The scores count for every seller of the order already added
+        low, high = np.searchsorted(self.pair_orders, orders), np.searchsorted(self.pair_orders, orders, side="right")
+        entries = np.searchsorted(self.entry_keys, self.pair_entries[expand_ranges(low, high)])
+        for i, measure in enumerate(["review_score_sum", "reviews"]):
+            np.add.at(self.entry_sums[:, MEASURES.index(measure)], entries, np.repeat(sums[:, i], high - low))
+
+    @profiling.profiled
+    def create_index(self) -> SellerIndex:
+        """Function: Get the seller index of the rows added, with the locations of the sellers dataset"""
+        codes, days = np.divmod(self.entry_keys, DAY_STRIDE)
+        first_day = int(days.min()) if len(days) else DAY_SHIFT
+        n_days = int(days.max()) - first_day + 1 if len(days) else 0
+        prefix = np.zeros((len(self.entry_keys) + 1, len(MEASURES)), dtype=np.int64)
+        prefix[1:] = self.entry_sums.cumsum(axis=0)
+
+        sellers_df = self.sellers_df.set_index(object_values(self.sellers_df["seller_id"])).reindex(self.seller_ids)
+        sellers_df = sellers_df[["seller_zip_code_prefix", "seller_city", "seller_state"]].rename_axis("seller_id"). \
+            reset_index()
+
+        return SellerIndex(
+            sellers_df=sellers_df,
+            seller_ids=self.seller_ids,
+            first_day=first_day - DAY_SHIFT,
+            days=n_days,
+            keys=codes * n_days + days - first_day,
+            prefix=prefix,
+            product_days=self.day_keys // PAIR_STRIDE - first_day,
+            product_sellers=self.day_sellers.copy(),
+            product_previous_days=np.where(self.day_previous >= 0, self.day_previous - first_day, -1)
+        )
+
+
+@profiling.profiled
+def build_seller_index(items_df: pd.DataFrame, reviews_df: pd.DataFrame, sellers_df: pd.DataFrame) -> SellerIndex:
+    """Function: Get the seller index of the orders order items products category dataset, with the review scores
+    of the order reviews dataset and the locations of the sellers dataset"""
+    state = SellerState(sellers_df)
+    state.add_reviews(reviews_df)
+    state.add_items(items_df)
+    return state.create_index()
+
+
+def day_offsets(index: SellerIndex, start_date: datetime.date, end_date: datetime.date) -> tuple[int, int]:
+    """Function: Get the days of the index bounding the timeframe, end_date included"""
+    epoch = datetime.date(1970, 1, 1)
+    start = (start_date - epoch).days - index.first_day
+    end = (end_date - epoch).days - index.first_day + 1
+    return int(np.clip(start, 0, index.days)), int(np.clip(end, 0, index.days))
+
+
+def create_seller_totals_df(index: SellerIndex, start_date: datetime.date, end_date: datetime.date,
+                            codes: np.ndarray | None = None) -> pd.DataFrame:
+    """Function: Get a dataframe of the measures of every seller, or of the sellers of codes, with items sold
+    within the timeframe"""
+    start, end = day_offsets(index, start_date, end_date)
+    codes = np.arange(len(index.seller_ids), dtype=np.int64) if codes is None else np.asarray(codes, dtype=np.int64)
+    bases = codes * index.days
+    totals = index.prefix[np.searchsorted(index.keys, bases + end)] - \
+        index.prefix[np.searchsorted(index.keys, bases + start)]
+
+    low, high = np.searchsorted(index.product_days, [start, end])
+    first_sales = index.product_previous_days[low:high] < start
+    products = np.bincount(index.product_sellers[low:high][first_sales], minlength=len(index.seller_ids))[codes]
+
+    selling = np.flatnonzero(totals[:, MEASURES.index("items")] > 0)
+    result_df = index.sellers_df.iloc[codes[selling]].reset_index(drop=True)
+    for i, measure in enumerate(MEASURES):
+        result_df[measure] = totals[selling, i]
+    result_df["revenue"] = result_df["revenue"] / 100
+    result_df["products"] = products[selling]
+    return add_averages(result_df)
+
+
+def add_averages(totals_df: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get seller or location totals with their average review score and their on-time shipping rate
+    in percent, missing when there is nothing to average"""
+    totals_df["review_score"] = totals_df["review_score_sum"] / totals_df["reviews"].where(totals_df["reviews"] > 0)
+    totals_df["on_time_rate"] = totals_df["on_time"] / totals_df["shipped"].where(totals_df["shipped"] > 0) * 100
+    return totals_df
+
+
+def top_sellers(totals_df: pd.DataFrame, column: str, k: int = 10) -> pd.DataFrame:
+    """Function: Get the k best sellers by column. Averages and rates only rank the sellers with at least
+    MIN_RANKED_COUNT reviews or shipped items"""
+    if column in RANKED_COUNTS:
+        totals_df = totals_df[totals_df[RANKED_COUNTS[column]] >= MIN_RANKED_COUNT]
+    return totals_df.nlargest(k, column).reset_index(drop=True)
+
+
+def create_location_df(totals_df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """Function: Get a dataframe of the sellers and measures of every seller city or state. Orders of several
+    sellers of a location count once per seller, and so do the products they both sold"""
+    result_df = totals_df.groupby(by=column, observed=True).agg(
+        sellers=("seller_id", "size"), **{measure: (measure, "sum") for measure in MEASURES + ["products"]})
+    return add_averages(result_df.reset_index())
+
+
+def find_seller(index: SellerIndex, seller_id: str) -> int | None:
+    """Function: Get the code of a seller, None if it is not in the index"""
+    code = int(np.searchsorted(index.seller_ids, seller_id))
+    return code if code < len(index.seller_ids) and index.seller_ids[code] == seller_id else None
+
+
+def create_seller_monthly_df(index: SellerIndex, code: int, start_date: datetime.date,
+                             end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the orders and revenue of a seller for each month of the timeframe,
+    as main.create_monthly_orders_df"""
+    start, end = day_offsets(index, start_date, end_date)
+    low, high = np.searchsorted(index.keys, [code * index.days + start, code * index.days + end])
+    sums = np.diff(index.prefix[low:high + 1], axis=0)
+    months = (index.keys[low:high] - code * index.days + index.first_day).astype("datetime64[D]"). \
+        astype("datetime64[M]")
+    result_df = pd.DataFrame({
+        "order_month": pd.DatetimeIndex(months).strftime("%Y-%m"),
+        "order_count": sums[:, MEASURES.index("orders")],
+        "revenue": sums[:, MEASURES.index("revenue")] / 100
+    })
+    return result_df.groupby(by="order_month", as_index=False).sum()
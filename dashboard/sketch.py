@@ -0,0 +1,164 @@
+"""Daily HyperLogLog sketches of the non-additive distinct counts.
+
+A product sold on several days is counted once over a timeframe, so distinct
+counts can't be summed from daily counts like the measures of rollup.py. Each
+sketch instead keeps, per day and per value of one dimension, the HyperLogLog
+registers of the keys seen that day: the hash of a key picks one of REGISTERS
+registers, which keeps the highest rank (position of the first 1 bit) of the
+hashes it saw. Registers are merged over a timeframe with a maximum, so a
+filter change reads the sketch entries of the selected days instead of
+hashing every row again.
+
+The relative standard error of an estimate is 1.04 / sqrt(REGISTERS), 1.6%
+with PRECISION 12, so 99.7% of the estimates are within 4.9% of the exact
+count. Small counts use linear counting and are usually exact. Only the
+registers a day actually set are stored, so a sketch never holds more entries
+than rows, nor more than days * groups * REGISTERS.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import loader
+import rollup
+import profiling
+
+# Registers per sketch are 2 ** PRECISION
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+
+# Relative standard error of an estimate
+STANDARD_ERROR = 1.04 / np.sqrt(REGISTERS)
+
+
+@dataclass
+class Sketch:
+    """Non-zero HyperLogLog registers per day and dimension value, sorted on the day"""
+    first_day: int
+    groups: np.ndarray
+    offsets: np.ndarray  # entries of day d are offsets[d]:offsets[d + 1]
+    group_codes: np.ndarray
+    registers: np.ndarray
+    ranks: np.ndarray
+
+    @property
+    def days(self) -> int:
+        return len(self.offsets) - 1
+
+
+def register_ranks(hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Function: Get the register and the rank of every hash. The first PRECISION bits pick the register,
+    the rank is the position of the first 1 bit in the next 32 bits"""
+    registers = (hashes >> np.uint64(64 - PRECISION)).astype(np.int64)
+    remainder = ((hashes << np.uint64(PRECISION)) >> np.uint64(32)).astype(np.float64)
+    # frexp gives the bit length of the remainder, exactly since it fits in 32 bits
+    _, bit_length = np.frexp(remainder)
+    return registers, (33 - bit_length).astype(np.uint8)
+
+
+def build_sketch(days: np.ndarray, groups: pd.Series, keys: pd.Series) -> Sketch:
+    """Function: Get the daily sketch of the distinct keys of every group.
+    Rows with a missing group or key are left out, as groupby and nunique do"""
+    codes, categories = pd.factorize(groups, sort=True)
+    valid = (codes >= 0) & keys.notna().to_numpy()
+    days, codes = days[valid], codes[valid]
+    registers, ranks = register_ranks(loader.hash_values(keys[valid]))
+
+    first_day = int(days.min()) if len(days) else 0
+    n_days = int(days.max()) - first_day + 1 if len(days) else 0
+
+    # Only the highest rank of every (day, group, register) is kept
+    flat_index = ((days - first_day) * len(categories) + codes) * REGISTERS + registers
+    order = np.argsort(flat_index, kind="stable")
+    flat_index, ranks = flat_index[order], ranks[order]
+    starts = np.flatnonzero(np.r_[True, flat_index[1:] != flat_index[:-1]]) if len(flat_index) else \
+        np.zeros(0, dtype=np.int64)
+    flat_index = flat_index[starts]
+    ranks = np.maximum.reduceat(ranks, starts) if len(starts) else ranks
+
+    day_group, registers = np.divmod(flat_index, REGISTERS)
+    entry_days, group_codes = np.divmod(day_group, max(len(categories), 1))
+    return Sketch(
+        first_day=first_day,
+        groups=np.asarray(categories),
+        offsets=np.searchsorted(entry_days, np.arange(n_days + 1)),
+        group_codes=group_codes.astype(np.int32),
+        registers=registers.astype(np.int16),
+        ranks=ranks
+    )
+
+
+def add_sketches(left: Sketch, right: Sketch) -> Sketch:
+    """Function: Get the sketch of the keys of two sketches, such as a sketch and the sketch of a delta.
+    Registers set by both are kept twice, which the maximum of distinct_counts ignores"""
+    if len(right.ranks) == 0:
+        return left
+    if len(left.ranks) == 0:
+        return right
+
+    groups = np.union1d(left.groups, right.groups)
+    first_day = min(left.first_day, right.first_day)
+    entry_days, group_codes = [], []
+    for part in (left, right):
+        entry_days.append(np.repeat(np.arange(part.days), np.diff(part.offsets)) + part.first_day - first_day)
+        group_codes.append(np.searchsorted(groups, part.groups)[part.group_codes])
+    entry_days, group_codes = np.concatenate(entry_days), np.concatenate(group_codes)
+    registers, ranks = np.concatenate([left.registers, right.registers]), np.concatenate([left.ranks, right.ranks])
+
+    # A delta of later days is appended as it is, an older one is merged into place
+    if right.first_day < left.first_day + left.days:
+        order = np.argsort(entry_days, kind="stable")
+        entry_days, group_codes = entry_days[order], group_codes[order]
+        registers, ranks = registers[order], ranks[order]
+
+    days = max(left.first_day + left.days, right.first_day + right.days) - first_day
+    return Sketch(
+        first_day=first_day,
+        groups=groups,
+        offsets=np.searchsorted(entry_days, np.arange(days + 1)),
+        group_codes=group_codes.astype(np.int32),
+        registers=registers,
+        ranks=ranks
+    )
+
+
+@profiling.profiled
+def build_sketches(items_df: pd.DataFrame) -> dict:
+    """Function: Get the daily sketches of the orders order items products category dataset"""
+    return {
+        "product_category": build_sketch(rollup.day_numbers(items_df["order_purchase_timestamp"]),
+                                         items_df["product_category_name_english"], items_df["product_id"])
+    }
+
+
+def estimate_cardinality(registers: np.ndarray) -> np.ndarray:
+    """Function: Get the HyperLogLog estimate of every row of registers"""
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS ** 2 / np.exp2(-registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    # Linear counting is more accurate while many registers are still empty
+    linear = REGISTERS * np.log(REGISTERS / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * REGISTERS) & (zeros > 0), linear, raw)
+
+
+def distinct_counts(sketch: Sketch, start_date: datetime.date, end_date: datetime.date) -> pd.Series:
+    """Function: Get the estimated number of distinct keys of every group seen over the timeframe"""
+    start, end = rollup.day_range(sketch, start_date, end_date)
+    entries = slice(sketch.offsets[start], sketch.offsets[end])
+    group_codes = sketch.group_codes[entries]
+
+    registers = np.zeros((len(sketch.groups), REGISTERS), dtype=np.uint8)
+    np.maximum.at(registers, (group_codes, sketch.registers[entries]), sketch.ranks[entries])
+    seen = np.bincount(group_codes, minlength=len(sketch.groups)) > 0
+    counts = np.rint(estimate_cardinality(registers[seen])).astype(np.int64)
+    return pd.Series(counts, index=sketch.groups[seen])
+
+
+@profiling.profiled
+def create_sum_order_items_df(sketches: dict, rollups: dict,
+                              start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the estimated amount and the income of each product category"""
+    counts = distinct_counts(sketches["product_category"], start_date, end_date)
+    revenue = rollup.rollup_totals(rollups["product_category"], start_date, end_date)["revenue"]
+    result_df = pd.DataFrame({"count": counts, "revenue": revenue.reindex(counts.index, fill_value=0) / 100})
+    return result_df.rename_axis("product_category").reset_index().sort_values(by="count", ascending=False)
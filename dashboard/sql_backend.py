@@ -0,0 +1,219 @@
+"""Optional in-process SQL backend of the dashboard aggregations.
+
+The typed Parquet files of the datasets are registered as views of an
+embedded DuckDB database, and every create_* aggregation is expressed as one
+query returning the same columns as its pandas counterpart, so the charts do
+not change. The engine runs the queries on all cores, reads only the columns
+it needs and skips the row groups outside the timeframe, so the datasets are
+never held in pandas memory.
+
+The backend is chosen with the DASHBOARD_BACKEND environment variable (see
+loader.BACKENDS). DuckDB is not a requirement of the dashboard and is only
+imported when it is installed.
+"""
+import os
+import datetime
+import pandas as pd
+import loader
+import cohorts
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Timeframe filters of the datasets, end excluded
+ORDERS_TIMEFRAME = "order_purchase_timestamp >= $start AND order_purchase_timestamp < $end"
+REVIEWS_TIMEFRAME = "review_creation_date >= $start AND review_creation_date < $end"
+
+
+def is_enabled() -> bool:
+    """Function: Check whether the dashboard is configured to use the SQL backend"""
+    return loader.selected_backend() == "duckdb"
+
+
+def connect(files: dict | None = None, threads: int | None = None) -> "duckdb.DuckDBPyConnection":
+    """Function: Get an in-memory DuckDB connection with a view over the Parquet file of every dataset.
+    files maps dataset names to Parquet files and defaults to the loader caches"""
+    if duckdb is None:
+        raise ImportError("The duckdb backend needs the duckdb package, install it with: pip install duckdb")
+
+    connection = duckdb.connect(database=":memory:")
+    if threads is not None:
+        connection.execute("SET threads = {:d}".format(threads))
+    for name in loader.DATASETS:
+        path = files[name] if files is not None else loader.cached_dataset_file(name)
+        connection.execute("CREATE VIEW {} AS SELECT * FROM read_parquet('{}')".format(
+            name, os.path.abspath(path).replace("'", "''")))
+    return connection
+
+
+def query(connection, sql: str, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the result of a query over the timeframe, end_date included.
+    Every call runs on its own cursor, so one connection can be shared across sessions"""
+    start = datetime.datetime.combine(start_date, datetime.time())
+    parameters = {"start": start, "end": start + datetime.timedelta(days=(end_date - start_date).days + 1)}
+    with connection.cursor() as cursor:
+        return cursor.execute(sql, parameters).df()
+
+
+def date_range(connection) -> tuple:
+    """Function: Get the first and last order purchase timestamps"""
+    with connection.cursor() as cursor:
+        first, last = cursor.execute(
+            "SELECT min(order_purchase_timestamp), max(order_purchase_timestamp) FROM order_customers_payments"
+        ).fetchone()
+    return pd.Timestamp(first), pd.Timestamp(last)
+
+
+def create_monthly_orders_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the amount and income of delivered orders for each month"""
+    return query(connection, """
+        WITH monthly AS (
+            SELECT date_trunc('month', order_purchase_timestamp) AS month,
+                   count(DISTINCT order_id) AS order_count,
+                   coalesce(sum(payment_value), 0) AS revenue
+            FROM order_customers_payments
+            WHERE order_status = 'delivered' AND {}
+            GROUP BY month
+        ), months AS (
+            SELECT unnest(generate_series(min(month), max(month), INTERVAL 1 MONTH)) AS month FROM monthly
+        )
+        SELECT strftime(months.month, '%Y-%m') AS order_month,
+               coalesce(order_count, 0) AS order_count,
+               coalesce(revenue, 0) AS revenue
+        FROM months LEFT JOIN monthly USING (month)
+        ORDER BY months.month
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_sum_order_items_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the amount and income of each product category"""
+    return query(connection, """
+        SELECT product_category_name_english AS product_category,
+               count(DISTINCT product_id) AS count,
+               coalesce(sum(price), 0) AS revenue
+        FROM orders_order_items_products_category
+        WHERE product_category_name_english IS NOT NULL AND {}
+        GROUP BY product_category
+        ORDER BY count DESC, product_category
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_payment_type_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get payment method type dataframe"""
+    return query(connection, """
+        SELECT payment_type, count(*) AS count
+        FROM order_customers_payments
+        WHERE payment_type IS NOT NULL AND {}
+        GROUP BY payment_type
+        ORDER BY count DESC, payment_type
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_payment_installments_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get dataframe of number of installment users"""
+    return query(connection, """
+        SELECT payment_installments > 1 AS use_installment, count(*) AS count
+        FROM order_customers_payments
+        WHERE payment_installments IS NOT NULL AND {}
+        GROUP BY use_installment
+        ORDER BY count DESC
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_customer_order_revenue_df(connection, dimension: str,
+                                     start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get a dataframe of the number of orders and total revenue for each city, state or zip code
+    prefix"""
+    if dimension not in ("customer_city", "customer_state", "customer_zip_code_prefix"):
+        raise ValueError("Unknown dimension {!r}".format(dimension))
+    return query(connection, """
+        SELECT {0}, count(DISTINCT order_id) AS "order", coalesce(sum(payment_value), 0) AS revenue
+        FROM order_customers_payments
+        WHERE {0} IS NOT NULL AND {1}
+        GROUP BY {0}
+        ORDER BY "order" DESC, {0}
+    """.format(dimension, ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_customer_scores_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get customer satisfaction score dataframe"""
+    return query(connection, """
+        SELECT review_score, count(*) AS count,
+               CASE WHEN review_score >= 4 THEN 'satisfied' ELSE 'not satisfied' END AS satisfaction
+        FROM order_reviews
+        WHERE review_score IS NOT NULL AND {}
+        GROUP BY review_score
+        ORDER BY review_score
+    """.format(REVIEWS_TIMEFRAME), start_date, end_date)
+
+
+def create_rfm_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get RFM (Recency, Frequency, Monetary) dataframe"""
+    return query(connection, """
+        WITH timeframe AS (
+            SELECT customer_unique_id, order_id, order_status, order_purchase_timestamp, payment_value
+            FROM order_customers_payments
+            WHERE {}
+        )
+        SELECT customer_unique_id AS customer_id,
+               count(DISTINCT order_id) AS frequency,
+               coalesce(sum(payment_value), 0) AS monetary,
+               date_diff('day', max(order_purchase_timestamp)::DATE,
+                         (SELECT max(order_purchase_timestamp)::DATE FROM timeframe)) AS recency
+        FROM timeframe
+        WHERE order_status = 'delivered' AND customer_unique_id IS NOT NULL
+        GROUP BY customer_unique_id
+        ORDER BY customer_unique_id
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+
+
+def create_cohort_df(connection, start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the cohort retention dataframe of the delivered orders, as cohorts.create_cohort_df"""
+    cells_df = query(connection, """
+        WITH delivered AS (
+            SELECT customer_unique_id, order_id, payment_value,
+                   date_diff('month', DATE '1970-01-01', order_purchase_timestamp::DATE) AS month
+            FROM order_customers_payments
+            WHERE order_status = 'delivered' AND customer_unique_id IS NOT NULL AND {}
+        ), first_months AS (
+            SELECT customer_unique_id, min(month) AS cohort_month
+            FROM delivered
+            GROUP BY customer_unique_id
+        )
+        SELECT cohort_month, month - cohort_month AS age,
+               count(DISTINCT customer_unique_id) AS customers,
+               count(DISTINCT order_id) AS orders,
+               coalesce(sum(payment_value), 0) AS revenue
+        FROM delivered JOIN first_months USING (customer_unique_id)
+        GROUP BY cohort_month, age
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+    return cohorts.create_cohort_cells_df(cells_df)
+
+
+def total_orders_revenue(connection, start_date: datetime.date, end_date: datetime.date) -> tuple:
+    """Function: Get the number of orders and the total revenue over the timeframe"""
+    totals_df = query(connection, """
+        SELECT count(DISTINCT order_id) AS orders, coalesce(sum(payment_value), 0) AS revenue
+        FROM order_customers_payments
+        WHERE order_status IS NOT NULL AND {}
+    """.format(ORDERS_TIMEFRAME), start_date, end_date)
+    return int(totals_df.loc[0, "orders"]), float(totals_df.loc[0, "revenue"])
+
+
+def create_review_messages_df(connection) -> pd.DataFrame:
+    """Function: Get every review with a message, newest first"""
+    with connection.cursor() as cursor:
+        return cursor.execute("""
+            SELECT review_creation_date, review_score, review_comment_title, review_comment_message
+            FROM order_reviews
+            WHERE review_comment_message IS NOT NULL
+            ORDER BY review_creation_date DESC
+        """).df()
+
+
+def select_columns(connection, name: str, columns: list) -> pd.DataFrame:
+    """Function: Get columns of every row of a dataset, to build an index that is kept instead of the rows"""
+    with connection.cursor() as cursor:
+        return cursor.execute("SELECT {} FROM {}".format(", ".join(columns), name)).df()
@@ -0,0 +1,380 @@
+"""Out-of-core streaming aggregation of the dashboard datasets.
+
+The source files are read chunk_size rows at a time and only the columns an
+aggregation needs, and each chunk is folded into mergeable partial aggregates:
+per group sums and maxima, and the distinct orders and products with the
+groups they belong to, from which the exact distinct counts are taken.
+Partials are merged like the runs of a merge sort, so merging costs
+O(n log n) overall, and are finally turned into the same dataframes as the
+create_* functions of main.py.
+
+Peak memory is the size of one chunk plus the size of the partial aggregates,
+which grows with the number of groups and distinct keys (orders, products,
+customers) but not with the number of rows. The datasets are never loaded as a
+whole.
+"""
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import loader
+import rollup
+import cohorts
+import delivery
+import sellers
+from timeframe import timeframe_bounds
+
+# Rows per chunk when none is given, the dashboard passes loader.selected_chunk_size()
+CHUNK_SIZE = loader.DEFAULT_CHUNK_SIZE
+
+# Strings kept in the partial aggregates, stored once in Arrow memory
+KEY_DTYPE = "string[pyarrow]"
+
+ORDER_COLUMNS = [
+    "order_id", "customer_unique_id", "order_status", "order_purchase_timestamp", "customer_city",
+    "customer_state", "customer_zip_code_prefix", "payment_type", "payment_installments", "payment_value"
+]
+ITEM_COLUMNS = ["order_purchase_timestamp", "product_id", "price", "product_category_name_english"]
+REVIEW_COLUMNS = [
+    "review_creation_date", "review_score", "review_comment_title", "review_comment_message"
+]
+
+
+def is_enabled() -> bool:
+    """Function: Check whether the dashboard is configured to use the streaming backend"""
+    return loader.selected_backend() == "streaming"
+
+
+@dataclass
+class Partial:
+    """Mergeable partial aggregate: per group sums and maxima of measures, or distinct keys with their groups"""
+    sums: pd.DataFrame  # measure sums, indexed by group
+    maxima: pd.DataFrame  # measure maxima, indexed by group
+    keys: pd.DataFrame | None = None  # one row per distinct key, with the groups it belongs to
+
+
+def compact(values: pd.Series) -> pd.Series:
+    """Function: Get string and categorical values as Arrow strings, other values unchanged"""
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values.dtype):
+        return values.astype(KEY_DTYPE)
+    return values
+
+
+def fold(groups: pd.Series, sums: dict | None = None, maxima: dict | None = None) -> Partial:
+    """Function: Get the partial aggregate of a chunk per group: the sums of measures (name -> values,
+    None to count rows) and the maxima of measures. Rows with a missing group are left out, as groupby does,
+    and every series must share the index of groups"""
+    sums, maxima = sums or {}, maxima or {}
+    frame = pd.DataFrame({"group": groups})
+    for name, values in sums.items():
+        frame["sum_" + name] = 1 if values is None else values
+    for name, values in maxima.items():
+        frame["max_" + name] = values
+
+    by_group = frame.groupby("group", sort=False, observed=True)
+    sums_df = by_group[["sum_" + name for name in sums]].sum().rename(columns=lambda column: column[4:])
+    maxima_df = by_group[["max_" + name for name in maxima]].max().rename(columns=lambda column: column[4:])
+    sums_df.index = compact(sums_df.index.to_series()).rename("group")
+    maxima_df.index = sums_df.index if len(maxima) else compact(maxima_df.index.to_series()).rename("group")
+    return Partial(sums_df, maxima_df)
+
+
+def fold_keys(keys: pd.Series, groups: dict) -> Partial:
+    """Function: Get the partial aggregate of the distinct keys of a chunk with their groups (name -> values).
+    A key must belong to a single group of each name, as an order has a single status, customer and
+    purchase date, so the distinct keys of any group are counted from one table"""
+    frame = pd.DataFrame({"key": compact(keys), **{name: compact(values) for name, values in groups.items()}})
+    frame = frame[frame["key"].notna()].drop_duplicates(subset="key", ignore_index=True)
+    return Partial(pd.DataFrame(), pd.DataFrame(), frame)
+
+
+def merge_partials(left: Partial, right: Partial) -> Partial:
+    """Function: Get one partial aggregate holding the rows of two partial aggregates"""
+    if left.keys is not None:
+        keys = pd.concat([left.keys, right.keys], ignore_index=True).drop_duplicates(subset="key", ignore_index=True)
+        return Partial(left.sums, left.maxima, keys)
+    return Partial(
+        pd.concat([left.sums, right.sums]).groupby(level=0, sort=False).sum(),
+        pd.concat([left.maxima, right.maxima]).groupby(level=0, sort=False).max()
+    )
+
+
+def push_partial(stack: list, partial, merge=merge_partials) -> None:
+    """Procedure: Add a partial aggregate to a merge stack, merging runs of equal size with merge(older, newer)"""
+    level = 0
+    while stack and stack[-1][0] == level:
+        partial = merge(stack.pop()[1], partial)
+        level += 1
+    stack.append((level, partial))
+
+
+def collapse_stack(stack: list, merge=merge_partials):
+    """Function: Get the merge of every partial aggregate left on a merge stack, None if it is empty"""
+    result = None
+    while stack:
+        partial = stack.pop()[1]
+        result = partial if result is None else merge(partial, result)
+    return result
+
+
+def finalize(partial: Partial | None, columns: list) -> pd.DataFrame:
+    """Function: Get the distinct keys of a keys partial aggregate, or the sums and maxima of every group,
+    with at least the given columns"""
+    if partial is None:
+        return pd.DataFrame(columns=columns)
+    if partial.keys is not None:
+        return partial.keys
+    return partial.sums.join(partial.maxima, how="outer")
+
+
+def count_keys(keys: pd.DataFrame, group: str, groups: pd.Index) -> np.ndarray:
+    """Function: Get the number of distinct keys of each group"""
+    return keys.groupby(group, sort=False).size().reindex(groups, fill_value=0).to_numpy(dtype=np.int64)
+
+
+def batch_to_pandas(batch: pa.RecordBatch) -> pd.DataFrame:
+    """Function: Get an Arrow record batch as a dataframe, strings (dictionary-encoded or not) staying in
+    Arrow memory instead of being converted to Python objects"""
+    columns = [column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+               for column in batch.columns]
+    return pa.Table.from_arrays(columns, names=batch.schema.names).to_pandas(
+        types_mapper={pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}.get)
+
+
+def iter_chunks(path: str, name: str, columns: list, chunk_size: int = CHUNK_SIZE,
+                start_date: datetime.date | None = None, end_date: datetime.date | None = None):
+    """Generator: Read columns of a dataset file chunk_size rows at a time, keeping only the rows within
+    the timeframe. Parquet row groups outside the timeframe are skipped using their statistics, and no
+    batch is read ahead so that a single chunk is held in memory"""
+    spec = loader.DATASETS[name]
+    sort_column = spec["sort_column"]
+    columns = list(dict.fromkeys(columns + [sort_column]))
+    bounds = timeframe_bounds(start_date, end_date) if start_date is not None else None
+
+    if path.endswith(".parquet"):
+        row_filter = None
+        if bounds is not None:
+            row_filter = (ds.field(sort_column) >= pa.scalar(bounds[0])) & \
+                (ds.field(sort_column) < pa.scalar(bounds[1]))
+        chunks = (batch_to_pandas(batch) for batch in ds.dataset(path, format="parquet").to_batches(
+            columns=columns, filter=row_filter, batch_size=chunk_size, batch_readahead=0, fragment_readahead=0))
+    else:
+        chunks = pd.read_csv(path, usecols=columns, chunksize=chunk_size,
+                             dtype={column: dtype for column, dtype in spec["dtypes"].items() if column in columns})
+
+    for chunk in chunks:
+        loader.set_datetime_columns(chunk, [column for column in spec["datetime_columns"] if column in columns])
+        if bounds is not None:
+            timestamps = chunk[sort_column].to_numpy(dtype="datetime64[ns]")
+            chunk = chunk[(timestamps >= bounds[0]) & (timestamps < bounds[1])]
+        if len(chunk):
+            yield chunk
+
+
+def day_numbers(timestamps: pd.Series) -> pd.Series:
+    """Function: Get the number of days since the epoch of every timestamp, keeping the index"""
+    return pd.Series(rollup.day_numbers(timestamps), index=timestamps.index)
+
+
+def fold_orders_chunk(chunk: pd.DataFrame) -> dict:
+    """Function: Get the partial aggregates of a chunk of the order customers payments dataset"""
+    delivered = chunk[chunk["order_status"] == "delivered"]
+    installments = chunk["payment_installments"][chunk["payment_installments"].notna()]
+    month = pd.Series(chunk["order_purchase_timestamp"].to_numpy(dtype="datetime64[ns]").astype("datetime64[M]").
+                      astype("datetime64[ns]"), index=chunk.index)
+    return {
+        "orders": fold_keys(chunk["order_id"], {
+            "order_status": chunk["order_status"],
+            "month": month,
+            "customer_city": chunk["customer_city"],
+            "customer_state": chunk["customer_state"],
+            "customer_zip_code_prefix": chunk["customer_zip_code_prefix"],
+            "customer_unique_id": chunk["customer_unique_id"]
+        }),
+        "monthly": fold(month[delivered.index], {"revenue": delivered["payment_value"]}),
+        "customer_city": fold(chunk["customer_city"], {"revenue": chunk["payment_value"]}),
+        "customer_state": fold(chunk["customer_state"], {"revenue": chunk["payment_value"]}),
+        "customer_zip_code_prefix": fold(chunk["customer_zip_code_prefix"], {"revenue": chunk["payment_value"]}),
+        "order_status": fold(chunk["order_status"], {"revenue": chunk["payment_value"]}),
+        "payment_type": fold(chunk["payment_type"], {"count": None}),
+        "use_installment": fold(installments > 1, {"count": None}),
+        "order_revenue": fold(delivered["order_id"], {"revenue": delivered["payment_value"]}),
+        "customer": fold(delivered["customer_unique_id"], {"monetary": delivered["payment_value"]},
+                         {"last_day": day_numbers(delivered["order_purchase_timestamp"])}),
+        "recent_day": fold(pd.Series(0, index=chunk.index),
+                           maxima={"day": day_numbers(chunk["order_purchase_timestamp"])})
+    }
+
+
+def fold_items_chunk(chunk: pd.DataFrame) -> dict:
+    """Function: Get the partial aggregates of a chunk of the orders order items products category dataset"""
+    return {
+        "products": fold_keys(chunk["product_id"], {"category": chunk["product_category_name_english"]}),
+        "product_category": fold(chunk["product_category_name_english"], {"revenue": chunk["price"]})
+    }
+
+
+def fold_reviews_chunk(chunk: pd.DataFrame) -> dict:
+    """Function: Get the partial aggregates of a chunk of the order reviews dataset"""
+    return {"review_score": fold(chunk["review_score"], {"count": None})}
+
+
+def stream_partials(chunks, fold_chunk) -> dict:
+    """Function: Get the merged partial aggregates of every chunk"""
+    stacks = {}
+    for chunk in chunks:
+        for name, partial in fold_chunk(chunk).items():
+            push_partial(stacks.setdefault(name, []), partial)
+    return {name: collapse_stack(stack) for name, stack in stacks.items()}
+
+
+def create_monthly_orders_df(monthly: pd.DataFrame, orders: pd.DataFrame) -> pd.DataFrame:
+    """Function: Get a dataframe of the amount and income of delivered orders for each month"""
+    if len(monthly) == 0:
+        return pd.DataFrame({"order_month": [], "order_count": [], "revenue": []})
+    months = pd.date_range(monthly.index.min(), monthly.index.max(), freq="MS")
+    return pd.DataFrame({
+        "order_month": months.strftime('%Y-%m'),
+        "order_count": count_keys(orders[orders["order_status"] == "delivered"], "month", months),
+        "revenue": monthly["revenue"].reindex(months, fill_value=0).to_numpy(dtype=np.float64)
+    })
+
+
+def create_group_df(groups: pd.DataFrame, group_column: str, columns: dict, sort_column: str,
+                    ascending: bool = False) -> pd.DataFrame:
+    """Function: Get the finalized aggregates of a dimension as a dataframe sorted on sort_column"""
+    result_df = groups.reindex(columns=list(columns)).rename(columns=columns).rename_axis(group_column).reset_index()
+    return result_df.sort_values(by=sort_column, ascending=ascending, ignore_index=True)
+
+
+def stream_aggregates(start_date: datetime.date, end_date: datetime.date, chunk_size: int = CHUNK_SIZE,
+                      files: dict | None = None) -> dict:
+    """Function: Get every dashboard aggregation over the timeframe by streaming the dataset files.
+    files maps dataset names to CSV or Parquet files and defaults to the loader source files"""
+    files = files or {name: loader.source_path(name) for name in loader.DATASETS}
+
+    def chunks(name: str, columns: list):
+        return iter_chunks(files[name], name, columns, chunk_size, start_date, end_date)
+
+    partials = {
+        **stream_partials(chunks("order_customers_payments", ORDER_COLUMNS), fold_orders_chunk),
+        **stream_partials(chunks("orders_order_items_products_category", ITEM_COLUMNS), fold_items_chunk),
+        **stream_partials(chunks("order_reviews", ["review_score"]), fold_reviews_chunk)
+    }
+    orders = finalize(partials.get("orders"), ["key", "order_status", "month", "customer_city",
+                                               "customer_state", "customer_zip_code_prefix", "customer_unique_id"])
+    products = finalize(partials.get("products"), ["key", "category"])
+    groups = {name: finalize(partials.get(name), columns) for name, columns in {
+        "monthly": ["revenue"], "customer_city": ["revenue"], "customer_state": ["revenue"],
+        "customer_zip_code_prefix": ["revenue"],
+        "order_status": ["revenue"], "payment_type": ["count"], "use_installment": ["count"],
+        "order_revenue": ["revenue"], "customer": ["monetary", "last_day"], "recent_day": ["day"],
+        "product_category": ["revenue"],
+        "review_score": ["count"]
+    }.items()}
+
+    for dimension in ["customer_city", "customer_state", "customer_zip_code_prefix"]:
+        groups[dimension]["order"] = count_keys(orders, dimension, groups[dimension].index)
+    groups["product_category"]["count"] = count_keys(products, "category", groups["product_category"].index)
+
+    customer_scores_df = create_group_df(groups["review_score"], "review_score", {"count": "count"},
+                                         "review_score", ascending=True)
+    customer_scores_df["satisfaction"] = np.where(customer_scores_df["review_score"] >= 4,
+                                                  "satisfied", "not satisfied")
+
+    customers = groups["customer"]
+    rfm_df = pd.DataFrame({
+        "customer_id": customers.index.astype(KEY_DTYPE),
+        "frequency": count_keys(orders[orders["order_status"] == "delivered"], "customer_unique_id",
+                                customers.index),
+        "monetary": customers["monetary"].to_numpy(dtype=np.float64),
+        "recency": (groups["recent_day"]["day"].max() - customers["last_day"]).to_numpy(dtype=np.int64)
+    })
+
+    # Every delivered order once, on the first day of its month, with its revenue
+    delivered_orders = orders[orders["order_status"] == "delivered"]
+    cohort_df = cohorts.create_cohort_df(pd.DataFrame({
+        "customer_unique_id": delivered_orders["customer_unique_id"],
+        "order_id": delivered_orders["key"],
+        "order_purchase_timestamp": delivered_orders["month"],
+        "payment_value": groups["order_revenue"]["revenue"].reindex(delivered_orders["key"]).to_numpy(
+            dtype=np.float64)
+    }))
+
+    return {
+        "total_orders": int(orders["order_status"].notna().sum()),
+        "total_revenue": float(groups["order_status"]["revenue"].sum()),
+        "monthly_orders_df": create_monthly_orders_df(groups["monthly"], orders),
+        "customer_order_revenue_city": create_group_df(groups["customer_city"], "customer_city",
+                                                       {"order": "order", "revenue": "revenue"}, "order"),
+        "customer_order_revenue_state": create_group_df(groups["customer_state"], "customer_state",
+                                                        {"order": "order", "revenue": "revenue"}, "order"),
+        "customer_order_revenue_zip": create_group_df(groups["customer_zip_code_prefix"], "customer_zip_code_prefix",
+                                                      {"order": "order", "revenue": "revenue"}, "order"),
+        "sum_order_items_df": create_group_df(groups["product_category"], "product_category",
+                                              {"count": "count", "revenue": "revenue"}, "count"),
+        "payment_type_df": create_group_df(groups["payment_type"], "payment_type", {"count": "count"}, "count"),
+        "payment_installments_df": create_group_df(groups["use_installment"], "use_installment",
+                                                   {"count": "count"}, "count"),
+        "customer_scores_df": customer_scores_df,
+        "rfm_df": rfm_df.sort_values(by="customer_id", ignore_index=True),
+        "cohort_df": cohort_df
+    }
+
+
+def stream_review_messages(chunk_size: int = CHUNK_SIZE, files: dict | None = None) -> pd.DataFrame:
+    """Function: Get every review with a message, newest first, streaming the reviews file"""
+    path = (files or {}).get("order_reviews") or loader.source_path("order_reviews")
+    messages = [chunk[chunk["review_comment_message"].notna()]
+                for chunk in iter_chunks(path, "order_reviews", REVIEW_COLUMNS, chunk_size)]
+    if not messages:
+        return pd.DataFrame(columns=REVIEW_COLUMNS)
+    return pd.concat(messages, ignore_index=True).sort_values(
+        by="review_creation_date", ascending=False, ignore_index=True)[REVIEW_COLUMNS]
+
+
+def stream_seller_index(sellers_df: pd.DataFrame, chunk_size: int = CHUNK_SIZE,
+                        files: dict | None = None) -> sellers.SellerIndex:
+    """Function: Get the seller index, streaming the reviews then the order items files and adding each chunk to
+    the sorted arrays of the sellers, so that only one chunk of rows is held at a time"""
+    items_name = "orders_order_items_products_category"
+    state = sellers.SellerState(sellers_df)
+    for chunk in iter_chunks((files or {}).get("order_reviews") or loader.source_path("order_reviews"),
+                             "order_reviews", sellers.REVIEW_COLUMNS, chunk_size):
+        state.add_reviews(chunk)
+    for chunk in iter_chunks((files or {}).get(items_name) or loader.source_path(items_name), items_name,
+                             sellers.ITEM_COLUMNS, chunk_size):
+        state.add_items(chunk)
+    return state.create_index()
+
+
+def stream_delivery_sketch(chunk_size: int = CHUNK_SIZE, files: dict | None = None) -> delivery.DeliverySketch:
+    """Function: Get the delivery sketch of the orders, streaming the orders file and adding up the sketches
+    of its chunks like the runs of a merge sort, so that a chunk isn't merged with everything read before it.
+    An order counts on its first row, whichever chunk it is in"""
+    path = (files or {}).get("order_customers_payments") or loader.source_path("order_customers_payments")
+    stack = []
+    # The 64-bit hashes of the orders already counted, sorted, 8 bytes per order
+    seen_orders = np.zeros(0, dtype=np.uint64)
+    for chunk in iter_chunks(path, "order_customers_payments", delivery.ORDER_COLUMNS, chunk_size):
+        hashes = loader.hash_values(chunk["order_id"])
+        _, seen = loader.find_sorted(seen_orders, hashes)
+        first_rows = ~seen & ~pd.Series(hashes).duplicated().to_numpy()
+        seen_orders, = sellers.insert_sorted(seen_orders, np.sort(hashes[first_rows]))
+        push_partial(stack, delivery.build_delivery_sketch(chunk, first_rows), delivery.add_delivery_sketches)
+    result = collapse_stack(stack, delivery.add_delivery_sketches)
+    return result if result is not None else delivery.build_delivery_sketch(
+        pd.DataFrame(columns=delivery.ORDER_COLUMNS))
+
+
+def date_range(chunk_size: int = CHUNK_SIZE, files: dict | None = None) -> tuple:
+    """Function: Get the first and last order purchase timestamps, streaming the orders file"""
+    path = (files or {}).get("order_customers_payments") or loader.source_path("order_customers_payments")
+    first, last = pd.NaT, pd.NaT
+    for chunk in iter_chunks(path, "order_customers_payments", [], chunk_size):
+        timestamps = chunk["order_purchase_timestamp"]
+        first = timestamps.min() if pd.isna(first) else min(first, timestamps.min())
+        last = timestamps.max() if pd.isna(last) else max(last, timestamps.max())
+    return first, last
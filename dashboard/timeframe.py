@@ -0,0 +1,22 @@
+import datetime
+import numpy as np
+import pandas as pd
+import profiling
+
+
+def timeframe_bounds(start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+    """Function: Get the [start, end) timestamps covering every day from start_date to end_date inclusive"""
+    return np.array([start_date, end_date + datetime.timedelta(days=1)], dtype="datetime64[ns]")
+
+
+@profiling.profiled
+def slice_timeframe(dataframe: pd.DataFrame, column: str,
+                    start_date: datetime.date, end_date: datetime.date) -> pd.DataFrame:
+    """Function: Get the rows whose column falls within the timeframe, as a positional slice.
+
+    The dataframe must be sorted on column (missing values last), as the datasets
+    returned by loader.py are. The bounds are found by binary search, so the cost
+    does not depend on the number of rows and the result is a view, not a copy.
+    """
+    start, end = np.searchsorted(dataframe[column].to_numpy(), timeframe_bounds(start_date, end_date), side="left")
+    return dataframe.iloc[start:end]